@@ -81,6 +81,7 @@ fgbg = cv2.createBackgroundSubtractorMOG2(
 )
 
 movement_window = deque(maxlen=config.WINDOW_SIZE)
+window_sum = 0  # running sum of movement_window
 cooldown_frames = 0
 frame_idx = 0
 kernel_small = np.ones(config.MORPH_KERNEL_SMALL, np.uint8)
@@ -138,9 +139,12 @@ try:
                 # upscale contour
                 full_contours.append((c.astype(np.float32) * np.array([sx, sy])).astype(np.int32))
 
-        # Sliding window logic
+        # Sliding window logic (running sum instead of re-summing the window)
+        if len(movement_window) == movement_window.maxlen:
+            window_sum -= movement_window[0]
         movement_window.append(1 if movement_detected else 0)
-        smoothed_movement = sum(movement_window) >= config.THRESHOLD_COUNT
+        window_sum += movement_window[-1]
+        smoothed_movement = window_sum >= config.THRESHOLD_COUNT
 
         if smoothed_movement:
             cooldown_frames = config.COOLDOWN_DURATION
@@ -152,11 +156,11 @@ try:
 
             ts = str(datetime.timedelta(seconds=timestamp_sec))
 
-            print(f"[LIVE] {ts} — MOVEMENT ({sum(movement_window)}/{config.WINDOW_SIZE})")
+            print(f"[LIVE] {ts} — MOVEMENT ({window_sum}/{config.WINDOW_SIZE})")
 
             movement_times.append(ts)
 
-            label = f"FISH MOVEMENT ({sum(movement_window)}/{config.WINDOW_SIZE})"
+            label = f"FISH MOVEMENT ({window_sum}/{config.WINDOW_SIZE})"
             (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 1.5, 3)
 
             cv2.rectangle(frame, (10, 10), (20 + tw, 20 + th + 20), (0, 0, 255), -1)
@@ -1,11 +1,25 @@
-from flask import Flask, Response
 from gpiozero import LED
 from picamzero import Camera
 import threading
 import cv2
+import os
+import sys
 import time
 
-app = Flask(__name__)
+# Reuse the frame ring, stream hub and server from the experiment package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "virtual_stimulation_experiment"))
+from utils.frame_ring import SharedFrameRing
+from utils.pipeline import FrameQueue
+from utils.server import StreamServer
+from utils.streaming import MjpegHub, PreviewEncoder
+
+server = StreamServer()
+hub = MjpegHub("pi")
+# JPEG quality / resolution adapt to encode cost and client throughput
+preview = PreviewEncoder(hub)
+
+# Newest frame waiting for the encoder (only fed while someone watches)
+encode_queue = FrameQueue(1)
 
 # ============================
 # CAMERA SETUP (PicamZero)
@@ -22,65 +36,67 @@ time.sleep(1)  # let colors stabilize
 # ============================
 # SHARED FRAME BUFFER
 # ============================
-latest_frame = None
-lock = threading.Lock()
+# Preallocated shared-memory ring, created on the first frame once the
+# real frame shape is known. Readers get views, not copies.
+ring = None
+ring_ready = threading.Event()
+RING_SLOTS = 8
 
 
 # ============================
 # BACKGROUND CAMERA THREAD
 # ============================
 def camera_thread():
-    global latest_frame
+    global ring
 
     while True:
         frame = cam.capture_array()
-        with lock:
-            latest_frame = frame
-
-
-threading.Thread(target=camera_thread, daemon=True).start()
+        if ring is None:
+            ring = SharedFrameRing(frame.shape, frame.dtype, slots=RING_SLOTS)
+            ring_ready.set()
+        t = time.time()
+        seq = ring.write(frame, t)
+        if hub.subscribers and preview.due(t):
+            encode_queue.put(seq)
 
 
 # ============================
-# MJPEG STREAM GENERATOR
+# JPEG ENCODER (once per frame, shared by all clients)
 # ============================
-def generate_frames():
-    global latest_frame
-
-    # Faster JPEG encoding parameters
-    encode_params = [
-        cv2.IMWRITE_JPEG_QUALITY, 80,          # Quality: 0–100
-        cv2.IMWRITE_JPEG_OPTIMIZE, 1,          # Optimized Huffman tables
-    ]
+def encoder_thread():
+    ring_ready.wait()
+    frame = None
 
     while True:
-        if latest_frame is None:
-            time.sleep(0.005)
+        seq = encode_queue.get()
+        if seq is None:
             continue
 
-        with lock:
-            frame = cv2.cvtColor(latest_frame, cv2.COLOR_RGB2BGR)
+        slot = ring.read(seq)
+        if slot is None:
+            continue  # already overwritten
+        _, view = slot
+        # Convert straight out of the ring slot into the encoder's buffer
+        frame = cv2.cvtColor(view, cv2.COLOR_RGB2BGR, dst=frame)
+        if not ring.is_valid(seq):
+            continue  # camera lapped us mid-conversion
 
-        # Fast JPEG encoding
-        ret, buffer = cv2.imencode(".jpg", frame, encode_params)
-        frame_bytes = buffer.tobytes()
+        preview.encode(seq, frame)
 
-        # MJPEG chunk
-        yield (
-            b"--frame\r\n"
-            b"Content-Type: image/jpeg\r\n\r\n" +
-            frame_bytes + b"\r\n"
-        )
 
-        time.sleep(0.001)   # reduce CPU load slightly
+threading.Thread(target=camera_thread, daemon=True).start()
+threading.Thread(target=encoder_thread, daemon=True).start()
+
+
+# ============================
+# MJPEG STREAM
+# ============================
+server.add_stream(hub)
 
 
-@app.get("/")
-def stream():
-    return Response(
-        generate_frames(),
-        mimetype="multipart/x-mixed-replace; boundary=frame"
-    )
+@server.route("GET", "/")
+async def stream(request, reader, writer):
+    await server.mjpeg(request, writer, hub)
 
 
 # ============================
@@ -88,4 +104,4 @@ def stream():
 # ============================
 if __name__ == "__main__":
     print("🚀 Server running at http://0.0.0.0:5000")
-    app.run(host="0.0.0.0", port=5000, threaded=True, debug=False)
+    server.serve_forever("0.0.0.0", 5000)
@@ -0,0 +1,221 @@
+# batch_analyze.py
+"""
+Re-run movement detection over recorded videos.
+
+Each recording is split into chunks that are analyzed in parallel. Every
+chunk starts `warmup` frames early so its MOG2 model has converged by the
+time its own frames begin; the warm-up frames are discarded. The per-frame
+detection flags are stitched back together and the sliding window /
+cooldown is applied once over the whole timeline (smooth_detections), so
+the result matches a serial pass. Events are written with ExperimentLogger, in the same format
+as a live session.
+
+Usage:
+    python batch_analyze.py output/recording_20251230_132249.mp4
+    python batch_analyze.py output/*.mp4 --workers 8 --chunk-seconds 120
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import config
+from detection import MaskStage, Bout, smooth_detections
+from utils.experiment_logger import ExperimentLogger
+
+
+# --------------------------------------------------
+# Video helpers
+# --------------------------------------------------
+
+def video_info(path):
+    """Return (frame_count, fps, width, height)."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"❌ Could not open {path}")
+
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return n, fps, w, h
+
+
+def load_timestamps(path):
+    """
+    Capture times from the segment's .timestamps.csv: entry i is video
+    frame i. None if there is no such file.
+    """
+    timestamps_path = os.path.splitext(path)[0] + ".timestamps.csv"
+    if not os.path.exists(timestamps_path):
+        return None
+    t = np.loadtxt(timestamps_path, delimiter=",", skiprows=1, usecols=1, ndmin=1)
+    return t if t.size else None
+
+
+def recording_start_time(path):
+    """
+    Capture time of the first frame from the segment's .timestamps.csv,
+    else the wall-clock start parsed from recording_YYYYmmdd_HHMMSS*.mp4,
+    else 0.
+    """
+    t = load_timestamps(path)
+    if t is not None:
+        return float(t[0])
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    parts = stem.split("_")
+    if len(parts) >= 3 and parts[0] == "recording":
+        try:
+            return datetime.strptime(parts[1] + parts[2], "%Y%m%d%H%M%S").timestamp()
+        except ValueError:
+            pass
+    return 0.0
+
+
+def frame_times(path, n_frames, fps):
+    """
+    Capture time of frames 0..n_frames (one past the last, for a bout
+    that runs to the end). The recorder drops frames when it falls behind,
+    so the times come from .timestamps.csv, not frame / fps; fps only
+    fills in when the file is missing or shorter than the video.
+    """
+    times = load_timestamps(path)
+    if times is None:
+        return recording_start_time(path) + np.arange(n_frames + 1) / fps
+    if len(times) < n_frames + 1:
+        extra = times[-1] + np.arange(1, n_frames + 2 - len(times)) / fps
+        times = np.concatenate([times, extra])
+    return times
+
+
+# --------------------------------------------------
+# Chunk worker
+# --------------------------------------------------
+
+def analyze_chunk(path, start, end, warmup, width, height):
+    """
+    Detection flags for frames [start, end) of `path`.
+    Runs in a worker process.
+    """
+    first = max(0, start - warmup)
+
+    cap = cv2.VideoCapture(path)
+    if first > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+
+    mask = MaskStage(width, height)
+    flags = np.zeros(end - start, dtype=bool)
+
+    idx = first
+    while idx < end:
+        ok, frame = cap.read()
+        if not ok:
+            break
+
+        detected, _ = mask.run(frame)
+        if idx >= start:
+            flags[idx - start] = detected
+        idx += 1
+
+    cap.release()
+    return start, flags[: max(0, idx - start)]
+
+
+def detect_flags(path, workers, chunk_frames, warmup):
+    """Per-frame detection flags for the whole video, computed in parallel."""
+    n, fps, w, h = video_info(path)
+
+    if chunk_frames <= 0 or chunk_frames >= n:
+        chunks = [(0, n)]
+    else:
+        chunks = [(s, min(s + chunk_frames, n)) for s in range(0, n, chunk_frames)]
+
+    flags = np.zeros(n, dtype=bool)
+    filled = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = [
+            ex.submit(analyze_chunk, path, s, e, warmup, w, h)
+            for s, e in chunks
+        ]
+        for fut in futures:
+            start, chunk_flags = fut.result()
+            flags[start:start + len(chunk_flags)] = chunk_flags
+            filled = max(filled, start + len(chunk_flags))
+
+    # FRAME_COUNT can overestimate; trust what was actually decoded
+    return flags[:filled], fps
+
+
+# --------------------------------------------------
+# Stitching
+# --------------------------------------------------
+
+def write_events(path, score, onsets, offsets, fps, out_dir):
+    times = frame_times(path, len(score), fps)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    logger = ExperimentLogger(base_dir=out_dir, name=f"reanalysis_{stem}")
+    logger.log_trial_start(t=float(times[0]))
+
+    for start, end in zip(onsets, offsets):
+        bout_scores = score[start:end]
+        bout = Bout(float(times[start]), int(start), int(bout_scores[0]))
+        bout.frames = int(end - start)
+        bout.peak_score = int(bout_scores.max())
+        bout.score_sum = int(bout_scores.sum())
+        bout.offset = float(times[end])
+        bout.offset_frame = int(end)
+
+        logger.log_bout_onset(bout)
+        if logger.frame_events:
+            for i in range(start, end):
+                logger.log_movement(t=float(times[i]), frame=int(i), score=int(score[i]))
+        logger.log_bout_end(bout)
+
+    logger.close()
+    return logger.log_path
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline movement re-analysis of recordings")
+    parser.add_argument("videos", nargs="+", help="recording_*.mp4 files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-seconds", type=float, default=60.0,
+                        help="chunk length; 0 = single serial pass")
+    parser.add_argument("--warmup-frames", type=int, default=config.MOG2_HISTORY * 5,
+                        help="frames decoded before each chunk to settle MOG2")
+    parser.add_argument("--out", default=os.path.join("logs", "reanalysis"),
+                        help="directory for the re-analysis logs")
+    args = parser.parse_args()
+
+    for path in args.videos:
+        _, fps, _, _ = video_info(path)
+        chunk_frames = int(args.chunk_seconds * fps)
+
+        t_start = time.time()
+        flags, fps = detect_flags(path, args.workers, chunk_frames, args.warmup_frames)
+        elapsed = time.time() - t_start
+
+        score, active, onsets, offsets = smooth_detections(flags)
+        log_path = write_events(path, score, onsets, offsets, fps, args.out)
+
+        print(
+            f"🐟 {path}: {len(flags)} frames in {elapsed:.1f}s "
+            f"({len(flags) / max(elapsed, 1e-6):.0f} frames/s), "
+            f"{len(onsets)} bouts / {int(active.sum())} movement frames → {log_path}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# bench_detection.py
+"""
+Microbenchmark: per-frame latency and memory allocated per frame of the
+detection mask work, old chained-ops version vs MaskStage.
+
+    python bench_detection.py
+    python bench_detection.py --frames 500
+
+Frames are synthetic (noisy background + a moving orange blob), so the
+numbers are comparable between machines and runs.
+"""
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import config
+from detection import MaskStage
+
+
+RESOLUTIONS = [(640, 360), (1280, 720)]
+
+
+class LegacyMaskStage:
+    """The original MovementDetector.process mask chain, one temporary per step."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.fgbg = cv2.createBackgroundSubtractorMOG2(
+            history=config.MOG2_HISTORY,
+            varThreshold=config.MOG2_VAR_THRESHOLD,
+            detectShadows=False
+        )
+        self.new_w = int(width * config.SCALE)
+        self.new_h = int(height * config.SCALE)
+        self.kernel_small = np.ones(config.MORPH_KERNEL_SMALL, np.uint8)
+        self.min_area = (self.new_w * self.new_h) * config.AREA_RATIO
+
+    def run(self, frame):
+        small = cv2.resize(frame, (self.new_w, self.new_h))
+
+        motion = self.fgbg.apply(small)
+        motion = cv2.morphologyEx(motion, cv2.MORPH_OPEN, self.kernel_small)
+        motion = cv2.dilate(motion, None, iterations=1)
+
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        color = cv2.inRange(hsv, config.ORANGE_LOW, config.ORANGE_HIGH)
+        color = cv2.medianBlur(color, config.MEDIAN_BLUR_SIZE)
+        color = cv2.morphologyEx(color, cv2.MORPH_CLOSE, self.kernel_small)
+
+        combined = cv2.bitwise_and(motion, color)
+        contours, _ = cv2.findContours(combined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        detected = False
+        full_contours = []
+        sx = self.width / self.new_w
+        sy = self.height / self.new_h
+        for c in contours:
+            if cv2.contourArea(c) > self.min_area:
+                detected = True
+                full_contours.append((c.astype(np.float32) * np.array([sx, sy])).astype(np.int32))
+        return detected, full_contours
+
+
+def synthetic_frames(width, height, n, seed=0):
+    rng = np.random.default_rng(seed)
+    bg = rng.integers(20, 60, (height, width, 3), dtype=np.uint8)
+    bw, bh = width // 9, height // 9
+
+    frames = []
+    for i in range(n):
+        f = bg + rng.integers(0, 4, bg.shape, dtype=np.uint8)
+        x = (i * width // 90) % (width - bw)
+        y = height // 3 + int(height / 8 * np.sin(i / 10))
+        f[y:y + bh, x:x + bw] = (10, 100, 230)
+        frames.append(f)
+    return frames
+
+
+def bench(stage, frames, warmup):
+    for f in frames[:warmup]:
+        stage.run(f)
+
+    latencies = []
+    transient = []
+    results = []
+
+    tracemalloc.start()
+    for f in frames[warmup:]:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+
+        t0 = time.perf_counter()
+        results.append(stage.run(f)[0])
+        latencies.append(time.perf_counter() - t0)
+
+        _, peak = tracemalloc.get_traced_memory()
+        transient.append(peak - base)
+    tracemalloc.stop()
+
+    # Latency without tracemalloc overhead
+    clean = []
+    for f in frames[warmup:]:
+        t0 = time.perf_counter()
+        stage.run(f)
+        clean.append(time.perf_counter() - t0)
+
+    return np.array(clean) * 1000, np.array(transient) / 1024, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection mask microbenchmark")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'resolution':>11} {'version':>8} {'mean ms':>8} {'p95 ms':>7} {'KiB/frame':>10}")
+    for w, h in RESOLUTIONS:
+        frames = synthetic_frames(w, h, args.frames + args.warmup)
+
+        flags = {}
+        for label, stage in (("legacy", LegacyMaskStage(w, h)), ("engine", MaskStage(w, h))):
+            ms, kib, flags[label] = bench(stage, frames, args.warmup)
+            print(
+                f"{w:>5}x{h:<5} {label:>8} {ms.mean():8.2f} "
+                f"{np.percentile(ms, 95):7.2f} {kib.mean():10.1f}"
+            )
+
+        if flags["legacy"] != flags["engine"]:
+            print("⚠️  Warning: detection results differ between versions")
+
+
+if __name__ == "__main__":
+    main()
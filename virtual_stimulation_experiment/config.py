@@ -11,6 +11,18 @@ SCALE = 0.6
 # Movement area ratio
 AREA_RATIO = 0.001
 
+# Region of interest in full-frame pixels (only this part is processed)
+#   None                        → whole frame
+#   (x, y, w, h)                → bounding box
+#   [(x1, y1), (x2, y2), ...]   → polygon (cropped to its bounding box, then masked)
+ROI = None
+
+# Adaptive ROI: after a detection, only look at a padded box around the
+# last contours; go back to the whole ROI every N frames or when the fish is lost
+ADAPTIVE_ROI = False
+ADAPTIVE_ROI_PAD = 40          # pixels (full frame) around the last contours
+ADAPTIVE_ROI_FULL_EVERY = 30   # frames
+
 # Color (HSV) for orange fish
 ORANGE_LOW  = (0, 50, 40)
 ORANGE_HIGH = (28, 255, 255)
@@ -30,12 +42,28 @@ THRESHOLD_COUNT = 12
 # Cooldown frames
 COOLDOWN_DURATION = 3
 
+# Where the per-frame mask work runs:
+#   "local"   → inline in the frame loop
+#   "process" → DetectionPool worker processes (one sticky worker per camera)
+DETECTION_BACKEND = "local"
+DETECTION_WORKERS = None  # None = one per CPU core
+# Seconds to wait for a pool worker's result before counting the frame as
+# "no movement" and checking that the worker is still alive
+DETECTION_TIMEOUT = 2.0
+
 # ============================
 # LED Config
 # ============================
 LED_COM_PORT = "COM3" 
 LED_BAUDRATE = 115200
 
+# "lines"  → firmware that switches on ON / OFF lines; the host times the blink
+# "framed" → firmware that plays a whole pattern from one framed command and
+#            acknowledges with its own timestamps (utils/led_protocol.py)
+LED_PROTOCOL = "lines"
+LED_ACK_TIMEOUT = 0.5    # seconds to wait for the device to acknowledge a command
+LED_SYNC_INTERVAL = 10   # seconds between host ↔ device clock re-syncs
+
 # LED blinking timing parameters
 STIM_INTERVAL = 5     # every 5 seconds start blinking
 BLINK_ON = 0.3
@@ -44,8 +72,199 @@ BLINK_COUNT = 3
 STIM_RESPONSE_WINDOW = 3       # fish has 2 seconds to respond
 STIM_RESPONSE_WINDOW_START_DELAY = 1.0  # after LED blink
 
+# Stimulus protocol (utils/scheduler.py). None = every STIM_INTERVAL s, or:
+#   {"type": "fixed", "interval": 5}
+#   {"type": "jitter", "interval": 5, "jitter": 1.5, "seed": 1}    uniform 3.5–6.5 s
+#   {"type": "blocks", "blocks": [[5, 2.0], [5, 8.0]], "rest": 30, "repeat": 3}
+# A finished protocol ends the trial. Per tank: "protocol" in TANKS.
+STIM_PROTOCOL = None
+
+# The scheduler sleeps until this many seconds before a stimulus is due,
+# then polls the clock (yielding the GIL between reads) to hit the exact time
+SCHEDULER_SPIN = 0.006
+
 # ============================
 # Windows Stimulator API Config
 # ============================
 STIM_TRIG_BASE_URL = "http://172.20.10.2:5555/stim"
-MAKE_SOUND_URL = "http://172.20.10.2:5555/make_sound"
\ No newline at end of file
+MAKE_SOUND_URL = "http://172.20.10.2:5555/make_sound"
+
+# Brain stimulator driver (stim/stim.py): None → closed-loop triggers are
+# only printed, "deuteron" → DeuteronStimulator.dll, "mock" → recorded
+STIM_DRIVER = None
+STIM_FREQ_HZ = 917000000
+STIM_COMMAND_TIMEOUT = 5.0   # seconds to wait for the driver to finish a command
+
+# Pulse train fired on a closed-loop trigger (Kobayashi fish parameters)
+STIM_PULSE = {
+    "first_electrode": 1,
+    "second_electrode": 2,
+    "phase_width": 0.0015,    # s
+    "pulse_period": 0.01,     # s
+    "amplitude": 0.000180,    # A (180 µA)
+    "pulse_count": 50,
+}
+
+# Every command is checked against these before it reaches the driver
+STIM_MAX_AMPLITUDE = 0.000200   # A (200 µA)
+STIM_MAX_PULSE_COUNT = 1000
+
+# ============================
+# Frame Pipeline Config
+# ============================
+# Queue policies: "drop_oldest" (never blocks the producer) or "block"
+DETECT_QUEUE_SIZE = 2
+DETECT_QUEUE_POLICY = "drop_oldest"
+
+ENCODE_QUEUE_SIZE = 1
+ENCODE_QUEUE_POLICY = "drop_oldest"
+
+# The recorder drops (and counts) frames rather than stall detection;
+# recordings carry per-frame timestamps, so gaps keep correct timing
+RECORD_QUEUE_SIZE = 60
+RECORD_QUEUE_POLICY = "drop_oldest"
+
+# Live preview (MJPEG). Frames are only JPEG-encoded while someone watches,
+# once per frame per width in use. Clients pick a width with ?width=N (mapped
+# to the largest allowed width ≤ N; None = full preview resolution) and are
+# capped at ?fps=N, default STREAM_MAX_FPS.
+STREAM_WIDTHS = (None, 640, 320)
+STREAM_MAX_FPS = 30
+STREAM_JPEG_QUALITY = 80
+
+# The preview is the detector's downscaled ROI image (SCALE) with the
+# detections drawn on, not the full frame. The encoder keeps its share of
+# one CPU core under STREAM_CPU_BUDGET by lowering JPEG quality (down to
+# STREAM_MIN_QUALITY), then resolution (down to STREAM_MIN_SCALE), and
+# raises them again when comfortably under budget.
+STREAM_CPU_BUDGET = 0.10
+STREAM_MIN_QUALITY = 40
+STREAM_MIN_SCALE = 0.4
+
+# H.264 / RTP output for remote monitoring (utils/rtp_stream.py): one ffmpeg
+# encode per tank, sent to RTP_HOST (a multicast group such as 239.255.0.1
+# serves any number of viewers). Tank i sends to port RTP_PORT + 2*i and
+# writes <name>.sdp to its output directory for viewers to open.
+RTP_ENABLED = False
+RTP_HOST = "127.0.0.1"
+RTP_PORT = 5000
+RTP_WIDTH = 640          # None = full camera resolution
+RTP_BITRATE = "1M"
+RTP_QUEUE_SIZE = 2
+
+# Streaming / control server (utils/server.py). Localhost only by default:
+# the POST routes change a running experiment. To reach it from the lab
+# network set SERVER_HOST = "0.0.0.0" and a SERVER_TOKEN; POSTs then need
+# "Authorization: Bearer <token>". Without a token, a server listening
+# beyond localhost refuses every POST.
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 5000
+SERVER_TOKEN = None
+# Live "score" events per second per tank on the /events WebSocket
+EVENT_SCORE_RATE = 5
+
+# Shared-memory frame ring. Must be larger than the number of frames that
+# can be in flight at once: everything the queues above can hold, plus
+# headroom for the frame each stage is working on and the one capture is
+# writing. Stages still re-check a frame after reading it (tank.py).
+FRAME_RING_HEADROOM = 8
+FRAME_RING_SLOTS = (
+    DETECT_QUEUE_SIZE + ENCODE_QUEUE_SIZE + RECORD_QUEUE_SIZE + RTP_QUEUE_SIZE
+    + FRAME_RING_HEADROOM
+)
+
+# ============================
+# Recording Config
+# ============================
+# Recordings are split into segments; a new one starts after this many
+# seconds or megabytes, whichever comes first (None = no limit)
+RECORD_SEGMENT_SECONDS = 600
+RECORD_SEGMENT_MB = 1024
+
+# OpenCV fourcc, e.g. "mp4v", "avc1" (needs an H.264-enabled OpenCV), "MJPG"
+RECORD_FOURCC = "mp4v"
+# 0-100 where the codec supports it (e.g. MJPG), None = codec default
+RECORD_QUALITY = None
+
+# "full"  → record every frame
+# "clips" → only record CLIP_PRE_ROLL s before to CLIP_POST_ROLL s after each
+#           stimulation / reaction (overlapping clips are merged). The
+#           pre-roll is held in RAM: pre_roll * fps * frame size * 1.25
+RECORD_MODE = "full"
+CLIP_PRE_ROLL = 5
+CLIP_POST_ROLL = 10
+
+
+# ============================
+# Multi-Tank Config (multi_tank.py)
+# ============================
+# One entry per camera/tank. Optional keys:
+#   resolution      → (w, h), default (640, 360)
+#   stim_interval   → seconds between stimuli, default STIM_INTERVAL
+#   stim_offset     → delay of the first stimulus. Default: from the protocol,
+#                     plus stim_interval * i / len(TANKS) for the i-th tank, so
+#                     tanks sharing the LED and sound don't come due together
+#   protocol        → stimulus protocol (same format as STIM_PROTOCOL)
+#   roi             → per-tank ROI (same format as ROI), default ROI
+#   led_port        → this tank's own LED stimulator, with its own actuator
+#                     threads. Tanks without one share LED_COM_PORT, and a
+#                     stimulus landing on another tank's blink follows
+#                     LED_OVERLAP_POLICY (logged as STIMULATION_SKIPPED if
+#                     merged or rejected).
+TANKS = [
+    {"name": "tank1", "camera_index": 0},
+    {"name": "tank2", "camera_index": 1},
+]
+
+# Print per-tank FPS every N seconds
+STATUS_INTERVAL = 10
+
+# Per-frame latency tracing (utils/tracing.py): camera read → detection
+# sub-stages → behavior → stimulus trigger. Histograms at GET /metrics, a
+# Chrome / Perfetto trace at GET /trace and in logs/trace_<ts>.json at
+# shutdown. Can also be switched at runtime (POST /trace/start|stop).
+# Off, a trace point is one attribute check.
+TRACE_ENABLED = False
+TRACE_MAX_EVENTS = 200000      # newest spans kept for the trace file
+
+
+# ============================
+# Source / Actuator Backends
+# ============================
+# "live" (USB webcam), "synthetic" (rendered fish) or "video" (replay a file)
+CAMERA_SOURCE = "live"
+
+SYNTHETIC_FPS = 30
+SYNTHETIC_SEED = 0
+SYNTHETIC_SPONTANEOUS_RATE = 0.05  # spontaneous swim bouts per second
+
+VIDEO_SOURCE_PATH = None
+VIDEO_SOURCE_REALTIME = True       # False = replay as fast as possible
+
+# "hardware" (serial LED, winsound, stimulator) or "mock" (records call times)
+ACTUATOR_BACKEND = "hardware"
+
+# What happens to a blink / beep requested while the previous one is still
+# playing: "queue" (played afterwards), "merge" (absorbed by the running one,
+# so the later stimulus is skipped) or "reject" (dropped, also skipped).
+# The LED and sound are shared by every tank without its own "led_port", so
+# "queue" makes sure each tank's stimulus plays. Stimulator triggers are
+# always queued.
+LED_OVERLAP_POLICY = "queue"
+SOUND_OVERLAP_POLICY = "queue"
+
+
+# ============================
+# Experiment Log Config
+# ============================
+# Events are queued and written by a background thread in batches:
+# whichever comes first, N queued events or T seconds since the last flush
+LOG_FLUSH_EVENTS = 256
+LOG_FLUSH_INTERVAL = 1.0
+
+# Movements are logged as bouts (onset / offset). Set True to also log a
+# record for every frame with movement (large logs in long sessions).
+LOG_FRAME_EVENTS = False
+
+# Live statistics: "recent" numbers cover the last N reactions / bouts
+STATS_WINDOW = 50
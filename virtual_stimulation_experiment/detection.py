@@ -2,10 +2,72 @@
 import cv2
 import numpy as np
 from collections import deque
+from concurrent.futures import TimeoutError as FuturesTimeout
 import config
+from utils.tracing import tracer, NULL_TRACE
 
-class MovementDetector:
-    def __init__(self, width, height):
+
+def parse_roi(roi, width, height):
+    """
+    Normalize a config ROI to (x, y, w, h, polygon).
+
+    roi is None (whole frame), an (x, y, w, h) box, or a list of (x, y)
+    polygon points. Polygons are cropped to their bounding box and the
+    polygon itself is returned (shifted into the box) for masking.
+    """
+    if roi is None:
+        return 0, 0, width, height, None
+
+    if len(roi) == 4 and all(np.isscalar(v) for v in roi):
+        x, y, w, h = (int(v) for v in roi)
+        polygon = None
+    else:
+        pts = np.asarray(roi, dtype=np.int32).reshape(-1, 2)
+        x, y, w, h = cv2.boundingRect(pts)
+        polygon = pts
+
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(width, x + w), min(height, y + h)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"ROI {roi} does not overlap a {width}x{height} frame")
+
+    if polygon is not None:
+        polygon = polygon - np.array([x0, y0], dtype=np.int32)
+    return x0, y0, x1 - x0, y1 - y0, polygon
+
+
+def roi_mask(polygon, roi_w, roi_h, new_w, new_h):
+    """
+    Polygon mask (255 inside) for the ROI crop resized to new_w x new_h,
+    or None for a box ROI. polygon is as returned by parse_roi.
+    """
+    if polygon is None:
+        return None
+
+    mask = np.zeros((new_h, new_w), np.uint8)
+    small_poly = (polygon / np.array([roi_w / new_w, roi_h / new_h])).astype(np.int32)
+    cv2.fillPoly(mask, [small_poly], 255)
+    return mask
+
+
+class MaskStage:
+    """
+    The per-frame image work: MOG2 + color mask + contours.
+
+    Holds the MOG2 background model, so one instance must see every frame
+    of its camera/region in order. Runs either inline in MovementDetector
+    or inside a DetectionPool worker process.
+
+    Work is restricted to config.ROI. With config.ADAPTIVE_ROI the color,
+    morphology and contour steps further shrink to a padded box around the
+    last detection; MOG2 always sees the whole ROI so its background model
+    stays intact.
+
+    All intermediate images are preallocated once and written with dst=,
+    so a frame costs no full-size allocations.
+    """
+
+    def __init__(self, width, height, roi=None):
         self.width = width
         self.height = height
 
@@ -15,49 +77,178 @@ class MovementDetector:
             detectShadows=False
         )
 
-        self.movement_window = deque(maxlen=config.WINDOW_SIZE)
-        self.cooldown_frames = 0
+        roi = config.ROI if roi is None else roi
+        self.rx, self.ry, self.rw, self.rh, polygon = parse_roi(roi, width, height)
 
-        self.new_w = int(width * config.SCALE)
-        self.new_h = int(height * config.SCALE)
+        self.new_w = int(self.rw * config.SCALE)
+        self.new_h = int(self.rh * config.SCALE)
         self.kernel_small = np.ones(config.MORPH_KERNEL_SMALL, np.uint8)
 
-        self.min_area = (self.new_w * self.new_h) * config.AREA_RATIO
+        # Area threshold stays relative to the whole (scaled) frame so a
+        # fish is the same size in pixels whatever ROI is used
+        self.min_area = (int(width * config.SCALE) * int(height * config.SCALE)) * config.AREA_RATIO
+
+        self.sx = self.rw / self.new_w
+        self.sy = self.rh / self.new_h
+
+        self.roi_mask = roi_mask(polygon, self.rw, self.rh, self.new_w, self.new_h)
+
+        # Adaptive window state (small-image coordinates)
+        self.adaptive = config.ADAPTIVE_ROI
+        self.pad_x = int(config.ADAPTIVE_ROI_PAD / self.sx)
+        self.pad_y = int(config.ADAPTIVE_ROI_PAD / self.sy)
+        self.full_every = config.ADAPTIVE_ROI_FULL_EVERY
+        self.last_box = None
+        self.frames_since_full = 0
+
+        # How far the color result at a pixel depends on its neighbours:
+        # median blur radius + close (dilate then erode) radius
+        kx, ky = config.MORPH_KERNEL_SMALL
+        self.color_pad = config.MEDIAN_BLUR_SIZE // 2 + 2 * (max(kx, ky) // 2) + 1
 
-    def process(self, frame):
-        """Returns: (movement_active, contour_list, movement_score)"""
+        self._scale = np.array([self.sx, self.sy], np.float32)
+        self._origin = np.array([self.rx, self.ry], np.float32)
+        self._alloc_buffers()
 
-        small = cv2.resize(frame, (self.new_w, self.new_h))
+    def _window(self):
+        """Part of the small image to run the color/contour steps on."""
+        full = (0, 0, self.new_w, self.new_h)
+        if not self.adaptive or self.last_box is None or self.frames_since_full >= self.full_every:
+            self.frames_since_full = 0
+            return full
 
-        # Motion
-        motion = self.fgbg.apply(small)
-        motion = cv2.morphologyEx(motion, cv2.MORPH_OPEN, self.kernel_small)
-        motion = cv2.dilate(motion, None, iterations=1)
+        self.frames_since_full += 1
+        x, y, w, h = self.last_box
+        return (
+            max(0, x - self.pad_x),
+            max(0, y - self.pad_y),
+            min(self.new_w, x + w + self.pad_x),
+            min(self.new_h, y + h + self.pad_y),
+        )
+
+    def _alloc_buffers(self):
+        """Every intermediate image, allocated once for this resolution."""
+        h, w = self.new_h, self.new_w
+        self._small = np.empty((h, w, 3), np.uint8)
+        self._hsv = np.empty((h, w, 3), np.uint8)
+        self._motion_raw = np.empty((h, w), np.uint8)
+        self._motion_open = np.empty((h, w), np.uint8)
+        self._motion = np.empty((h, w), np.uint8)
+        self._color_raw = np.empty((h, w), np.uint8)
+        self._color_blur = np.empty((h, w), np.uint8)
+        self._color = np.empty((h, w), np.uint8)
+        self._combined = np.empty((h, w), np.uint8)
+
+    @property
+    def small(self):
+        """The most recent resized (ROI) frame. Overwritten by the next run()."""
+        return self._small
+
+    def run(self, frame, trace=NULL_TRACE):
+        """
+        Returns: (detected, contour_list) with contours in full-frame coordinates
+
+        `trace` (see utils/tracing.py) gets one mark per sub-stage.
+        """
+
+        crop = frame[self.ry:self.ry + self.rh, self.rx:self.rx + self.rw]
+        small = cv2.resize(crop, (self.new_w, self.new_h), dst=self._small)
+        trace.mark("resize")
+
+        # Motion (always the whole ROI — MOG2 needs a fixed-size image)
+        motion = self.fgbg.apply(small, fgmask=self._motion_raw)
+        trace.mark("mog2")
+
+        x0, y0, x1, y1 = self._window()
+        motion = cv2.morphologyEx(
+            motion[y0:y1, x0:x1], cv2.MORPH_OPEN, self.kernel_small,
+            dst=self._motion_open[y0:y1, x0:x1]
+        )
+        motion = cv2.dilate(motion, None, dst=self._motion[y0:y1, x0:x1], iterations=1)
+        trace.mark("motion_morph")
+
+        # Only pixels that moved can end up in the combined mask, so the
+        # color stages run on the motion bounding box (plus enough margin
+        # for the blur / close to see the same neighbours). On a still
+        # frame they are skipped entirely.
+        mx, my, mw, mh = cv2.boundingRect(motion)
+        if mw == 0 or mh == 0:
+            self.last_box = None
+            return False, []
+        mx += x0
+        my += y0
+
+        cx0, cy0 = max(0, mx - self.color_pad), max(0, my - self.color_pad)
+        cx1 = min(self.new_w, mx + mw + self.color_pad)
+        cy1 = min(self.new_h, my + mh + self.color_pad)
 
         # Color
-        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
-        color = cv2.inRange(hsv, config.ORANGE_LOW, config.ORANGE_HIGH)
-        color = cv2.medianBlur(color, config.MEDIAN_BLUR_SIZE)
-        color = cv2.morphologyEx(color, cv2.MORPH_CLOSE, self.kernel_small)
+        hsv = cv2.cvtColor(
+            small[cy0:cy1, cx0:cx1], cv2.COLOR_BGR2HSV, dst=self._hsv[cy0:cy1, cx0:cx1]
+        )
+        color = cv2.inRange(
+            hsv, config.ORANGE_LOW, config.ORANGE_HIGH, dst=self._color_raw[cy0:cy1, cx0:cx1]
+        )
+        color = cv2.medianBlur(
+            color, config.MEDIAN_BLUR_SIZE, dst=self._color_blur[cy0:cy1, cx0:cx1]
+        )
+        color = cv2.morphologyEx(
+            color, cv2.MORPH_CLOSE, self.kernel_small, dst=self._color[cy0:cy1, cx0:cx1]
+        )
+        trace.mark("color")
 
-        # Combined
-        combined = cv2.bitwise_and(motion, color)
-        contours, _ = cv2.findContours(combined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Combined, over the motion box only (everything outside is 0)
+        m = motion[my - y0:my - y0 + mh, mx - x0:mx - x0 + mw]
+        c = color[my - cy0:my - cy0 + mh, mx - cx0:mx - cx0 + mw]
+        combined = cv2.bitwise_and(m, c, dst=self._combined[my:my + mh, mx:mx + mw])
+        if self.roi_mask is not None:
+            combined = cv2.bitwise_and(
+                combined, self.roi_mask[my:my + mh, mx:mx + mw], dst=combined
+            )
+        contours, _ = cv2.findContours(
+            combined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(mx, my)
+        )
 
         detected = False
         full_contours = []
-        sx = self.width / self.new_w
-        sy = self.height / self.new_h
+        kept = []
 
         for c in contours:
             if cv2.contourArea(c) > self.min_area:
                 detected = True
-                full = (c.astype(np.float32) * np.array([sx, sy])).astype(np.int32)
+                kept.append(c)
+                full = (c.astype(np.float32) * self._scale + self._origin).astype(np.int32)
                 full_contours.append(full)
 
-        # sliding window smoothing
-        self.movement_window.append(1 if detected else 0)
-        score = sum(self.movement_window)
+        # Fish lost → next frame goes back to the whole ROI
+        self.last_box = cv2.boundingRect(np.vstack(kept)) if kept else None
+        trace.mark("contours")
+
+        return detected, full_contours
+
+
+class MovementSmoother:
+    """
+    Sliding-window vote + cooldown over per-frame detection flags.
+    smooth_detections() is the same computation over a whole array.
+    """
+
+    def __init__(self):
+        self.movement_window = deque(maxlen=config.WINDOW_SIZE)
+        self.window_sum = 0
+        self.cooldown_frames = 0
+
+    def update(self, detected):
+        """Returns: (movement_active, movement_score)"""
+
+        # sliding window smoothing (running sum, O(1) per frame)
+        if len(self.movement_window) == self.movement_window.maxlen:
+            self.window_sum -= self.movement_window[0]
+        flag = 1 if detected else 0
+        self.movement_window.append(flag)
+        self.window_sum += flag
+
+        score = self.window_sum
         smoothed = score >= config.THRESHOLD_COUNT
 
         # cooldown logic
@@ -68,4 +259,183 @@ class MovementDetector:
 
         movement_active = smoothed or self.cooldown_frames > 0
 
+        return movement_active, score
+
+
+def smooth_detections(detections, min_area=None, window=None, threshold=None, cooldown=None):
+    """
+    Batch version of MovementSmoother for offline analysis.
+
+    `detections` is an array of per-frame flags, or of per-frame contour
+    areas together with `min_area`. Window, threshold and cooldown default
+    to config values.
+
+    Returns: (score, movement_active, onsets, offsets) where score and
+    movement_active are per-frame arrays identical to what the streaming
+    path produces, and onsets/offsets are the frame indices where movement
+    bouts start / end (offset exclusive).
+    """
+    window = config.WINDOW_SIZE if window is None else window
+    threshold = config.THRESHOLD_COUNT if threshold is None else threshold
+    cooldown = config.COOLDOWN_DURATION if cooldown is None else cooldown
+
+    detections = np.asarray(detections)
+    if min_area is not None:
+        flags = detections > min_area
+    else:
+        flags = detections.astype(bool)
+
+    n = len(flags)
+    idx = np.arange(1, n + 1)
+
+    # Sliding window sum via cumsum (partial window at the start, like the deque)
+    csum = np.concatenate(([0], np.cumsum(flags, dtype=np.int64)))
+    score = csum[idx] - csum[np.maximum(idx - window, 0)]
+    smoothed = score >= threshold
+
+    # Cooldown keeps movement active for COOLDOWN_DURATION - 1 frames after
+    # the last smoothed frame, i.e. while any of the last `cooldown` frames
+    # was smoothed
+    if cooldown <= 1:
+        movement_active = smoothed
+    else:
+        ssum = np.concatenate(([0], np.cumsum(smoothed, dtype=np.int64)))
+        movement_active = (ssum[idx] - ssum[np.maximum(idx - cooldown, 0)]) > 0
+
+    edges = np.diff(np.concatenate(([0], movement_active.astype(np.int8), [0])))
+    onsets = np.flatnonzero(edges == 1)
+    offsets = np.flatnonzero(edges == -1)
+
+    return score, movement_active, onsets, offsets
+
+
+class Bout:
+    """One contiguous stretch of movement_active frames (offset exclusive)."""
+
+    __slots__ = (
+        "onset", "onset_frame", "offset", "offset_frame",
+        "frames", "peak_score", "score_sum", "reaction",
+    )
+
+    def __init__(self, onset, onset_frame, score, reaction=False):
+        self.onset = onset
+        self.onset_frame = onset_frame
+        self.offset = None
+        self.offset_frame = None
+        self.frames = 1
+        self.peak_score = score
+        self.score_sum = score
+        self.reaction = reaction
+
+    @property
+    def duration(self):
+        return None if self.offset is None else self.offset - self.onset
+
+    @property
+    def mean_score(self):
+        return self.score_sum / self.frames
+
+
+class BoutTracker:
+    """
+    Turns the per-frame (movement_active, score) stream into bouts, the
+    streaming counterpart of the onsets/offsets from smooth_detections().
+    """
+
+    def __init__(self):
+        self.current = None
+
+    def update(self, t, frame, movement_active, score):
+        """
+        Returns: (started, ended) — the Bout that starts on this frame and
+        the Bout that ended on it (its offset is this frame), or None.
+        """
+        started = ended = None
+        bout = self.current
+
+        if movement_active:
+            if bout is None:
+                started = self.current = Bout(t, frame, score)
+            else:
+                bout.frames += 1
+                bout.score_sum += score
+                if score > bout.peak_score:
+                    bout.peak_score = score
+        elif bout is not None:
+            ended = self.finish(t, frame)
+
+        return started, ended
+
+    def finish(self, t, frame):
+        """Close the open bout (if any) at time t, e.g. when the experiment stops."""
+        bout = self.current
+        if bout is not None:
+            bout.offset = t
+            bout.offset_frame = frame
+            self.current = None
+        return bout
+
+
+class MovementDetector:
+    """
+    Per-camera movement detector.
+
+    By default the mask work runs inline. Pass a DetectionPool (see
+    detection_pool.py) to run it in a worker process instead; the sliding
+    window and cooldown always stay here, so the results are identical.
+    """
+
+    def __init__(self, width, height, pool=None, key=None, ring=None, roi=None):
+        self.width = width
+        self.height = height
+
+        self.pool = pool
+        self.key = key if key is not None else id(self)
+        if pool is None:
+            self.mask = MaskStage(width, height, roi)
+        else:
+            self.mask = None
+            pool.register(self.key, width, height, ring, roi)
+
+        self.smoother = MovementSmoother()
+
+    def process(self, frame, seq=None):
+        """
+        Returns: (movement_active, contour_list, movement_score)
+
+        `seq` is the frame's ring sequence number; with a pool backend it
+        lets the worker read the frame from shared memory instead of
+        receiving a pickled copy.
+        """
+
+        trace = tracer.begin("detect", seq)
+        if self.pool is None:
+            detected, full_contours = self.mask.run(frame, trace)
+        else:
+            # Sub-stages run in the worker process; only the round trip is traced
+            try:
+                detected, full_contours = self.pool.submit(self.key, frame, seq).result(
+                    config.DETECTION_TIMEOUT
+                )
+            except FuturesTimeout:
+                # Never block the frame loop on a hung / dead worker
+                print(f"⚠️  Warning: [{self.key}] detection worker timed out on frame {seq}")
+                self.pool.check_workers()
+                detected, full_contours = False, []
+            trace.mark("pool")
+
+        movement_active, score = self.smoother.update(detected)
+        trace.mark("smooth")
+
         return movement_active, full_contours, score
+
+    def preview_source(self):
+        """
+        (small image, origin, scale) of the last frame: the downscaled ROI
+        the mask ran on, where full = small * scale + origin. None when the
+        mask runs in a pool worker (the image lives in the other process).
+        The image is overwritten by the next process() — copy it.
+        """
+        if self.mask is None:
+            return None
+        return self.mask.small, self.mask._origin, self.mask._scale
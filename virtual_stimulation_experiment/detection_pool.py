@@ -0,0 +1,287 @@
+# detection_pool.py
+import itertools
+import multiprocessing as mp
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+import config
+from detection import MaskStage
+from utils.frame_ring import SharedFrameRing
+
+
+def _worker_main(requests, results):
+    """
+    Worker process loop. Owns one MaskStage (and therefore one MOG2 model)
+    per key routed to it, so background state never crosses processes.
+
+    `results` is this worker's own pipe back to the pool; a "ready" message
+    tells the pool it has started.
+    """
+    stages = {}
+    rings = {}
+    results.send(("ready", None, None))
+
+    while True:
+        msg = requests.get()
+        kind = msg[0]
+
+        if kind == "stop":
+            break
+
+        if kind == "register":
+            _, key, width, height, ring_spec, roi = msg
+            stages[key] = MaskStage(width, height, roi)
+            if ring_spec is not None:
+                rings[key] = SharedFrameRing.attach(**ring_spec)
+            continue
+
+        _, key, token, payload = msg
+        try:
+            if kind == "seq":
+                res = rings[key].read(payload)
+                if res is None:
+                    # Capture lapped the ring before we got here
+                    results.send((token, None, "frame overwritten before detection"))
+                    continue
+                frame = res[1]
+            else:
+                frame = payload
+
+            detected, contours = stages[key].run(frame)
+            if kind == "seq" and not rings[key].is_valid(payload):
+                # Capture reused the slot while we were reading it: a torn frame
+                results.send((token, None, "frame overwritten during detection"))
+                continue
+            results.send((token, (detected, contours), None))
+
+        except Exception as e:
+            results.send((token, None, repr(e)))
+
+    for ring in rings.values():
+        ring.close()
+    results.close()
+
+
+class DetectionPool:
+    """
+    Runs MaskStage work in worker processes, one sticky worker per key
+    (camera or region). Frames of a key are always handled by the same
+    worker in submission order, which keeps its MOG2 model consistent.
+
+    A worker that dies (OOM, a crash in native code) or hangs (no result
+    for its oldest frame within `timeout` s) is restarted with its keys
+    registered again (their MOG2 models start over); the frames it still
+    had resolve as "no movement" instead of hanging. Every worker has its
+    own request queue and result pipe, so a worker killed mid-write can
+    only break the channels that are replaced with it.
+    """
+
+    # How often the result collector checks that the workers are alive
+    CHECK_INTERVAL = 0.5
+
+    def __init__(self, workers=None, timeout=config.DETECTION_TIMEOUT):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+
+        self._ctx = mp.get_context("spawn")
+        self._requests = [None] * self.workers
+        self._results = [None] * self.workers
+        self._procs = [None] * self.workers
+        self._ready = [None] * self.workers     # when each worker reported in
+        self._retired = []                      # result pipes of replaced workers
+        self._lock = threading.Lock()
+        for i in range(self.workers):
+            self._start_worker(i)
+
+        self._assignment = {}
+        self._ring_keys = set()
+        self._load = [0] * self.workers
+        self._registrations = [[] for _ in range(self.workers)]   # replayed on restart
+        self._futures = {}          # token → (future, worker index, submit time)
+        self._tokens = itertools.count(1)
+        self._restart_lock = threading.Lock()
+        self._closing = False
+        self.restarts = 0
+
+        self._collector = threading.Thread(target=self._collect, name="detect-results", daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, idx):
+        """Start worker `idx` on fresh channels (call under _lock once running)."""
+        q = self._ctx.Queue()
+        recv, send = self._ctx.Pipe(duplex=False)
+        p = self._ctx.Process(
+            target=_worker_main,
+            args=(q, send),
+            name=f"detect-{idx}",
+            daemon=True,
+        )
+        p.start()
+        send.close()    # only the worker writes, so its exit shows up as EOF
+        self._requests[idx] = q
+        self._results[idx] = recv
+        self._procs[idx] = p
+        self._ready[idx] = None
+
+    def _oldest_pending(self):
+        """Worker index → submit time of its oldest unanswered frame."""
+        oldest = {}
+        with self._lock:
+            for _, idx, t in self._futures.values():
+                if t < oldest.get(idx, float("inf")):
+                    oldest[idx] = t
+        return oldest
+
+    def check_workers(self):
+        """
+        Restart dead workers, and workers that have had a frame unanswered
+        for longer than `timeout` since they started; their pending frames
+        resolve as "no movement".
+        """
+        with self._restart_lock:
+            oldest = self._oldest_pending()
+            now = time.monotonic()
+            for idx, p in enumerate(self._procs):
+                if self._closing:
+                    return
+
+                # A worker still starting up (spawn, imports) isn't hung
+                hung = False
+                if idx in oldest and self._ready[idx] is not None:
+                    waited = now - max(oldest[idx], self._ready[idx])
+                    hung = waited > self.timeout
+                if p.is_alive() and not hung:
+                    continue
+
+                if p.is_alive():
+                    reason = f"hung (no result for {waited:.1f} s)"
+                    p.terminate()
+                    p.join(timeout=1)
+                    if p.is_alive():
+                        p.kill()
+                        p.join(timeout=1)
+                else:
+                    reason = f"died (exit code {p.exitcode})"
+
+                with self._lock:
+                    lost = [t for t, (_, i, _) in self._futures.items() if i == idx]
+                    futures = [self._futures.pop(t)[0] for t in lost]
+                    old = self._requests[idx]
+                    self._retired.append(self._results[idx])
+                    self._start_worker(idx)
+                    for msg in self._registrations[idx]:
+                        self._requests[idx].put(msg)
+                self.restarts += 1
+
+                # Whatever was still queued for the old worker is gone with it
+                old.cancel_join_thread()
+                old.close()
+
+                print(
+                    f"⚠️  Warning: detection worker {idx} {reason}; "
+                    f"restarted, {len(futures)} frame(s) lost"
+                )
+                for fut in futures:
+                    fut.set_result((False, []))
+
+    def register(self, key, width, height, ring=None, roi=None):
+        """Pin `key` to the least loaded worker and create its MaskStage there."""
+        with self._lock:
+            if key in self._assignment:
+                raise ValueError(f"Detection key already registered: {key}")
+
+            idx = self._load.index(min(self._load))
+            self._assignment[key] = idx
+            self._load[idx] += 1
+            if ring is not None:
+                self._ring_keys.add(key)
+
+            ring_spec = ring.spec() if ring is not None else None
+            msg = ("register", key, width, height, ring_spec, roi)
+            self._registrations[idx].append(msg)
+            self._requests[idx].put(msg)
+
+    def submit(self, key, frame, seq=None):
+        """
+        Queue one frame for `key`. Returns a Future resolving to
+        (detected, contour_list). If `seq` is given and the key was
+        registered with a ring, only the sequence number crosses the
+        process boundary.
+        """
+        fut = Future()
+        token = next(self._tokens)
+        if seq is not None and key in self._ring_keys:
+            msg = ("seq", key, token, seq)
+        else:
+            msg = ("frame", key, token, frame)
+
+        # Under the lock: check_workers() swaps in (and closes the old)
+        # request queue of a restarted worker. put() only hands the message
+        # to the queue's feeder thread, so it doesn't hold the lock for long.
+        with self._lock:
+            idx = self._assignment[key]
+            self._futures[token] = (fut, idx, time.monotonic())
+            self._requests[idx].put(msg)
+        return fut
+
+    def _collect(self):
+        last_check = time.monotonic()
+        exited = set()      # result pipes at EOF, until their worker is replaced
+
+        while not self._closing:
+            with self._lock:
+                # Only this thread waits on the pipes, so it closes the old ones
+                for conn in self._retired:
+                    conn.close()
+                    exited.discard(conn)
+                self._retired = []
+                conns = {c: i for i, c in enumerate(self._results) if c not in exited}
+
+            for conn in wait(list(conns), timeout=self.CHECK_INTERVAL):
+                try:
+                    token, result, error = conn.recv()
+                except (EOFError, OSError):
+                    # The worker is gone: check it now rather than at the next interval
+                    exited.add(conn)
+                    last_check = 0
+                    continue
+
+                if token == "ready":
+                    self._ready[conns[conn]] = time.monotonic()
+                    continue
+                self._resolve(token, result, error)
+
+            # Also while the workers keep the results coming
+            if time.monotonic() - last_check >= self.CHECK_INTERVAL:
+                self.check_workers()
+                last_check = time.monotonic()
+
+    def _resolve(self, token, result, error):
+        with self._lock:
+            fut = self._futures.pop(token, (None,))[0]
+        if fut is None:
+            return
+
+        if error is not None:
+            # Treat a failed frame as "no movement" rather than killing
+            # the frame loop; the window/cooldown absorb a single miss.
+            print(f"⚠️  Warning: detection worker error: {error}")
+            fut.set_result((False, []))
+        else:
+            fut.set_result(result)
+
+    def close(self):
+        self._closing = True
+        for q in self._requests:
+            q.put(("stop",))
+        for p in self._procs:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
+
+        self._collector.join(timeout=2)
+        for conn in self._results + self._retired:
+            conn.close()
@@ -0,0 +1,245 @@
+# loadtest.py
+"""
+End-to-end load test without hardware.
+
+Runs N tanks on SyntheticCamera sources with mock LED / sound / stimulator
+devices; every tank has its own LED, like a rig with one LED per tank.
+On every stimulation the synthetic fish of that tank starts
+swimming after --reaction-delay seconds, so the measured stimulus →
+reaction latency minus that delay is the detection latency of the
+pipeline. Runs the same on any Linux box.
+
+    python loadtest.py --seconds 60
+    python loadtest.py --tanks 8 --resolution 1280x720 --backend process
+    python loadtest.py --rtp    # also stream H.264 to a loopback receiver
+    python loadtest.py --trace  # per-stage latency histograms + trace.json
+    python loadtest.py --led framed   # LED on a fake serial device (pty)
+    python loadtest.py --stim-driver  # brain triggers through the stimulator service
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import config
+import utils.general_utils as general_utils
+from detection_pool import DetectionPool
+from tank import Tank
+from stim.stim import MockDriver, StimulatorService
+from utils.devices import BrainStimulator, MockLed, SerialLed, make_devices
+from utils.led_protocol import FakeLedDevice, FramedSerialLed
+from utils.rtp_stream import RtpReceiver
+from utils.scheduler import StimulusScheduler
+from utils.sources import SyntheticCamera
+from utils.tracing import tracer
+
+
+def blink_timing_errors(edges, on_s, off_s):
+    """|actual − requested| of every on time and every gap inside a blink pattern (s)."""
+    errors = []
+    for (t0, on0), (t1, on1) in zip(edges, edges[1:]):
+        dt = (t1 - t0) / 1e6
+        if on0 and not on1:
+            errors.append(abs(dt - on_s))
+        elif on1 and not on0 and dt < 1.5 * off_s:   # longer: the next stimulus
+            errors.append(abs(dt - off_s))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hardware-free end-to-end load test")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--tanks", type=int, default=1)
+    parser.add_argument("--resolution", default="640x360")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--backend", choices=("local", "process"), default=config.DETECTION_BACKEND)
+    parser.add_argument("--stim-interval", type=float, default=config.STIM_INTERVAL)
+    parser.add_argument("--reaction-delay", type=float, default=1.2,
+                        help="seconds from stimulus to synthetic swim onset")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record-mode", choices=("full", "clips"), default=config.RECORD_MODE)
+    parser.add_argument("--rtp", action="store_true",
+                        help="stream every tank over RTP/H.264 to a loopback receiver")
+    parser.add_argument("--trace", action="store_true",
+                        help="trace per-frame latency; writes trace.json to --out")
+    parser.add_argument("--led", choices=("mock", "lines", "framed"), default="mock",
+                        help="LED backend: recording mock, or a fake serial device "
+                             "speaking ON / OFF lines or the framed pattern protocol")
+    parser.add_argument("--stim-driver", action="store_true",
+                        help="fire STIM_PULSE trains on the mock stimulator driver thread")
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "biobots_loadtest"))
+    args = parser.parse_args()
+
+    w, h = (int(v) for v in args.resolution.lower().split("x"))
+
+    if args.trace:
+        tracer.enable()
+
+    devices = make_devices("mock")
+    fake_leds = []
+    stim_driver = None
+    if args.stim_driver:
+        stim_driver = MockDriver(realtime=True)
+        devices.stimulator = BrainStimulator(StimulatorService(stim_driver))
+    general_utils.set_devices(devices)
+
+    pool = DetectionPool(config.DETECTION_WORKERS) if args.backend == "process" else None
+    scheduler = StimulusScheduler()
+
+    tanks = []
+    receivers = {}
+    for i in range(args.tanks):
+        cam = SyntheticCamera(
+            resolution=(w, h),
+            framerate=args.fps,
+            seed=args.seed + i,
+            ring_slots=config.FRAME_RING_SLOTS,
+        )
+        name = f"tank{i + 1}"
+        if args.led == "mock":
+            led = MockLed()
+        else:
+            fake_leds.append(FakeLedDevice())
+            fake_leds[-1].start()
+            led_class = FramedSerialLed if args.led == "framed" else SerialLed
+            led = led_class(fake_leds[-1].port, config.LED_BAUDRATE)
+
+        tank = Tank(
+            name,
+            cam,
+            pool=pool,
+            log_dir=os.path.join(args.out, "logs", name),
+            output_dir=os.path.join(args.out, "output", name),
+            stim_interval=args.stim_interval,
+            record_mode=args.record_mode,
+            rtp_port=config.RTP_PORT + 2 * i if args.rtp else None,
+            actuators=general_utils.make_tank_actuators(led=led),
+        )
+        if args.rtp:
+            receivers[name] = RtpReceiver(config.RTP_PORT + 2 * i)
+            receivers[name].start()
+
+        # The fish "reacts" to its own tank's stimulus
+        def on_event(event, cam=cam):
+            if event["event"] == "stimulation":
+                cam.trigger_swim(args.reaction_delay)
+
+        tank.add_event_listener(on_event)
+        tanks.append(tank)
+
+    print(f"🐟 {args.tanks} synthetic tank(s) at {w}x{h}@{args.fps}, detection backend: {args.backend}")
+
+    for i, tank in enumerate(tanks):
+        tank.start()
+        # Stagger tanks so their stimuli don't all land on the same frame
+        offset = args.stim_interval * (1 + i / max(1, len(tanks)))
+        tank.schedule(scheduler, offset)
+    scheduler.start()
+
+    try:
+        time.sleep(args.seconds)
+    except KeyboardInterrupt:
+        pass
+
+    scheduler.stop()
+    live = {tank.name: tank.stats() for tank in tanks}
+    for tank in tanks:
+        tank.stop()
+    if pool is not None:
+        pool.close()
+    general_utils.close_devices()
+    for fake_led in fake_leds:
+        fake_led.stop()
+    time.sleep(0.5)  # let the last RTP packets arrive
+    for receiver in receivers.values():
+        receiver.stop()
+
+    # --------------------------------------------------
+    # Report
+    # --------------------------------------------------
+    print("-" * 60)
+    for tank in tanks:
+        s = live[tank.name]
+        mean_rt, median_rt, n_rt = tank.logger.reactions.stats()
+        line = (
+            f"[{tank.name}] capture {s['capture_fps']:.1f} FPS, detect {s['detect_fps']:.1f} FPS, "
+            f"dropped {s['dropped']}, recorded {s['recording']['frames']} frames, "
+            f"reactions {n_rt}/{tank.logger.total_stimulations}"
+        )
+        if n_rt:
+            line += (
+                f", stimulus→reaction median {median_rt * 1000:.0f} ms "
+                f"(detection latency {(median_rt - args.reaction_delay) * 1000:.0f} ms)"
+            )
+        print(line)
+
+        if tank.name in receivers:
+            r = receivers[tank.name].stats()
+            print(
+                f"[{tank.name}] RTP: sent {s['rtp']['frames']} frames, received {r['frames']} "
+                f"({r['keyframes']} keyframes, {r['packets']} packets, {r['lost']} lost, "
+                f"{8 * r['bytes'] / args.seconds / 1000:.0f} kbit/s)"
+            )
+
+    if args.trace:
+        print("-" * 60)
+        for name, m in tracer.metrics()["spans"].items():
+            print(
+                f"{name:28s} n={m['count']:6d}  p50 {m['p50_ms']:7.2f} ms  "
+                f"p95 {m['p95_ms']:7.2f} ms  p99 {m['p99_ms']:7.2f} ms"
+            )
+        print(f"Trace written to {tracer.dump(os.path.join(args.out, 'trace.json'))}")
+
+    late = scheduler.stats().get("lateness_ms")
+    if late:
+        print(
+            f"Scheduler: {scheduler.fired} stimuli, lateness mean {late['mean']:.3f} ms, "
+            f"p99 {late['p99']:.3f} ms, max {late['max']:.3f} ms"
+        )
+
+    # Summed over the tanks' actuator services
+    for channel in ("led", "sound", "stimulator"):
+        per_tank = [live[tank.name]["actuators"][channel] for tank in tanks]
+        late = [a for a in per_tank if "latency_ms" in a]
+        if not late:
+            continue
+        executed = sum(a["executed"] for a in per_tank)
+        mean = sum(a["executed"] * a["latency_ms"]["mean"] for a in late) / max(1, executed)
+        print(
+            f"Actuator {channel}: {executed} run, {sum(a['merged'] for a in per_tank)} merged, "
+            f"{sum(a['rejected'] for a in per_tank)} rejected, command latency mean {mean:.3f} ms, "
+            f"max {max(a['latency_ms']['max'] for a in late):.3f} ms"
+        )
+
+    if not fake_leds:
+        flashes = sum(len(tank.actuators.devices.led.times("on")) for tank in tanks)
+    else:
+        flashes = sum(on for fake_led in fake_leds for _, on in fake_led.edges)
+        errors = [
+            e for fake_led in fake_leds
+            for e in blink_timing_errors(fake_led.edges, config.BLINK_ON, config.BLINK_OFF)
+        ]
+        if errors:
+            errors.sort()
+            print(
+                f"LED ({args.led}): blink timing error median {1000 * errors[len(errors) // 2]:.3f} ms, "
+                f"max {1000 * errors[-1]:.3f} ms over {len(errors)} intervals"
+            )
+
+    if stim_driver is None:
+        triggers = len(devices.stimulator.times("trigger"))
+    else:
+        triggers = len(stim_driver.times("fire"))
+        s = devices.stimulator.service.stats()
+        if "fire_ms" in s:
+            print(f"Stimulator: {s['fired']} pulse trains, driver call mean {s['fire_ms']['mean']:.1f} ms")
+
+    print(
+        f"Mock devices: {flashes} LED flashes, "
+        f"{len(devices.sound.times('beep'))} sounds, "
+        f"{triggers} brain stimulus triggers"
+    )
+
+
+if __name__ == "__main__":
+    main()
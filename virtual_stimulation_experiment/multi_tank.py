@@ -0,0 +1,92 @@
+import time
+import threading
+
+from detection_pool import DetectionPool
+from tank import Tank, camera_from_config, tank_dirs
+import config
+from utils.server import register_tank, start_server
+from utils.scheduler import StimulusScheduler
+import utils.general_utils as general_utils
+from utils.tracing import tracer
+
+
+def main():
+    # --------------------------------------------------
+    # Init: one Tank per entry in config.TANKS, sharing one
+    # detection pool and one stimulus scheduler
+    # --------------------------------------------------
+    pool = None
+    if config.DETECTION_BACKEND == "process":
+        pool = DetectionPool(config.DETECTION_WORKERS)
+
+    scheduler = StimulusScheduler()
+    tanks = []
+
+    for i, spec in enumerate(config.TANKS):
+        name = spec["name"]
+        cam = camera_from_config(
+            camera_index=spec["camera_index"],
+            resolution=spec.get("resolution", (640, 360)),
+            seed=config.SYNTHETIC_SEED + i,
+        )
+        log_dir, output_dir = tank_dirs(name)
+
+        tank = Tank(
+            name,
+            cam,
+            pool=pool,
+            log_dir=log_dir,
+            output_dir=output_dir,
+            stim_interval=spec.get("stim_interval", config.STIM_INTERVAL),
+            roi=spec.get("roi"),
+            rtp_port=config.RTP_PORT + 2 * i if config.RTP_ENABLED else None,
+            protocol=spec.get("protocol", config.STIM_PROTOCOL),
+            actuators=(
+                general_utils.make_tank_actuators(spec["led_port"]) if "led_port" in spec else None
+            ),
+        )
+        register_tank(tank)
+        tanks.append((tank, spec))
+
+        print(f"🐟 {name}: camera {spec['camera_index']} at {cam.width}x{cam.height}")
+
+    threading.Thread(target=start_server, name="server", daemon=True).start()
+
+    # Spread the tanks' default first stimuli over one interval
+    for i, (tank, spec) in enumerate(tanks):
+        stagger = spec.get("stim_interval", config.STIM_INTERVAL) * i / len(tanks)
+        tank.start()
+        tank.schedule(scheduler, spec.get("stim_offset"), stagger=stagger)
+    scheduler.start()
+
+    try:
+        while True:
+            time.sleep(config.STATUS_INTERVAL)
+
+            for tank, _ in tanks:
+                s = tank.stats()
+                print(
+                    f"[{tank.name}] capture {s['capture_fps']:.1f} FPS, "
+                    f"detect {s['detect_fps']:.1f} FPS, dropped {s['dropped']}"
+                )
+
+    except KeyboardInterrupt:
+        print("\nKeyboard interrupt — finishing up...")
+
+
+    finally:
+        scheduler.stop()
+        for tank, _ in tanks:
+            tank.stop()
+        if pool is not None:
+            pool.close()
+        general_utils.close_devices()
+        if tracer.enabled or tracer.events:
+            path = tracer.dump(time.strftime("logs/trace_%Y%m%d_%H%M%S.json"))
+            print(f"🧭 Trace written to {path} (open in ui.perfetto.dev)")
+
+        print("Shutdown complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,109 @@
+# stim/stim.py
+"""
+Brain stimulator: the DeuteronStimulator.dll bindings, and a service that
+owns the driver on its own thread.
+
+    service = StimulatorService(DeuteronDriver())   # or MockDriver()
+    service.start()                                 # connects on its thread
+    future = service.fire(amplitude=0.00019)        # returns at once
+    futures = service.run_protocol({"type": "ramp", "start": 0.00018, "step": 0.000005, "count": 5, "rest": 1})
+    future.result()   # {"status": "done", "code": 0, "t_start": ..., "t_done": ..., "params": {...}}
+
+Commands run one at a time in submit order. A protocol's rest comes after
+each pulse train, on the driver thread. Every pulse train is validated
+before anything is queued (a bad sweep step fails the whole protocol up
+front, not halfway through a session). Times are perf_counter().
+
+Protocols are data, so new sweeps need no code:
+
+    {"type": "single", "repeat": 5, "rest": 1.0, "amplitude": 0.00019}
+    {"type": "ramp", "start": 0.00018, "step": 0.000005, "max": 0.0002, "count": 15, "rest": 1.0}
+    {"type": "sweep", "params": {"amplitude": [0.00016, 0.00018], "pulse_count": [25, 50]},
+     "rest": 2.0, "repeat": 3, "seed": 1}
+
+Any other key sets that pulse parameter for every step (defaults:
+config.STIM_PULSE). A sweep runs the cartesian product of its params in
+order, or shuffled per repeat when it has a seed.
+
+    python -m stim.stim protocol.json [--mock]
+"""
+import argparse
 import ctypes
+import itertools
+import json
+import math
 import os
-import time 
+import queue
+import random
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+
+import config
+from utils.stats import StreamSummary
+
+
+_stim = None
 
 
-try:
+def load_driver():
+    """
+    Load DeuteronStimulator.dll and declare its signatures.
+
+    Done on first use instead of at import, so this module can be imported
+    on machines without the DLL (Linux CI, benchmark hosts).
+    """
+    global _stim
+    if _stim is not None:
+        return _stim
+
     # Folder where THIS Python file is located
     base_dir = os.path.dirname(os.path.abspath(__file__))
     # Full path to the DLL in the same folder
     dll_path = os.path.join(base_dir, "DeuteronStimulator.dll")
     stim = ctypes.WinDLL(dll_path)
 
-except Exception as e:
-    print("DLL load FAILED:", e)
-
-
-# int Stim_ConnectToTransmitter()
-stim.Stim_ConnectToTransmitter.restype = ctypes.c_int
-
-# int SetTransceiverFrequency(int freq)
-stim.SetTransceiverFrequency.argtypes = [ctypes.c_int]
-stim.SetTransceiverFrequency.restype = ctypes.c_int
-
-# int EnumerateAndSelectTarget(ref int targetSelected)
-stim.EnumerateAndSelectTarget.argtypes = [ctypes.POINTER(ctypes.c_int)]
-stim.EnumerateAndSelectTarget.restype = ctypes.c_int
-
-# int Stim_GetBatteryVoltage(ref double volts)
-stim.Stim_GetBatteryVoltage.argtypes = [ctypes.POINTER(ctypes.c_double)]
-stim.Stim_GetBatteryVoltage.restype = ctypes.c_int
-
-# int FireStimulusByValues(
-#     int FirstElectrode,
-#     int SecondElectrode,
-#     double PhaseWidth,
-#     double PulsePeriod,
-#     double Amplitude1,
-#     double Amplitude2,
-#     int PulseCount
-# )
-stim.FireStimulusByValues.argtypes = [
-    ctypes.c_int,     # FirstElectrode
-    ctypes.c_int,     # SecondElectrode
-    ctypes.c_double,  # PhaseWidth
-    ctypes.c_double,  # PulsePeriod
-    ctypes.c_double,  # Amplitude1
-    ctypes.c_double,  # Amplitude2
-    ctypes.c_int      # PulseCount
-]
-stim.FireStimulusByValues.restype = ctypes.c_int
+    # int Stim_ConnectToTransmitter()
+    stim.Stim_ConnectToTransmitter.restype = ctypes.c_int
+
+    # int SetTransceiverFrequency(int freq)
+    stim.SetTransceiverFrequency.argtypes = [ctypes.c_int]
+    stim.SetTransceiverFrequency.restype = ctypes.c_int
+
+    # int EnumerateAndSelectTarget(ref int targetSelected)
+    stim.EnumerateAndSelectTarget.argtypes = [ctypes.POINTER(ctypes.c_int)]
+    stim.EnumerateAndSelectTarget.restype = ctypes.c_int
+
+    # int Stim_GetBatteryVoltage(ref double volts)
+    stim.Stim_GetBatteryVoltage.argtypes = [ctypes.POINTER(ctypes.c_double)]
+    stim.Stim_GetBatteryVoltage.restype = ctypes.c_int
+
+    # int FireStimulusByValues(
+    #     int FirstElectrode,
+    #     int SecondElectrode,
+    #     double PhaseWidth,
+    #     double PulsePeriod,
+    #     double Amplitude1,
+    #     double Amplitude2,
+    #     int PulseCount
+    # )
+    stim.FireStimulusByValues.argtypes = [
+        ctypes.c_int,     # FirstElectrode
+        ctypes.c_int,     # SecondElectrode
+        ctypes.c_double,  # PhaseWidth
+        ctypes.c_double,  # PulsePeriod
+        ctypes.c_double,  # Amplitude1
+        ctypes.c_double,  # Amplitude2
+        ctypes.c_int      # PulseCount
+    ]
+    stim.FireStimulusByValues.restype = ctypes.c_int
+
+    _stim = stim
+    return stim
+
 
 def connect(freq_hz=917000000):
+    stim = load_driver()
     result = stim.Stim_ConnectToTransmitter()
     if result != 0:
         print("Connect error:", result)
@@ -60,7 +114,16 @@ def connect(freq_hz=917000000):
         print("Set frequency error:", result)
 
 
-def fire_stimulus(phase_width, pulse_period, amp, pulse_count):
+def fire_stimulus(
+    phase_width,
+    pulse_period,
+    amp,
+    pulse_count,
+    first_electrode=1,
+    second_electrode=2,
+    amp2=None,
+):
+    """One pulse train through the DLL (blocking). Returns the driver's result code."""
     # FireStimulusByValues(
     #   int FirstElectrode,
     #   int SecondElectrode,
@@ -70,39 +133,346 @@ def fire_stimulus(phase_width, pulse_period, amp, pulse_count):
     #   double Amplitude2,
     #   int PulseCount
     # )
-    result = stim.FireStimulusByValues(
-        1,      # FirstElectrode
-        2,      # SecondElectrode
+    result = load_driver().FireStimulusByValues(
+        int(first_electrode),
+        int(second_electrode),
         float(phase_width),
         float(pulse_period),
         float(amp),
-        float(amp),
+        float(amp if amp2 is None else amp2),
         int(pulse_count)
     )
 
     if result != 0:
         print("Stim error:", result)
+    return result
+
+
+# ============================
+# Parameters and protocols
+# ============================
+
+PULSE_KEYS = (
+    "first_electrode", "second_electrode", "phase_width",
+    "pulse_period", "amplitude", "amplitude2", "pulse_count",
+)
+
+
+def validate_pulse(params):
+    """
+    Complete pulse parameters (defaults: config.STIM_PULSE), checked
+    against the safety limits. Raises ValueError.
+    """
+    unknown = set(params) - set(PULSE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown stimulus parameter(s): {', '.join(sorted(unknown))}")
+
+    p = dict(config.STIM_PULSE, **params)
+    if p.get("amplitude2") is None:
+        p["amplitude2"] = p["amplitude"]   # symmetric biphasic pulse
+
+    # Numbers from a JSON protocol may be strings or null
+    for key in PULSE_KEYS:
+        try:
+            p[key] = float(p[key])
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} must be a number, got {p[key]!r}") from None
+        if not math.isfinite(p[key]):
+            raise ValueError(f"{key} must be finite, got {p[key]}")
+
+    first, second = p["first_electrode"], p["second_electrode"]
+    if int(first) != first or int(second) != second or min(first, second) < 1:
+        raise ValueError("Electrodes are numbered from 1")
+    if first == second:
+        raise ValueError("First and second electrode must differ")
+    if p["phase_width"] <= 0 or p["pulse_period"] <= 0:
+        raise ValueError("Phase width and pulse period must be positive")
+    if 2 * p["phase_width"] > p["pulse_period"]:
+        raise ValueError("Both phases must fit in the pulse period (2 × phase width ≤ period)")
+    for key in ("amplitude", "amplitude2"):
+        if not 0 < p[key] <= config.STIM_MAX_AMPLITUDE:
+            raise ValueError(
+                f"{key} {p[key] * 1e6:.1f} µA outside (0, {config.STIM_MAX_AMPLITUDE * 1e6:.1f}] µA"
+            )
+    if int(p["pulse_count"]) != p["pulse_count"] or not 1 <= p["pulse_count"] <= config.STIM_MAX_PULSE_COUNT:
+        raise ValueError(f"Pulse count must be 1–{config.STIM_MAX_PULSE_COUNT}")
+    for key in ("first_electrode", "second_electrode", "pulse_count"):
+        p[key] = int(p[key])
+    return p
+
+
+def expand_protocol(spec):
+    """Protocol dict → validated [(pulse params, rest s after it)]."""
+    spec = dict(spec)
+    kind = spec.pop("type", "single")
+    try:
+        rest = float(spec.pop("rest", 0.0))
+    except (TypeError, ValueError):
+        rest = -1
+    if not rest >= 0:   # also NaN
+        raise ValueError("Rest must be a non-negative number of seconds")
+
+    if kind not in ("single", "ramp", "sweep"):
+        raise ValueError(f"Unknown stimulation protocol: {kind}")
+    try:
+        if kind == "single":
+            steps = [{}] * int(spec.pop("repeat", 1))
+        elif kind == "ramp":
+            start = float(spec.pop("start"))
+            step = float(spec.pop("step", 0.0))
+            top = float(spec.pop("max", config.STIM_MAX_AMPLITUDE))
+            steps = [{"amplitude": min(start + step * i, top)} for i in range(int(spec.pop("count")))]
+        else:
+            sweep = spec.pop("params")
+            keys = list(sweep)
+            grid = [dict(zip(keys, values)) for values in itertools.product(*(sweep[k] for k in keys))]
+            repeat = int(spec.pop("repeat", 1))
+            seed = spec.pop("seed", None)
+            rng = random.Random(seed)
+            steps = []
+            for _ in range(repeat):
+                block = list(grid)
+                if seed is not None:
+                    rng.shuffle(block)
+                steps += block
+    except KeyError as e:
+        raise ValueError(f"{kind} protocol needs {e}") from None
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Malformed {kind} protocol: {e}") from None
+
+    out = []
+    for i, step in enumerate(steps):
+        try:
+            out.append((validate_pulse(dict(spec, **step)), rest))
+        except (ValueError, KeyError) as e:
+            raise ValueError(f"Protocol step {i}: {e}") from None
+    if not out:
+        raise ValueError("Protocol has no steps")
+    return out
+
+
+# The session stimulus_loop used to hard-code: 15 × 180 µA, 1 s apart
+KOBAYASHI_RAMP = {
+    "type": "ramp",
+    "start": 0.000180,
+    "step": 0.0,
+    "max": 0.000200,
+    "count": 15,
+    "rest": 1.0,
+    "phase_width": 0.0015,
+    "pulse_period": 0.01,
+    "pulse_count": 50,
+}
+
+
+# ============================
+# Drivers
+# ============================
+
+class DeuteronDriver:
+    """DeuteronStimulator.dll (Windows). Only call it from one thread."""
+
+    def connect(self, freq_hz):
+        connect(freq_hz)
+
+    def fire(self, p):
+        return fire_stimulus(
+            p["phase_width"], p["pulse_period"], p["amplitude"], p["pulse_count"],
+            first_electrode=p["first_electrode"],
+            second_electrode=p["second_electrode"],
+            amp2=p["amplitude2"],
+        )
+
+
+class MockDriver:
+    """
+    Records (perf_counter(), action, params) instead of stimulating. With
+    realtime=True a pulse train takes as long as it would on the fish.
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.calls = []
+
+    def connect(self, freq_hz):
+        self.calls.append((time.perf_counter(), "connect", {"freq_hz": freq_hz}))
+
+    def fire(self, p):
+        if self.realtime:
+            time.sleep(p["pulse_count"] * p["pulse_period"])
+        self.calls.append((time.perf_counter(), "fire", dict(p)))
+        return 0
+
+    def times(self, action="fire"):
+        return [t for t, a, _ in self.calls if a == action]
+
+
+DRIVERS = {"deuteron": DeuteronDriver, "mock": MockDriver}
+
+
+def make_driver(name):
+    if name not in DRIVERS:
+        raise ValueError(f"Unknown stimulator driver: {name}")
+    return DRIVERS[name]()
+
+
+# ============================
+# Service
+# ============================
+
+_STOP = object()
+
+
+class StimulatorService(threading.Thread):
+    """
+    The only thread that talks to the driver: connects on start, then fires
+    queued pulse trains in order. fire() / run_protocol() validate, queue
+    and return Futures; cancel a Future to drop a command that hasn't run.
+    A command with a deadline (perf_counter()) that comes up after it is
+    cancelled instead of fired late.
+    """
+
+    def __init__(self, driver, freq_hz=config.STIM_FREQ_HZ):
+        super().__init__(name="stimulator", daemon=True)
+        self.driver = driver
+        self.freq_hz = freq_hz
+
+        self._queue = queue.SimpleQueue()
+        self._stop_event = threading.Event()
+
+        self.fired = 0
+        self.errors = 0
+        self.expired = 0
+        self.fire_time = StreamSummary()   # seconds the driver call took
+
+    def fire(self, rest=0.0, deadline=None, **params):
+        """Queue one pulse train (config.STIM_PULSE overridden by params)."""
+        return self._put(validate_pulse(params), rest, deadline)
+
+    def run_protocol(self, spec):
+        """Queue a whole protocol; one Future per pulse train."""
+        return [self._put(params, rest) for params, rest in expand_protocol(spec)]
+
+    def _put(self, params, rest, deadline=None):
+        future = Future()
+        if self._stop_event.is_set():
+            future.cancel()
+        else:
+            self._queue.put((params, rest, deadline, future))
+        return future
+
+    def run(self):
+        try:
+            self.driver.connect(self.freq_hz)
+        except Exception as e:
+            print(f"⚠️  Warning: stimulator connect failed: {e}")
+
+        while True:
+            command = self._queue.get()
+            if command is _STOP:
+                break
+            self._execute(*command)
+        self._cancel_pending()
+
+    def _execute(self, params, rest, deadline, future):
+        late = time.perf_counter() - deadline if deadline is not None else 0
+        if late > 0 and not future.cancelled() and future.cancel():
+            self.expired += 1
+            print(f"⚠️  Warning: stimulus {1000 * late:.0f} ms past its deadline, dropped")
+        if self._stop_event.is_set() or not future.set_running_or_notify_cancel():
+            if not future.done():
+                future.cancel()
+            return
+
+        t_start = time.perf_counter()
+        try:
+            code = self.driver.fire(params)
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️  Warning: stimulator command failed: {e}")
+            future.set_exception(e)
+            return
+        t_done = time.perf_counter()
+
+        self.fire_time.add(t_done - t_start)
+        if code == 0:
+            self.fired += 1
+        else:
+            self.errors += 1
+        future.set_result({
+            "status": "done" if code == 0 else "error",
+            "code": code,
+            "t_start": t_start,
+            "t_done": t_done,
+            "params": params,
+        })
+
+        if rest > 0:
+            self._stop_event.wait(rest)
+
+    def _cancel_pending(self):
+        while True:
+            try:
+                command = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if command is not _STOP:
+                command[-1].cancel()
+
+    def stop(self, timeout=None):
+        """Finish the running pulse train, cancel the rest."""
+        self._stop_event.set()
+        self._queue.put(_STOP)
+        if self.is_alive():
+            self.join(timeout)
+        else:
+            self._cancel_pending()
 
+    def stats(self):
+        t = self.fire_time.to_dict()
+        stats = {
+            "fired": self.fired,
+            "errors": self.errors,
+            "expired": self.expired,
+            "queued": self._queue.qsize(),
+        }
+        if t["count"]:
+            stats["fire_ms"] = {k: round(1000 * t[k], 3) for k in ("mean", "p50", "p99", "max")}
+        return stats
 
-def stimulus_loop():
-    # Connect at 917 MHz
-    connect(917000000)
 
-    base_amp = 0.000180     # 180 microamp
-    amp_diff = 0.0
-    rest_time = 1000         # milliseconds
-    max_amp = 0.000200        # 200 microamp
-    pulse_count = 50
+def stimulus_loop(protocol=KOBAYASHI_RAMP, driver=None):
+    """Run one stimulation protocol to the end, printing each pulse train."""
+    service = StimulatorService(driver if driver is not None else DeuteronDriver())
+    futures = service.run_protocol(protocol)   # validated before connecting
+    try:
+        service.start()
+        for i, future in enumerate(futures):
+            try:
+                r = future.result()
+            except CancelledError:
+                print(f"Iteration {i}: cancelled")
+                continue
+            print(
+                f"Iteration {i}: {r['status']} {r['params']['amplitude'] * 1e6:.1f} µA, "
+                f"{r['params']['pulse_count']} pulses (driver {1000 * (r['t_done'] - r['t_start']):.1f} ms)"
+            )
+    except KeyboardInterrupt:
+        print("\nStopping stimulation...")
+    finally:
+        service.stop(timeout=5)
+    return service.stats()
 
-    # Kobayashi fish parameters
-    phase_width = 0.0015
-    pulse_period = 0.01
 
-    for i in range(15):
-        amp = min(base_amp + amp_diff * i, max_amp)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a brain stimulation protocol")
+    parser.add_argument("protocol", nargs="?", help="protocol JSON file (default: the 15-step ramp)")
+    parser.add_argument("--mock", action="store_true", help="use the mock driver")
+    args = parser.parse_args()
 
-        print(f"Iteration {i}: Stimulating brain with {amp} A")
-        fire_stimulus(phase_width, pulse_period, amp, pulse_count)
+    protocol = KOBAYASHI_RAMP
+    if args.protocol:
+        with open(args.protocol) as f:
+            protocol = json.load(f)
 
-        print(f"Wait {rest_time} ms")
-        time.sleep(rest_time / 1000.0)
+    print(stimulus_loop(protocol, MockDriver(realtime=True) if args.mock else None))
@@ -0,0 +1,328 @@
+# sweep.py
+"""
+Parameter sweep over a recorded video.
+
+Every stage is cached on disk under --cache, keyed by exactly the
+parameters it depends on:
+
+    resized frames   ← video, SCALE
+    HSV frames       ← resized frames
+    motion masks     ← resized frames, MOG2_HISTORY, MOG2_VAR_THRESHOLD, MORPH_KERNEL_SMALL
+    color masks      ← HSV frames, ORANGE_LOW/HIGH, MEDIAN_BLUR_SIZE, MORPH_KERNEL_SMALL
+    detection flags  ← motion masks, color masks, AREA_RATIO (inside a polygon ROI only)
+
+so a grid that only varies WINDOW_SIZE / THRESHOLD_COUNT / COOLDOWN_DURATION
+decodes the video once and re-scores the cached per-frame flags with NumPy.
+
+The grid is a JSON file mapping config names to lists of values; anything
+not in the grid comes from config.py:
+
+    {"MOG2_VAR_THRESHOLD": [4, 8, 16], "WINDOW_SIZE": [15, 30], "THRESHOLD_COUNT": [8, 12]}
+
+Ground-truth labels (optional) are a CSV of movement bouts in seconds
+from the start of the video:
+
+    start,end
+    12.3,14.0
+
+They are matched to frames by the recording's capture times
+(batch_analyze.frame_times), so frames the recorder dropped don't shift
+them.
+
+Usage:
+    python sweep.py output/recording_20251230_132249.mp4 --grid grid.json --labels labels.csv
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+
+import cv2
+import numpy as np
+
+import config
+from batch_analyze import frame_times
+from detection import parse_roi, roi_mask, smooth_detections
+
+
+MASK_PARAMS = ("SCALE", "MOG2_HISTORY", "MOG2_VAR_THRESHOLD", "MORPH_KERNEL_SMALL",
+               "ORANGE_LOW", "ORANGE_HIGH", "MEDIAN_BLUR_SIZE", "AREA_RATIO")
+SCORE_PARAMS = ("WINDOW_SIZE", "THRESHOLD_COUNT", "COOLDOWN_DURATION")
+
+
+# --------------------------------------------------
+# Disk cache
+# --------------------------------------------------
+
+class StageCache:
+    """
+    One .npy per (stage, params). A stage counts as cached once its .json
+    marker exists, which also records how many frames are valid (the
+    container's frame count is only an estimate).
+    """
+
+    def __init__(self, cache_dir, video):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.dir = cache_dir
+
+        st = os.stat(video)
+        self.video_key = (os.path.abspath(video), st.st_size, int(st.st_mtime))
+
+    def path(self, stage, *params):
+        digest = hashlib.sha1(repr((self.video_key, params)).encode()).hexdigest()[:16]
+        return os.path.join(self.dir, f"{stage}_{digest}")
+
+    def load(self, stage, *params):
+        p = self.path(stage, *params)
+        if not os.path.exists(p + ".json"):
+            return None
+
+        with open(p + ".json") as f:
+            length = json.load(f)["length"]
+        return np.load(p + ".npy", mmap_mode="r")[:length]
+
+    def create(self, stage, shape, dtype, *params):
+        """Memory-mapped output array for a stage; call finish() when filled."""
+        return np.lib.format.open_memmap(
+            self.path(stage, *params) + ".npy", mode="w+", dtype=dtype, shape=shape
+        )
+
+    def finish(self, arr, stage, *params, length=None):
+        arr.flush()
+        length = len(arr) if length is None else length
+
+        p = self.path(stage, *params)
+        with open(p + ".json", "w") as f:
+            json.dump({"stage": stage, "params": repr(params), "length": length}, f)
+        return arr[:length]
+
+
+# --------------------------------------------------
+# Stages
+# --------------------------------------------------
+
+def resized_frames(cache, video, scale):
+    arr = cache.load("small", scale, config.ROI)
+    if arr is not None:
+        return arr
+
+    cap = cv2.VideoCapture(video)
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    rx, ry, rw, rh, _ = parse_roi(config.ROI, w, h)
+    size = (int(rw * scale), int(rh * scale))
+
+    print(f"🎞️  Decoding {n} frames at {size[0]}x{size[1]}...")
+    out = cache.create("small", (n, size[1], size[0], 3), np.uint8, scale, config.ROI)
+
+    i = 0
+    while i < n:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        cv2.resize(frame[ry:ry + rh, rx:rx + rw], size, dst=out[i])
+        i += 1
+    cap.release()
+
+    return cache.finish(out, "small", scale, config.ROI, length=i)
+
+
+def hsv_frames(cache, small, scale):
+    arr = cache.load("hsv", scale, config.ROI)
+    if arr is not None:
+        return arr
+
+    out = cache.create("hsv", small.shape, np.uint8, scale, config.ROI)
+    for i in range(len(small)):
+        cv2.cvtColor(small[i], cv2.COLOR_BGR2HSV, dst=out[i])
+    return cache.finish(out, "hsv", scale, config.ROI)
+
+
+def _packed_shape(small):
+    n, h, w = small.shape[:3]
+    return (n, (h * w + 7) // 8)
+
+
+def motion_masks(cache, small, p):
+    key = (p["SCALE"], config.ROI, p["MOG2_HISTORY"], p["MOG2_VAR_THRESHOLD"], tuple(p["MORPH_KERNEL_SMALL"]))
+    arr = cache.load("motion", *key)
+    if arr is not None:
+        return arr
+
+    fgbg = cv2.createBackgroundSubtractorMOG2(
+        history=p["MOG2_HISTORY"],
+        varThreshold=p["MOG2_VAR_THRESHOLD"],
+        detectShadows=False
+    )
+    kernel = np.ones(tuple(p["MORPH_KERNEL_SMALL"]), np.uint8)
+
+    out = cache.create("motion", _packed_shape(small), np.uint8, *key)
+    for i in range(len(small)):
+        motion = fgbg.apply(small[i])
+        motion = cv2.morphologyEx(motion, cv2.MORPH_OPEN, kernel)
+        motion = cv2.dilate(motion, None, iterations=1)
+        out[i] = np.packbits(motion.reshape(-1) > 0)
+    return cache.finish(out, "motion", *key)
+
+
+def color_masks(cache, hsv, p):
+    key = (p["SCALE"], config.ROI, tuple(p["ORANGE_LOW"]), tuple(p["ORANGE_HIGH"]),
+           p["MEDIAN_BLUR_SIZE"], tuple(p["MORPH_KERNEL_SMALL"]))
+    arr = cache.load("color", *key)
+    if arr is not None:
+        return arr
+
+    kernel = np.ones(tuple(p["MORPH_KERNEL_SMALL"]), np.uint8)
+    low, high = tuple(p["ORANGE_LOW"]), tuple(p["ORANGE_HIGH"])
+
+    out = cache.create("color", _packed_shape(hsv), np.uint8, *key)
+    for i in range(len(hsv)):
+        color = cv2.inRange(hsv[i], low, high)
+        color = cv2.medianBlur(color, p["MEDIAN_BLUR_SIZE"])
+        color = cv2.morphologyEx(color, cv2.MORPH_CLOSE, kernel)
+        out[i] = np.packbits(color.reshape(-1) > 0)
+    return cache.finish(out, "color", *key)
+
+
+def detection_flags(cache, small, motion, color, p, frame_size):
+    # "roi_mask": flags cached before polygon ROIs were masked are stale
+    key = tuple(
+        tuple(v) if isinstance(v, (list, tuple)) else v
+        for v in (p[k] for k in MASK_PARAMS)
+    ) + (config.ROI, "roi_mask")
+    arr = cache.load("flags", *key)
+    if arr is not None:
+        return np.asarray(arr)
+
+    n, h, w = small.shape[:3]
+    full_w, full_h = frame_size
+    min_area = (int(full_w * p["SCALE"]) * int(full_h * p["SCALE"])) * p["AREA_RATIO"]
+
+    # Same polygon mask as MaskStage, packed like the motion / color masks
+    _, _, rw, rh, polygon = parse_roi(config.ROI, full_w, full_h)
+    mask = roi_mask(polygon, rw, rh, w, h)
+    packed_mask = None if mask is None else np.packbits(mask.reshape(-1) > 0)
+
+    flags = np.zeros(n, dtype=bool)
+    for i in range(n):
+        packed = motion[i] & color[i]
+        if packed_mask is not None:
+            packed &= packed_mask
+        combined = np.unpackbits(packed, count=h * w).reshape(h, w) * np.uint8(255)
+        contours, _ = cv2.findContours(combined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        flags[i] = any(cv2.contourArea(c) > min_area for c in contours)
+
+    out = cache.create("flags", flags.shape, bool, *key)
+    out[:] = flags
+    cache.finish(out, "flags", *key)
+    return flags
+
+
+# --------------------------------------------------
+# Scoring
+# --------------------------------------------------
+
+def precision_recall(onsets, offsets, labels):
+    if len(labels) == 0:
+        return None, None
+
+    gt = np.asarray(labels)
+    # A detected bout and a labelled bout match if they overlap
+    overlap = (onsets[:, None] < gt[None, :, 1]) & (offsets[:, None] > gt[None, :, 0])
+
+    precision = overlap.any(axis=1).mean() if len(onsets) else 0.0
+    recall = overlap.any(axis=0).mean()
+    return float(precision), float(recall)
+
+
+def load_labels(path, times):
+    """
+    Labelled bouts as [start, end) frame ranges. `times` are the frames'
+    capture times (frame_times); a label covers every frame shown
+    between its start and end.
+    """
+    elapsed = times - times[0]
+    rows = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            start = np.searchsorted(elapsed, float(row["start"]), side="right") - 1
+            end = np.searchsorted(elapsed, float(row["end"]), side="right")
+            rows.append((max(0, int(start)), int(end)))
+    return rows
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Detection parameter sweep with cached stages")
+    parser.add_argument("video")
+    parser.add_argument("--grid", required=True, help="JSON file: config name → list of values")
+    parser.add_argument("--labels", help="CSV of ground-truth bouts (start,end in seconds)")
+    parser.add_argument("--cache", default=".sweep_cache")
+    parser.add_argument("--out", default="sweep_results.csv")
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+
+    unknown = set(grid) - set(MASK_PARAMS) - set(SCORE_PARAMS)
+    if unknown:
+        raise SystemExit(f"❌ Not sweepable: {', '.join(sorted(unknown))}")
+
+    names = list(MASK_PARAMS) + list(SCORE_PARAMS)
+    values = [grid.get(k, [getattr(config, k)]) for k in names]
+
+    cap = cv2.VideoCapture(args.video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+
+    labels = []
+    if args.labels:
+        labels = load_labels(args.labels, frame_times(args.video, n_frames, fps))
+    cache = StageCache(args.cache, args.video)
+
+    results = []
+    for combo in itertools.product(*values):
+        p = dict(zip(names, combo))
+
+        small = resized_frames(cache, args.video, p["SCALE"])
+        hsv = hsv_frames(cache, small, p["SCALE"])
+        motion = motion_masks(cache, small, p)
+        color = color_masks(cache, hsv, p)
+        flags = detection_flags(cache, small, motion, color, p, frame_size)
+
+        _, active, onsets, offsets = smooth_detections(
+            flags,
+            window=p["WINDOW_SIZE"],
+            threshold=p["THRESHOLD_COUNT"],
+            cooldown=p["COOLDOWN_DURATION"],
+        )
+        precision, recall = precision_recall(onsets, offsets, labels)
+
+        row = {k: p[k] for k in grid}
+        row.update({
+            "bouts": len(onsets),
+            "movement_frames": int(active.sum()),
+            "precision": "" if precision is None else round(precision, 3),
+            "recall": "" if recall is None else round(recall, 3),
+        })
+        results.append(row)
+        print(row)
+
+    with open(args.out, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+    print(f"✅ {len(results)} combinations → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
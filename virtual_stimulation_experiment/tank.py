@@ -0,0 +1,604 @@
+# tank.py
+import os
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+import config
+import utils.general_utils as general_utils
+from detection import MovementDetector, BoutTracker
+from utils.actuators import dropped
+from utils.experiment_logger import ExperimentLogger
+from utils.output_manager import OutputManager, ClipRecorder
+from utils.pipeline import FrameQueue, CaptureStage, WorkerStage
+from utils.rtp_stream import RtpStreamer
+from utils.streaming import MjpegHub, PreviewEncoder
+from utils.scheduler import make_protocol
+from utils.sources import make_camera
+from utils.tracing import tracer
+
+
+class Tank:
+    """
+    Everything that belongs to one camera/tank: capture pipeline, detector
+    state, behavior logic, log and recording.
+
+    Stimuli are not timed here — schedule() hands them to a shared
+    StimulusScheduler, which calls stimulate() at the times the stimulus
+    protocol asks for. Trials and the protocol can be changed at runtime
+    (start_trial(), stop_trial(), set_schedule()).
+
+    Response windows live on the monotonic clock and are checked against
+    each frame's capture stamp (FramePacket.t_mono); wall-clock times are
+    only used for the log.
+    """
+
+    def __init__(
+        self,
+        name,
+        camera,
+        pool=None,
+        log_dir="logs",
+        output_dir="output",
+        stim_interval=config.STIM_INTERVAL,
+        roi=None,
+        record_mode=config.RECORD_MODE,
+        rtp_port=None,
+        protocol=None,
+        actuators=None,
+    ):
+        self.name = name
+        self.camera = camera
+        # `protocol` is a spec for make_protocol(); None = every stim_interval s
+        self.protocol = make_protocol(protocol, stim_interval)
+        # This tank's own ActuatorService (stopped with the tank); None = shared
+        self.actuators = actuators
+
+        self.detector = MovementDetector(
+            camera.width, camera.height, pool=pool, key=name, ring=camera.ring, roi=roi
+        )
+        self.bouts = BoutTracker()
+        self.logger = ExperimentLogger(base_dir=log_dir)
+        if record_mode == "clips":
+            self.output = ClipRecorder(output_dir=output_dir, fps=camera.fps)
+        elif record_mode == "full":
+            self.output = OutputManager(output_dir=output_dir)
+        else:
+            raise ValueError(f"Unknown record mode: {record_mode}")
+
+        # Live preview, encoded only while someone is watching
+        self.stream = MjpegHub(name, widths=config.STREAM_WIDTHS)
+        self.preview = PreviewEncoder(self.stream)
+
+        # --------------------------------------------------
+        # Pipeline: capture → detection → encode / record
+        # --------------------------------------------------
+        self.detect_queue = FrameQueue(config.DETECT_QUEUE_SIZE, config.DETECT_QUEUE_POLICY)
+        self.encode_queue = FrameQueue(config.ENCODE_QUEUE_SIZE, config.ENCODE_QUEUE_POLICY)
+        self.record_queue = FrameQueue(config.RECORD_QUEUE_SIZE, config.RECORD_QUEUE_POLICY)
+
+        self.capture = CaptureStage(camera, self.detect_queue)
+        self.encoder = WorkerStage(f"{name}-encode", self.encode_queue, self._encode)
+        self.recorder = WorkerStage(f"{name}-record", self.record_queue, self._record)
+        self._detect_thread = threading.Thread(
+            target=self._detection_loop, name=f"{name}-detect", daemon=True
+        )
+
+        # Optional H.264 / RTP output, fed like the recorder
+        self.rtp = None
+        if rtp_port is not None:
+            self.rtp = RtpStreamer(
+                port=rtp_port,
+                fps=camera.fps,
+                sdp_path=os.path.join(output_dir, f"{name}.sdp"),
+                name=name,
+            )
+            self.rtp_queue = FrameQueue(config.RTP_QUEUE_SIZE, "drop_oldest")
+            self.rtp_stage = WorkerStage(f"{name}-rtp", self.rtp_queue, self._send_rtp)
+
+        self.frame_count = 0
+        self.record_overruns = 0
+        self._record_buf = None   # the recorder's copy of the current ring frame
+        self.start_time = None
+        self._running = False
+
+        # Behavior state, shared between the detection thread and the scheduler
+        self._lock = threading.Lock()
+        self.response_window_start = 0
+        self.response_window_end = 0
+        self.waiting_for_response = False
+        self.stimulus_sent = False
+
+        # (capture time, seq) of recently processed frames, for live FPS
+        self._recent = deque(maxlen=60)
+
+        # perf_counter() of the first frame with raw detections in the
+        # current movement, for motion → stimulus latency
+        self._motion_start = None
+
+        # Trial / stimulus schedule. Bumping _schedule_gen cancels whatever
+        # the scheduler still holds for this tank. next_stimulus is on the
+        # scheduler's (monotonic) clock.
+        self.scheduler = None
+        self.stagger = 0.0
+        self.trial_active = False
+        self.next_stimulus = None
+        self._schedule_gen = 0
+
+        # Live event callbacks (stimulation, bouts, trials, throttled score)
+        self._event_listeners = []
+        self._last_score_event = 0.0
+
+    # --------------------------------------------------
+    # Lifecycle
+    # --------------------------------------------------
+
+    def start(self):
+        self.start_time = time.time()
+        self._running = True
+        self.trial_active = True
+
+        self.logger.log_trial_start(t=self.start_time, detail=self._protocol_detail())
+
+        self.capture.start()
+        self.encoder.start()
+        self.recorder.start()
+        if self.rtp is not None:
+            self.rtp_stage.start()
+        self._detect_thread.start()
+
+    def stop(self):
+        self._running = False
+        self.capture.stop()
+        self.capture.join(timeout=2)
+        self._detect_thread.join(timeout=2)
+        self.encoder.stop(timeout=2)
+        self.recorder.stop()
+        if self.rtp is not None:
+            self.rtp_stage.stop(timeout=2)
+            self.rtp.close()
+
+        self.camera.release()
+        if self.actuators is not None:
+            general_utils.close_tank_actuators(self.actuators)
+
+        # A bout still running at shutdown ends now
+        bout = self.bouts.finish(time.time(), self.capture.frame_count)
+        if bout is not None:
+            self.logger.log_bout_end(bout)
+
+        total_time = time.time() - self.start_time
+        real_fps = self.capture.frame_count / total_time
+
+        print(
+            f"[{self.name}] Captured {self.capture.frame_count} frames in "
+            f"{total_time:.2f}s → {real_fps:.2f} FPS"
+        )
+        print(
+            f"[{self.name}] Processed {self.frame_count} frames "
+            f"(dropped before detection: {self.detect_queue.dropped}, "
+            f"before encode: {self.encode_queue.dropped}, "
+            f"before record: {self.record_queue.dropped}, "
+            f"recorder overruns: {self.record_overruns})"
+        )
+
+        # The recording only holds frames that made it through detection
+        record_fps = self.recorder.processed / total_time
+        self.output.close(record_fps, frame_size=(self.camera.width, self.camera.height))
+        self.logger.close()
+
+    # --------------------------------------------------
+    # Trials / schedule (called from main or the server)
+    # --------------------------------------------------
+
+    def schedule(self, scheduler, first_in=None, stagger=0.0):
+        """
+        Let `scheduler` time this tank's stimuli. The first one comes after
+        `first_in` seconds, or when the protocol says plus `stagger` seconds
+        (also on every restarted trial), so tanks sharing actuators don't
+        come due together.
+        """
+        self.scheduler = scheduler
+        self.stagger = stagger
+        self._reschedule(self._first_due(first_in))
+
+    def _first_due(self, first_in=None):
+        # next_delay() is called once per stimulus, including the first
+        self.protocol.reset()
+        delay = self.protocol.next_delay()
+        if first_in is None:
+            return self.scheduler.now() + delay + self.stagger
+        return self.scheduler.now() + first_in
+
+    def _protocol_detail(self):
+        # Logged with every trial so a jittered sequence can be replayed
+        parts = []
+        for key, value in self.protocol.describe().items():
+            if key == "blocks":
+                value = "+".join(f"{count}x{interval:g}" for count, interval in value)
+            parts.append(f"{key}={value}")
+        return "protocol " + " ".join(parts)
+
+    def _reschedule(self, t):
+        with self._lock:
+            self._schedule_gen += 1
+            gen = self._schedule_gen
+            self.next_stimulus = t
+        self.scheduler.add(lambda t_due: self._scheduled_stimulus(gen, t_due), t)
+
+    def _scheduled_stimulus(self, gen, t_due):
+        # Superseded by a schedule change or a stopped trial
+        with self._lock:
+            current = gen == self._schedule_gen and self.trial_active
+        if not current:
+            return None
+        self.stimulate(t_due)
+
+        delay = self.protocol.next_delay()
+        if delay is None:
+            # Protocol finished: the trial ends, detection keeps running
+            self.stop_trial()
+            return None
+        with self._lock:
+            if gen != self._schedule_gen:
+                return None     # rescheduled while this one fired
+            # From the due time, not the firing time, so nothing drifts
+            self.next_stimulus = t_due + delay
+        return t_due + delay
+
+    def start_trial(self):
+        if self.trial_active:
+            return False
+        now = time.time()
+        self.trial_active = True
+        self.logger.log_trial_start(t=now, detail=self._protocol_detail())
+        self._emit("trial_start", now, protocol=self.protocol.describe())
+        if self.scheduler is not None:
+            self._reschedule(self._first_due())
+        return True
+
+    def stop_trial(self):
+        """Stop stimulating; detection, logging and recording keep running."""
+        if not self.trial_active:
+            return False
+        now = time.time()
+        self.trial_active = False
+        with self._lock:
+            self._schedule_gen += 1
+            self.next_stimulus = None
+        self.logger.log_trial_end(t=now)
+        self._emit("trial_stop", now)
+        return True
+
+    def set_schedule(self, interval=None, next_in=None, protocol=None):
+        """
+        Switch to a fixed `interval` or another `protocol` (a make_protocol()
+        spec), and/or change when the next stimulus comes.
+        """
+        if protocol is not None:
+            self.protocol = make_protocol(protocol)
+        elif interval is not None:
+            self.protocol = make_protocol(interval)
+        else:
+            if next_in is not None and self.trial_active and self.scheduler is not None:
+                self._reschedule(self.scheduler.now() + next_in)
+            return self.schedule_info()
+
+        if self.trial_active and self.scheduler is not None:
+            self._reschedule(self._first_due(next_in))
+        return self.schedule_info()
+
+    def schedule_info(self):
+        next_in = None
+        if self.next_stimulus is not None and self.scheduler is not None:
+            next_in = round(self.next_stimulus - self.scheduler.now(), 3)
+        return {
+            "trial_active": self.trial_active,
+            "protocol": self.protocol.describe(),
+            "next_in": next_in,
+        }
+
+    # --------------------------------------------------
+    # Live events
+    # --------------------------------------------------
+
+    def add_event_listener(self, callback):
+        """callback(event_dict), called on the emitting thread — keep it cheap."""
+        self._event_listeners.append(callback)
+
+    def _emit(self, event, t, **fields):
+        if not self._event_listeners:
+            return
+        fields.update(tank=self.name, event=event, t=t)
+        for callback in self._event_listeners:
+            try:
+                callback(fields)
+            except Exception as e:
+                print(f"⚠️  Warning: [{self.name}] event listener failed: {e}")
+
+    # --------------------------------------------------
+    # Stimulation (called from the scheduler thread)
+    # --------------------------------------------------
+
+    def stimulate(self, t_due):
+        """Fire one stimulus; t_due is when the scheduler meant it to happen."""
+        fired = self.scheduler.now() if self.scheduler is not None else time.perf_counter()
+        jitter = fired - t_due
+        now = time.time()
+
+        # Queued to the actuator service; returns without waiting for them.
+        # A blink / beep merged into or rejected by a running one (overlap
+        # policy) never plays, and a stimulus that didn't play must not open
+        # a window.
+        blink = general_utils.blink_led(self.actuators)
+        sound = general_utils.make_sound(self.actuators)
+        played = [kind for kind, f in (("visual", blink), ("audio", sound)) if not dropped(f)]
+        if not played:
+            reason = f"led={dropped(blink)} sound={dropped(sound)}"
+            print(f"⚠️  [{self.name}] Stimulus skipped, actuators busy ({reason})")
+            self.logger.log_stimulation_skipped(t=now, reason=reason)
+            self._emit("stimulation_skipped", now, reason=reason)
+            return
+
+        stim_type = "+".join(played)
+        print(f"💡 [{self.name}] Triggering {stim_type} stimulus at t={now:.3f}")
+        self.logger.log_stimulation(stim_type, t=now, jitter=jitter)
+        self._trigger_clip(now)
+        self._emit("stimulation", now, stim_type=stim_type, jitter_ms=round(1000 * jitter, 3))
+
+        # Monotonic, like the frame stamps they are compared with
+        with self._lock:
+            self.response_window_start = fired + config.STIM_RESPONSE_WINDOW_START_DELAY
+            self.response_window_end = fired + config.STIM_RESPONSE_WINDOW
+            self.waiting_for_response = True
+            self.stimulus_sent = False
+
+    @staticmethod
+    def _trace_stimulus(seq, t_capture, t_motion):
+        """Future callback: end-to-end spans up to when the trigger really fired."""
+
+        def done(future):
+            result = future.result()
+            if result["status"] != "done":
+                return
+            fired = result["t_start"]
+            tracer.record("e2e.capture_to_stimulus", t_capture, fired, seq)
+            if t_motion is not None:
+                tracer.record("e2e.motion_to_stimulus", t_motion, fired, seq)
+
+        return done
+
+    # --------------------------------------------------
+    # Frame loop
+    # --------------------------------------------------
+
+    def _detection_loop(self):
+        while self._running:
+            packet = self.detect_queue.get(timeout=0.5)
+            if packet is None:
+                if self.detect_queue.closed:
+                    break
+                continue
+
+            try:
+                self._handle(packet)
+            except Exception as e:
+                print(f"⚠️  Warning: [{self.name}] frame {packet.seq} failed: {e}")
+
+    def _handle(self, packet):
+        if tracer.enabled:
+            tracer.record("queue.detect", packet.t_mono, time.perf_counter(), packet.seq)
+
+        frame = packet.frame
+        self.frame_count += 1
+        self._recent.append((packet.t_capture, packet.seq))
+
+        # All behavior timing is relative to when the frame was captured,
+        # not when this stage got around to it.
+        now = packet.t_capture
+
+        # ==========================================================
+        # 1. MOVEMENT DETECTION
+        # ==========================================================
+        movement_active, contours, score = self.detector.process(frame, seq=packet.seq)
+        packet.movement_active = movement_active
+        packet.contours = contours
+        packet.score = score
+        trace = tracer.begin("tank", packet.seq)
+
+        # The smoother needs a few frames to agree; the fish moved on the
+        # first frame with raw detections
+        if contours:
+            if self._motion_start is None:
+                self._motion_start = packet.t_mono
+        elif not movement_active:
+            self._motion_start = None
+
+        # ==========================================================
+        # 2. SINGLE-SOURCE BEHAVIOR LOGIC
+        # ==========================================================
+        with self._lock:
+            in_window = (
+                self.waiting_for_response
+                and self.response_window_start <= packet.t_mono <= self.response_window_end
+            )
+            send_stimulus = movement_active and in_window and not self.stimulus_sent
+            if send_stimulus:
+                self.stimulus_sent = True
+
+            # Response window expired
+            if self.waiting_for_response and packet.t_mono > self.response_window_end:
+                self.waiting_for_response = False
+
+        # A bout is a RESPONSE if it starts inside the response window,
+        # otherwise a NORMAL movement
+        started, ended = self.bouts.update(now, packet.seq, movement_active, score)
+        if ended is not None:
+            self.logger.log_bout_end(ended)
+            self._emit(
+                "bout_offset", ended.offset, frame=ended.offset_frame, reaction=ended.reaction,
+                duration=ended.duration, peak_score=ended.peak_score, mean_score=ended.mean_score,
+            )
+        if started is not None:
+            started.reaction = in_window
+            self.logger.log_bout_onset(started)
+            self._emit("bout_onset", now, frame=packet.seq, score=score, reaction=in_window)
+            if in_window:
+                self._trigger_clip(now)
+
+        if now - self._last_score_event >= 1.0 / config.EVENT_SCORE_RATE:
+            self._last_score_event = now
+            self._emit("score", now, frame=packet.seq, score=score, movement_active=movement_active)
+
+        if movement_active:
+            if in_window:
+                self.logger.log_reaction(t=now, frame=packet.seq, score=score)
+
+                if send_stimulus:
+                    future = general_utils.send_brain_stimulus(self.actuators)
+                    if tracer.enabled:
+                        future.add_done_callback(
+                            self._trace_stimulus(packet.seq, packet.t_mono, self._motion_start)
+                        )
+            else:
+                self.logger.log_movement(t=now, frame=packet.seq, score=score)
+
+        trace.mark("behavior")
+
+        # ==========================================================
+        # 3. Visualization + streaming (handed off to other stages)
+        # ==========================================================
+        if self.stream.subscribers and self.preview.due(now):
+            # The detector's small image is reused by the next frame
+            source = self.detector.preview_source()
+            if source is not None:
+                small, origin, scale = source
+                packet.preview = (small.copy(), origin, scale)
+            self.encode_queue.put(packet)
+
+        # The frame stays untouched: it is the ring slot the other stages
+        # (and a pool worker) read. Each output draws the overlay on its own copy.
+        self.record_queue.put(packet)
+        if self.rtp is not None:
+            self.rtp_queue.put(packet)
+
+        trace.mark("handoff")
+        if tracer.enabled:
+            tracer.record("e2e.capture_to_result", packet.t_mono, time.perf_counter(), packet.seq)
+
+    def _trigger_clip(self, t):
+        if isinstance(self.output, ClipRecorder):
+            self.output.trigger(t)
+
+    def _encode(self, packet):
+        if packet.preview is not None:
+            image, origin, scale = packet.preview
+        else:
+            # Detection runs in a pool worker: downscale the frame here
+            image = cv2.resize(
+                packet.frame, None, fx=config.SCALE, fy=config.SCALE, interpolation=cv2.INTER_AREA
+            )
+            if not self.camera.ring.is_valid(packet.seq):
+                return  # capture reused the slot during the resize: torn image
+            origin, scale = np.zeros(2, np.float32), np.float32(1 / config.SCALE)
+
+        if packet.contours:
+            small = [((c - origin) / scale).astype(np.int32) for c in packet.contours]
+            cv2.drawContours(image, small, -1, (0, 255, 0), 1)
+        if packet.movement_active:
+            general_utils.draw_movement_overlay(image, scale=0.5, thickness=1)
+
+        self.preview.encode(packet.seq, image)
+
+    def _send_rtp(self, packet):
+        ring = self.camera.ring
+        if not ring.is_valid(packet.seq):
+            return  # slot already reused by capture
+        self.rtp.write(
+            packet.frame,
+            still_valid=lambda: ring.is_valid(packet.seq),
+            overlay=general_utils.draw_movement_overlay if packet.movement_active else None,
+        )
+
+    def _record(self, packet):
+        # The frame is a view into the camera ring, which capture may reuse
+        # at any time: copy it out, and only write the copy if the slot
+        # still held this frame once the copy was done.
+        ring = self.camera.ring
+        if not ring.is_valid(packet.seq):
+            self.record_overruns += 1
+            return
+        frame = packet.frame
+        if self._record_buf is None or self._record_buf.shape != frame.shape:
+            self._record_buf = np.empty_like(frame)
+        np.copyto(self._record_buf, frame)
+        if not ring.is_valid(packet.seq):
+            self.record_overruns += 1
+            return
+        if packet.movement_active:
+            general_utils.draw_movement_overlay(self._record_buf)
+        self.output.save_frame(self._record_buf, t=packet.t_capture)
+
+    # --------------------------------------------------
+    # Status
+    # --------------------------------------------------
+
+    def stats(self):
+        """Live capture / detection FPS over the last ~2 s, plus drop counters."""
+        recent = list(self._recent)
+        capture_fps = detect_fps = 0.0
+        if len(recent) >= 2:
+            (t0, seq0), (t1, seq1) = recent[0], recent[-1]
+            dt = max(t1 - t0, 1e-6)
+            # seq counts every captured frame, len() only the ones we processed
+            capture_fps = (seq1 - seq0) / dt
+            detect_fps = (len(recent) - 1) / dt
+
+        return {
+            "capture_fps": round(capture_fps, 2),
+            "detect_fps": round(detect_fps, 2),
+            "frames": self.frame_count,
+            "viewers": self.stream.subscribers,
+            "preview": self.preview.stats(),
+            "dropped": self.detect_queue.dropped,
+            "record_queue": len(self.record_queue),
+            "record_queue_high_water": self.record_queue.high_water,
+            "record_dropped": self.record_queue.dropped,
+            "record_blocked_s": round(self.record_queue.blocked_time, 3),
+            "record_overruns": self.record_overruns,
+            "recording": self.output.stats(),
+            "schedule": self.schedule_info(),
+            "rtp": self.rtp.stats() if self.rtp is not None else None,
+            "actuators": (
+                self.actuators.stats() if self.actuators is not None else general_utils.actuator_stats()
+            ),
+        }
+
+
+def camera_from_config(camera_index=1, resolution=(640, 360), seed=None):
+    """Frame source selected by config.CAMERA_SOURCE."""
+    source = config.CAMERA_SOURCE
+    kwargs = {}
+    if source == "synthetic":
+        kwargs = {
+            "framerate": config.SYNTHETIC_FPS,
+            "seed": config.SYNTHETIC_SEED if seed is None else seed,
+            "spontaneous_rate": config.SYNTHETIC_SPONTANEOUS_RATE,
+        }
+    elif source == "video":
+        kwargs = {"path": config.VIDEO_SOURCE_PATH, "realtime": config.VIDEO_SOURCE_REALTIME}
+
+    return make_camera(
+        source,
+        camera_index=camera_index,
+        resolution=resolution,
+        ring_slots=config.FRAME_RING_SLOTS,
+        **kwargs,
+    )
+
+
+def tank_dirs(name, log_root="logs", output_root="output"):
+    """Per-tank log / recording directories."""
+    return os.path.join(log_root, name), os.path.join(output_root, name)
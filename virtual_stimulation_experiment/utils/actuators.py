@@ -0,0 +1,295 @@
+# utils/actuators.py
+"""
+Long-lived actuator service: one worker thread per device (LED, sound,
+stimulator) that owns the device and takes commands from a queue.
+
+    actuators = ActuatorService(devices)
+    actuators.start()
+    future = actuators.blink(3, 0.3, 0.3)   # returns at once
+    future.result()   # {"status": "done", "latency": ..., "t_start": ..., "t_end": ...}
+
+Each device has its own thread, so a one-second beep never delays a
+blink, and nothing waits behind either of them to trigger the stimulator.
+Blink patterns are turned into a timeline of (offset, on/off) steps up
+front and played against one start time, so the steps don't drift with
+the time spent writing to the port. An LED that plays patterns itself
+(utils/led_protocol.py) gets the whole pattern in one command instead,
+and the device's own timestamps become the command's start / end times.
+
+A command that arrives while the same device is still busy is handled by
+the channel's overlap policy:
+
+    "merge"  → folded into the running command; its future completes with
+               that command's result (and times) as "merged"
+    "reject" → not executed; its future completes at once as "rejected"
+    "queue"  → runs after the current one
+
+A merged or rejected command never plays on its own, and that is known as
+soon as it is submitted (dropped(future)), before anything is logged for it.
+A device shared by several tanks should use "queue" (config), or each
+tank's stimulus after the first would be folded away.
+
+Command-to-execution latency (submit → first device write) is kept per
+channel. Timestamps are perf_counter().
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+
+import config
+from utils.stats import StreamSummary
+from utils.tracing import tracer
+
+MERGE = "merge"
+REJECT = "reject"
+QUEUE = "queue"
+
+_STOP = object()
+
+
+def dropped(future):
+    """
+    "merged" / "rejected" if the command won't play on its own (decided at
+    submit, so this never waits), else None.
+    """
+    if future.merged:
+        return "merged"
+    if future.done() and future.result()["status"] == "rejected":
+        return "rejected"
+    return None
+
+
+def blink_timeline(count, on_s, off_s):
+    """[(offset s, led on?)] for `count` blinks, ending with the LED off."""
+    steps = []
+    period = on_s + off_s
+    for i in range(count):
+        steps.append((i * period, True))
+        steps.append((i * period + on_s, False))
+    return steps
+
+
+class CommandFuture(Future):
+    """Future of one command; .merged is set at submit if it joined a running one."""
+
+    def __init__(self):
+        super().__init__()
+        self.merged = False
+
+
+class Command:
+    __slots__ = ("action", "run", "t_submit", "future", "merged")
+
+    def __init__(self, action, run):
+        self.action = action
+        self.run = run          # run(channel) → perf_counter() of the first device write
+        self.t_submit = time.perf_counter()
+        self.future = CommandFuture()
+        self.merged = []        # commands folded into this one
+
+
+class ActuatorChannel(threading.Thread):
+    """Worker thread that owns one device and runs its commands in order."""
+
+    def __init__(self, name, policy=MERGE):
+        super().__init__(name=f"actuator-{name}", daemon=True)
+        if policy not in (MERGE, REJECT, QUEUE):
+            raise ValueError(f"Unknown overlap policy: {policy}")
+        self.channel = name
+        self.policy = policy
+
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._busy = None           # command queued or running
+        self._stop_event = threading.Event()
+
+        self.executed = 0
+        self.merged = 0
+        self.rejected = 0
+        self.failed = 0
+        self.latency = StreamSummary()
+
+    def submit(self, action, run):
+        command = Command(action, run)
+        with self._lock:
+            if self._busy is not None and self.policy != QUEUE:
+                if self.policy == MERGE:
+                    self._busy.merged.append(command)
+                    command.future.merged = True
+                    self.merged += 1
+                else:
+                    self.rejected += 1
+                    command.future.set_result({"status": "rejected", "action": action})
+                return command.future
+            if self.policy != QUEUE:
+                self._busy = command
+        self._queue.put(command)
+        return command.future
+
+    def wait_until(self, t):
+        """Sleep until perf_counter() reaches t; False if the service stops first."""
+        delay = t - time.perf_counter()
+        if delay > 0:
+            return not self._stop_event.wait(delay)
+        return not self._stop_event.is_set()
+
+    def run(self):
+        while True:
+            command = self._queue.get()
+            if command is _STOP:
+                break
+            self._execute(command)
+
+    def _execute(self, command):
+        result = {"action": command.action}
+        try:
+            t_start = command.run(self)
+            t_end = time.perf_counter()
+            latency = t_start - command.t_submit
+            self.latency.add(latency)
+            self.executed += 1
+            tracer.record(f"actuator.{self.channel}", t_start, t_end)
+            result.update(status="done", t_start=t_start, t_end=t_end, latency=latency)
+        except Exception as e:
+            self.failed += 1
+            print(f"⚠️  Warning: {self.channel} command {command.action} failed: {e}")
+            result.update(status="failed", error=str(e))
+
+        with self._lock:
+            if self._busy is command:
+                self._busy = None
+            merged = command.merged
+            command.merged = []
+
+        command.future.set_result(result)
+        for other in merged:
+            other.future.set_result(dict(result, status="merged"))
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self._queue.put(_STOP)
+        self.join(timeout)
+
+    def stats(self):
+        late = self.latency.to_dict()
+        stats = {
+            "policy": self.policy,
+            "executed": self.executed,
+            "merged": self.merged,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+        if late["count"]:
+            stats["latency_ms"] = {
+                k: round(1000 * late[k], 3) for k in ("mean", "p50", "p99", "max")
+            }
+        return stats
+
+
+class ActuatorService:
+    """LED, sound and stimulator channels over one Devices bundle."""
+
+    def __init__(
+        self,
+        devices,
+        led_policy=config.LED_OVERLAP_POLICY,
+        sound_policy=config.SOUND_OVERLAP_POLICY,
+    ):
+        self.devices = devices
+        self.led = ActuatorChannel("led", led_policy)
+        self.sound = ActuatorChannel("sound", sound_policy)
+        # Every closed-loop trigger counts, so these are never merged away
+        self.stimulator = ActuatorChannel("stimulator", QUEUE)
+        self.channels = (self.led, self.sound, self.stimulator)
+
+    def start(self):
+        for channel in self.channels:
+            channel.start()
+
+    def stop(self, timeout=2):
+        if hasattr(self.devices.led, "stop_pattern"):
+            self.devices.led.stop_pattern()  # the LED channel is waiting for it
+        for channel in self.channels:
+            channel.stop(timeout)
+
+    # --------------------------------------------------
+    # Commands (any thread; never block)
+    # --------------------------------------------------
+
+    def blink(self, count, on_s, off_s):
+        led = self.devices.led
+        if hasattr(led, "play"):
+            return self._play_pattern(led, count, on_s, off_s)
+        timeline = blink_timeline(count, on_s, off_s)
+
+        def run(channel):
+            t0 = time.perf_counter()
+            lit = False
+            try:
+                for offset, state in timeline:
+                    if not channel.wait_until(t0 + offset):
+                        break
+                    led.set(state)
+                    lit = state
+            finally:
+                if lit:
+                    led.set(False)  # cut short (stop, serial error): never leave it on
+            return t0
+
+        return self.led.submit("blink", run)
+
+    def _play_pattern(self, led, count, on_s, off_s):
+        timeout = count * (on_s + off_s) + 2 * config.LED_ACK_TIMEOUT
+
+        def run(channel):
+            t_send = time.perf_counter()
+            try:
+                result = led.play(count, on_s, off_s).result(timeout)
+            except FuturesTimeout:
+                led.stop_pattern()  # don't leave a lost pattern running
+                raise RuntimeError("LED pattern not acknowledged") from None
+            if result["status"] not in ("done", "stopped"):
+                raise RuntimeError(f"LED pattern {result['status']}")
+            # Device edge time when the clocks are synced, else when it was sent
+            return result["t_start"] if result["t_start"] is not None else t_send
+
+        return self.led.submit("blink", run)
+
+    def beep(self, freq_hz, duration_ms):
+        sound = self.devices.sound
+
+        def run(channel):
+            t0 = time.perf_counter()
+            sound.beep(freq_hz, duration_ms)
+            return t0
+
+        return self.sound.submit("beep", run)
+
+    def trigger(self):
+        stimulator = self.devices.stimulator
+
+        def run(channel):
+            t0 = time.perf_counter()
+            pending = stimulator.trigger()
+            if isinstance(pending, Future):
+                # Queued to the stimulator's driver thread: wait here, so
+                # the start time is when the pulse train really began
+                try:
+                    result = pending.result(config.STIM_COMMAND_TIMEOUT)
+                except FuturesTimeout:
+                    # Too late for its response window: make sure it never fires
+                    pending.cancel()
+                    raise RuntimeError("stimulator busy, trigger cancelled") from None
+                if result["status"] != "done":
+                    raise RuntimeError(f"stimulator returned {result['code']}")
+                return result["t_start"]
+            return t0
+
+        return self.stimulator.submit("trigger", run)
+
+    def stats(self):
+        stats = {channel.channel: channel.stats() for channel in self.channels}
+        if hasattr(self.devices.led, "stats"):
+            stats["led"]["device"] = self.devices.led.stats()
+        return stats
@@ -1,12 +1,84 @@
 # camera_stream.py
+import time
+from abc import ABC, abstractmethod
+
 import cv2
-from collections import deque
+import numpy as np
+
+from utils.frame_ring import SharedFrameRing
+from utils.tracing import tracer
+
+
+class RingCamera(ABC):
+    """
+    Base for frame sources. Frames are captured straight into shared memory
+    so detection, streaming and recording (in this or other processes) read
+    the same pixels without copies.
+
+    Subclasses set self.width / self.height, call _init_ring() and
+    implement _read(slot).
+    """
+
+    def _init_ring(self, shape, ring_slots):
+        self.ring = SharedFrameRing(shape, np.uint8, slots=ring_slots)
+        self.last_seq = 0
+        self.rejected_frames = 0   # frames that didn't match the ring's shape
+
+    @abstractmethod
+    def _read(self, slot):
+        """Fill `slot` (or return a new array); None when no frame is available."""
+
+    def _release(self):
+        pass
+
+    def get_frame(self):
+        """
+        Return the next frame.
+
+        The returned array is a view into the frame ring and stays valid
+        until the ring wraps around (ring.is_valid(self.last_seq)). Every
+        frame returned is committed under last_seq; a frame of the wrong
+        size has no ring slot, so it is dropped (None).
+        """
+        seq, slot = self.ring.begin_write()
+        tr = tracer.begin("camera", seq)
+        frame = self._read(slot)
+        if frame is None:
+            return None
+        tr.mark("read")
+
+        t = time.time()
+        if frame is not slot:
+            # Source ignored the destination buffer (e.g. size changed)
+            if frame.shape != slot.shape:
+                self.rejected_frames += 1
+                if self.rejected_frames == 1:
+                    print(
+                        f"⚠️  Warning: camera delivered {frame.shape}, expected {slot.shape}; "
+                        f"dropping frames of the wrong size"
+                    )
+                return None
+            slot[...] = frame
+
+        self.ring.commit(seq, t)
+        self.last_seq = seq
+        tr.mark("commit")
+        return slot
+
+    def release(self):
+        """Release the source and the shared frame buffer."""
+        try:
+            self._release()
+        except:
+            pass
 
-class LiveCamera:
-    def __init__(self, camera_index=1, resolution=(640, 360), framerate=30):
+        self.ring.close()
+
+
+class LiveCamera(RingCamera):
+    def __init__(self, camera_index=1, resolution=(640, 360), framerate=30, ring_slots=64):
         self.width, self.height = resolution
         self.fps = framerate
-        self.jpeg_buffer = deque(maxlen=1)
 
         # Open USB webcam
         self.cap = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
@@ -24,24 +96,15 @@ class LiveCamera:
         # Update actual resolution from camera
         self.height, self.width = frame.shape[:2]
 
-    def get_frame(self):
-        """Return next frame from USB webcam."""
-        ok, frame = self.cap.read()
+        self._init_ring(frame.shape, ring_slots)
+
+    def _read(self, slot):
+        """Next frame from USB webcam."""
+        ok, frame = self.cap.read(slot)
         if not ok:
             return None
         return frame
 
-    def release(self):
+    def _release(self):
         """Release the webcam."""
-        try:
-            self.cap.release()
-        except:
-            pass
-        
-    def update_jpeg(self, jpeg_bytes):
-        self.jpeg_buffer.append(jpeg_bytes)
-
-    def get_latest_jpeg(self):
-        if not self.jpeg_buffer:
-            return None
-        return self.jpeg_buffer[-1]
\ No newline at end of file
+        self.cap.release()
@@ -0,0 +1,182 @@
+# utils/devices.py
+import time
+
+import config
+
+from stim.stim import StimulatorService, make_driver
+from utils.led_protocol import FramedSerialLed
+
+
+# ============================
+# Hardware backends
+# ============================
+
+class SerialLed:
+    """LED stimulator on a serial port that understands ON / OFF lines."""
+
+    def __init__(self, port, baudrate):
+        self.ser = None
+        try:
+            import serial
+            self.ser = serial.Serial(port, baudrate, timeout=1)
+        except Exception:
+            print("⚠️  Warning: Could not connect to LED stimulator on specified COM port.")
+
+    def set(self, on):
+        if self.ser is None:
+            print("⚠️  Warning: LED stimulator not connected.")
+            return
+        self.ser.write(b"ON\n" if on else b"OFF\n")
+
+    def blink(self, count, on_s, off_s):
+        """Blocking blink; the experiment plays patterns through utils/actuators.py."""
+        for _ in range(count):
+            self.set(True)
+            time.sleep(on_s)
+            self.set(False)
+            time.sleep(off_s)
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+
+class WinSound:
+    def beep(self, freq_hz, duration_ms):
+        import winsound
+        winsound.Beep(freq_hz, duration_ms)  # frequency (Hz), duration (ms)
+
+    def close(self):
+        pass
+
+
+class BrainStimulator:
+    """
+    Closed-loop brain stimulus trigger. With a StimulatorService (stim/stim.py)
+    it queues one config.STIM_PULSE train and returns its Future; without
+    one the trigger is only printed. A train that hasn't started within
+    STIM_COMMAND_TIMEOUT is dropped, never fired late.
+    """
+
+    def __init__(self, service=None):
+        self.service = service
+        if service is not None:
+            service.start()
+
+    def trigger(self):
+        if self.service is None:
+            print("Sending brain stimulus trigger...")
+            return None
+        return self.service.fire(deadline=time.perf_counter() + config.STIM_COMMAND_TIMEOUT)
+
+    def close(self):
+        if self.service is not None:
+            self.service.stop(timeout=2)
+
+
+# ============================
+# Mock backends
+# ============================
+
+class MockDevice:
+    """
+    Stand-in that records (timestamp, action, params) for every call instead
+    of touching hardware. Listeners are called as listener(action, t).
+    """
+
+    def __init__(self, name, clock=time.time):
+        self.name = name
+        self.clock = clock
+        self.calls = []
+        self.listeners = []
+
+    def _record(self, action, **params):
+        t = self.clock()
+        self.calls.append((t, action, params))
+        for listener in self.listeners:
+            listener(action, t)
+
+    def times(self, action=None):
+        return [t for t, a, _ in self.calls if action is None or a == action]
+
+    def close(self):
+        pass
+
+
+class MockLed(MockDevice):
+    def __init__(self, clock=time.time):
+        super().__init__("led", clock)
+
+    def set(self, on):
+        self._record("on" if on else "off")
+
+    def blink(self, count, on_s, off_s):
+        self._record("blink", count=count, on_s=on_s, off_s=off_s)
+
+
+class MockSound(MockDevice):
+    def __init__(self, clock=time.time):
+        super().__init__("sound", clock)
+
+    def beep(self, freq_hz, duration_ms):
+        self._record("beep", freq_hz=freq_hz, duration_ms=duration_ms)
+
+
+class MockStimulator(MockDevice):
+    def __init__(self, clock=time.time):
+        super().__init__("stimulator", clock)
+
+    def trigger(self):
+        self._record("trigger")
+
+
+# ============================
+# Factory
+# ============================
+
+class Devices:
+    def __init__(self, led, sound, stimulator):
+        self.led = led
+        self.sound = sound
+        self.stimulator = stimulator
+
+    def close(self):
+        for device in (self.led, self.sound, self.stimulator):
+            device.close()
+
+
+def make_led(backend="hardware", port=None, baudrate=None, protocol="lines"):
+    """The LED of make_devices() on its own (e.g. one LED per tank)."""
+    if backend == "mock":
+        return MockLed()
+    if backend != "hardware":
+        raise ValueError(f"Unknown actuator backend: {backend}")
+    if protocol == "framed":
+        return FramedSerialLed(port, baudrate)
+    if protocol == "lines":
+        return SerialLed(port, baudrate)
+    raise ValueError(f"Unknown LED protocol: {protocol}")
+
+
+def make_devices(
+    backend="hardware",
+    led_port=None,
+    led_baudrate=None,
+    led_protocol="lines",
+    stim_driver=None,
+):
+    """
+    "hardware" → serial LED, winsound, brain stimulus trigger
+    "mock"     → recording stand-ins that run anywhere
+
+    led_protocol picks the LED firmware: "lines" (ON / OFF) or "framed".
+    stim_driver ("deuteron" / "mock") makes the trigger fire pulse trains.
+    """
+    if backend == "hardware":
+        led = make_led(backend, led_port, led_baudrate, led_protocol)
+        service = StimulatorService(make_driver(stim_driver)) if stim_driver else None
+        return Devices(led, WinSound(), BrainStimulator(service))
+    if backend == "mock":
+        return Devices(MockLed(), MockSound(), MockStimulator())
+    raise ValueError(f"Unknown actuator backend: {backend}")
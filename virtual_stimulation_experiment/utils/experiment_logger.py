@@ -1,15 +1,66 @@
 import os
+import queue
+import threading
 import time
-import statistics
 from datetime import datetime
 
+import numpy as np
+
+import config
+from utils.stats import StreamSummary
+
+# Columns of the structured event file (<name>.events.csv)
+EVENT_COLUMNS = ("t", "frame", "event", "score", "detail")
+
+# Columns of the movement bout file (<name>.bouts.csv), one row per bout
+BOUT_COLUMNS = (
+    "onset", "offset", "duration", "onset_frame", "offset_frame",
+    "frames", "peak_score", "mean_score", "reaction",
+)
+
+_STOP = object()
+
+
+def load_events(path):
+    """
+    Load a <name>.events.csv file as a NumPy structured array with fields
+    t (float), frame (int, -1 if unknown), event (str), score (float, nan if
+    unknown) and detail (str). pandas.read_csv(path) works as well.
+    """
+    return np.genfromtxt(
+        path,
+        delimiter=",",
+        names=True,
+        dtype=[("t", "f8"), ("frame", "i8"), ("event", "U32"), ("score", "f8"), ("detail", "U64")],
+        encoding="utf-8",
+        ndmin=1,
+    )
+
+
+def load_bouts(path):
+    """Load a <name>.bouts.csv file as a NumPy structured array (columns as BOUT_COLUMNS)."""
+    return np.genfromtxt(
+        path,
+        delimiter=",",
+        names=True,
+        dtype=[
+            ("onset", "f8"), ("offset", "f8"), ("duration", "f8"),
+            ("onset_frame", "i8"), ("offset_frame", "i8"), ("frames", "i8"),
+            ("peak_score", "f8"), ("mean_score", "f8"), ("reaction", "i8"),
+        ],
+        encoding="utf-8",
+        ndmin=1,
+    )
+
 
 class ExperimentLogger:
     class ReactionTracker:
-        def __init__(self):
+        def __init__(self, window=config.STATS_WINDOW):
             self.current_stim_time = None
             self.first_reaction_time = None
-            self.latencies = []
+            self.latencies = StreamSummary(window)
+            # stats() / summary() are read live from the server thread
+            self._lock = threading.Lock()
 
         def on_stimulation(self, t):
             self.current_stim_time = t
@@ -22,34 +73,77 @@ class ExperimentLogger:
                 and self.first_reaction_time is None
             ):
                 self.first_reaction_time = t
-                self.latencies.append(t - self.current_stim_time)
+                with self._lock:
+                    self.latencies.add(t - self.current_stim_time)
 
         def stats(self):
-            if not self.latencies:
-                return None, None, 0
+            """(mean, approximate median, count) over the whole session."""
+            with self._lock:
+                n = self.latencies.count
+                if n == 0:
+                    return None, None, 0
+                return self.latencies.total.mean, self.latencies.sketch.quantile(0.5), n
 
-            mean = sum(self.latencies) / len(self.latencies)
-            median = statistics.median(self.latencies)
-            return mean, median, len(self.latencies)
+        def summary(self):
+            with self._lock:
+                return self.latencies.to_dict()
 
     # --------------------------------------------------
     # Logger init
     # --------------------------------------------------
 
-    def __init__(self, base_dir="logs"):
+    def __init__(
+        self,
+        base_dir="logs",
+        name=None,
+        flush_events=config.LOG_FLUSH_EVENTS,
+        flush_interval=config.LOG_FLUSH_INTERVAL,
+        frame_events=config.LOG_FRAME_EVENTS,
+    ):
         os.makedirs(base_dir, exist_ok=True)
 
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_path = os.path.join(base_dir, f"experiment_{ts}.log")
+        if name is None:
+            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+            name = f"experiment_{ts}"
+        self.log_path = os.path.join(base_dir, f"{name}.log")
+        self.events_path = os.path.join(base_dir, f"{name}.events.csv")
+        self.bouts_path = os.path.join(base_dir, f"{name}.bouts.csv")
 
+        # Movements and reactions are counted in bouts, not frames
         self.total_movements = 0
         self.total_stimulations = 0
+        self.skipped_stimulations = 0
         self.total_reactions = 0
+        self.movement_frames = 0
+        self.bout_durations = StreamSummary(config.STATS_WINDOW)
+        # Scheduled → actual stimulus time, seconds
+        self.stim_jitter = StreamSummary(config.STATS_WINDOW)
+        self._stats_lock = threading.Lock()
+
+        # Also write a MOVEMENT / REACTION_MOVEMENT record for every active frame
+        self.frame_events = frame_events
 
         self.reactions = self.ReactionTracker()
 
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+
+        self._log_file = open(self.log_path, "a")
+        self._events_file = open(self.events_path, "a")
+        if self._events_file.tell() == 0:
+            self._events_file.write(",".join(EVENT_COLUMNS) + "\n")
+        self._bouts_file = open(self.bouts_path, "a")
+        if self._bouts_file.tell() == 0:
+            self._bouts_file.write(",".join(BOUT_COLUMNS) + "\n")
+
         self._write_header()
 
+        # Log calls only put a tuple (event) or a Bout on this queue; the
+        # writer thread does the I/O
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._writer_loop, name=f"log-{name}", daemon=True)
+        self._writer.start()
+
     # --------------------------------------------------
     # Internal helpers
     # --------------------------------------------------
@@ -61,8 +155,68 @@ class ExperimentLogger:
         return f"{t:.3f}"
 
     def _write(self, msg):
-        with open(self.log_path, "a") as f:
-            f.write(msg + "\n")
+        self._log_file.write(msg + "\n")
+
+    def _put(self, t, event, frame=None, score=None, detail=""):
+        self._queue.put((t, event, frame, score, detail))
+
+    def _writer_loop(self):
+        pending = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                break
+            if item is not None:
+                pending.append(item)
+
+            if len(pending) >= self.flush_events or time.monotonic() >= deadline:
+                self._flush(pending)
+                pending = []
+                deadline = time.monotonic() + self.flush_interval
+
+        self._flush(pending)
+
+    def _flush(self, records):
+        if not records:
+            return
+
+        lines = []
+        rows = []
+        bouts = []
+        for record in records:
+            if not isinstance(record, tuple):
+                bouts.append(self._bout_row(record))
+                continue
+
+            t, event, frame, score, detail = record
+            text = f"[{self._fmt(t)}] {event}"
+            if detail:
+                text += f" {detail}"
+            lines.append(text + "\n")
+            rows.append(
+                f"{t:.6f},{-1 if frame is None else frame},{event},"
+                f"{'nan' if score is None else format(score, '.4g')},{detail}\n"
+            )
+
+        self._log_file.writelines(lines)
+        self._events_file.writelines(rows)
+        self._bouts_file.writelines(bouts)
+        self._log_file.flush()
+        self._events_file.flush()
+        self._bouts_file.flush()
+
+    def _bout_row(self, bout):
+        return (
+            f"{bout.onset:.6f},{bout.offset:.6f},{bout.duration:.6f},"
+            f"{bout.onset_frame},{bout.offset_frame},{bout.frames},"
+            f"{bout.peak_score:.4g},{bout.mean_score:.4g},{int(bout.reaction)}\n"
+        )
 
     def _write_header(self):
         self._write("=" * 60)
@@ -74,32 +228,98 @@ class ExperimentLogger:
     # Public logging API
     # --------------------------------------------------
 
-    def log_trial_start(self):
-        t = self._now()
-        self._write(f"[{self._fmt(t)}] TRIAL_START")
+    def log_trial_start(self, t=None, detail=""):
+        t = self._now() if t is None else t
+        self._put(t, "TRIAL_START", detail=detail)
+
+    def log_trial_end(self, t=None):
+        t = self._now() if t is None else t
+        self._put(t, "TRIAL_END")
 
-    def log_movement(self):
-        t = self._now()
+    def log_bout_onset(self, bout):
+        """A movement bout started; bout.reaction marks it as a response to the last stimulus."""
         self.total_movements += 1
-        self._write(f"[{self._fmt(t)}] MOVEMENT")
+        detail = ""
+        if bout.reaction:
+            self.total_reactions += 1
+            self.reactions.on_reaction(bout.onset)
+            detail = "reaction"
+        self._put(bout.onset, "BOUT_ONSET", bout.onset_frame, bout.peak_score, detail)
 
-    def log_stimulation(self, stim_type="visual+audio"):
-        t = self._now()
+    def log_bout_end(self, bout):
+        """A movement bout ended; writes its row to the bouts file."""
+        with self._stats_lock:
+            self.movement_frames += bout.frames
+            self.bout_durations.add(bout.duration)
+        self._put(
+            bout.offset, "BOUT_OFFSET", bout.offset_frame, bout.peak_score,
+            f"duration={bout.duration:.3f} mean_score={bout.mean_score:.2f}",
+        )
+        self._queue.put(bout)
+
+    def log_movement(self, t=None, frame=None, score=None):
+        """Per-frame detail, only written when frame_events is on."""
+        if not self.frame_events:
+            return
+        t = self._now() if t is None else t
+        self._put(t, "MOVEMENT", frame, score)
+
+    def log_stimulation(self, stim_type="visual+audio", t=None, jitter=None):
+        """`jitter`: seconds between the scheduled and the actual stimulus time."""
+        t = self._now() if t is None else t
         self.total_stimulations += 1
         self.reactions.on_stimulation(t)
-        self._write(f"[{self._fmt(t)}] STIMULATION type={stim_type}")
+        detail = f"type={stim_type}"
+        if jitter is not None:
+            with self._stats_lock:
+                self.stim_jitter.add(jitter)
+            detail += f" jitter_ms={1000 * jitter:.3f}"
+        self._put(t, "STIMULATION", detail=detail)
+
+    def log_stimulation_skipped(self, t=None, reason=""):
+        """A scheduled stimulus that never reached the fish; no response window."""
+        t = self._now() if t is None else t
+        self.skipped_stimulations += 1
+        self._put(t, "STIMULATION_SKIPPED", detail=reason)
+
+    def log_reaction(self, t=None, frame=None, score=None):
+        """Per-frame detail, only written when frame_events is on."""
+        if not self.frame_events:
+            return
+        t = self._now() if t is None else t
+        self._put(t, "REACTION_MOVEMENT", frame, score)
+
+    # --------------------------------------------------
+    # Live statistics
+    # --------------------------------------------------
+
+    def summary(self):
+        """Counters plus reaction latency / bout duration stats, cheap enough to poll."""
+        with self._stats_lock:
+            bouts = self.bout_durations.to_dict()
+            jitter = self.stim_jitter.to_dict()
+            movement_frames = self.movement_frames
 
-    def log_reaction(self):
-        t = self._now()
-        self.total_reactions += 1
-        self.reactions.on_reaction(t)
-        self._write(f"[{self._fmt(t)}] REACTION_MOVEMENT")
+        return {
+            "movement_bouts": self.total_movements,
+            "stimulations": self.total_stimulations,
+            "skipped_stimulations": self.skipped_stimulations,
+            "reactions": self.total_reactions,
+            "movement_frames": movement_frames,
+            "reaction_latency": self.reactions.summary(),
+            "bout_duration": bouts,
+            "stim_jitter": jitter,
+        }
 
     # --------------------------------------------------
     # Final summary
     # --------------------------------------------------
 
     def close(self):
+        # Drain everything still queued before the summary goes in
+        self._queue.put(_STOP)
+        self._writer.join()
+
         non_reaction_movements = self.total_movements - self.total_reactions
         mean_rt, median_rt, n_rt = self.reactions.stats()
 
@@ -107,10 +327,23 @@ class ExperimentLogger:
         self._write("EXPERIMENT END")
         self._write(f"End time: {datetime.now().isoformat()}")
         self._write("-" * 60)
-        self._write(f"Total movements: {self.total_movements}")
+        self._write(f"Total movement bouts: {self.total_movements}")
         self._write(f"Total stimulations: {self.total_stimulations}")
+        self._write(f"Stimulations skipped (actuators busy): {self.skipped_stimulations}")
         self._write(f"Total reactions to stimulation: {self.total_reactions}")
-        self._write(f"Total movements NOT reactions: {non_reaction_movements}")
+        self._write(f"Total bouts NOT reactions: {non_reaction_movements}")
+        self._write(f"Frames with movement: {self.movement_frames}")
+
+        self._write("-" * 60)
+        self._write("BOUT STATISTICS")
+
+        bouts = self.bout_durations.to_dict()
+        if bouts["count"] == 0:
+            self._write("No completed bouts.")
+        else:
+            self._write(f"Mean bout duration: {bouts['mean']:.3f} s")
+            self._write(f"Median bout duration: {bouts['p50']:.3f} s")
+            self._write(f"Longest bout: {bouts['max']:.3f} s")
 
         self._write("-" * 60)
         self._write("REACTION TIME STATISTICS")
@@ -121,5 +354,26 @@ class ExperimentLogger:
             self._write(f"Reaction count: {n_rt}")
             self._write(f"Mean reaction time: {mean_rt:.3f} s")
             self._write(f"Median reaction time: {median_rt:.3f} s")
+            rt = self.reactions.summary()
+            self._write(f"p90 / p99 reaction time: {rt['p90']:.3f} / {rt['p99']:.3f} s")
+            if rt["std"] is not None:
+                self._write(f"Reaction time std: {rt['std']:.3f} s")
+
+        self._write("-" * 60)
+        self._write("STIMULUS TIMING")
+
+        jitter = self.stim_jitter.to_dict()
+        if jitter["count"] == 0:
+            self._write("No scheduled stimuli.")
+        else:
+            self._write(f"Scheduled stimuli: {jitter['count']}")
+            self._write(
+                f"Scheduling jitter mean / p50 / p99 / max: {1000 * jitter['mean']:.3f} / "
+                f"{1000 * jitter['p50']:.3f} / {1000 * jitter['p99']:.3f} / {1000 * jitter['max']:.3f} ms"
+            )
 
         self._write("=" * 60)
+
+        self._log_file.close()
+        self._events_file.close()
+        self._bouts_file.close()
@@ -0,0 +1,211 @@
+# utils/frame_ring.py
+import time
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+
+
+# Per-slot header. seq == -1 means "being written / never written".
+_SLOT_DTYPE = np.dtype([("seq", "<i8"), ("nbytes", "<i8"), ("t", "<f8")])
+_HEAD_BYTES = 64  # latest committed seq (int64), padded to a cache line
+
+
+def _align(n, to=64):
+    return (n + to - 1) // to * to
+
+
+class SharedFrameRing:
+    """
+    Fixed-size ring of preallocated frame slots in shared memory.
+
+    One writer, any number of readers (threads or processes). Readers get
+    numpy views straight into the slot memory, no copies. Each slot carries
+    the sequence number of the frame in it, so a reader can check with
+    is_valid(seq) whether the writer has lapped it while it was looking.
+
+    Other processes attach with SharedFrameRing.attach(**ring.spec()).
+    """
+
+    def __init__(self, shape, dtype=np.uint8, slots=8, name=None, _attach=False):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.owner = not _attach
+
+        self.slot_bytes = _align(int(np.prod(self.shape)) * self.dtype.itemsize)
+        header_bytes = _align(_HEAD_BYTES + slots * _SLOT_DTYPE.itemsize)
+        total = header_bytes + slots * self.slot_bytes
+
+        if _attach:
+            self.shm = _attach_shm(name)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+
+        buf = self.shm.buf
+        self._head = np.ndarray((1,), dtype="<i8", buffer=buf, offset=0)
+        self._meta = np.ndarray((slots,), dtype=_SLOT_DTYPE, buffer=buf, offset=_HEAD_BYTES)
+        self._data = np.ndarray(
+            (slots, self.slot_bytes // self.dtype.itemsize),
+            dtype=self.dtype,
+            buffer=buf,
+            offset=header_bytes,
+        )
+
+        if self.owner:
+            self._head[0] = 0
+            self._meta["seq"] = -1
+            self._meta["nbytes"] = 0
+            self._meta["t"] = 0.0
+
+        self._next_seq = int(self._head[0]) + 1
+
+    # --------------------------------------------------
+    # Cross-process handles
+    # --------------------------------------------------
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def spec(self):
+        """Everything another process needs to attach to this ring."""
+        return {
+            "name": self.shm.name,
+            "shape": self.shape,
+            "dtype": self.dtype.str,
+            "slots": self.slots,
+        }
+
+    @classmethod
+    def attach(cls, name, shape, dtype, slots):
+        return cls(shape, dtype=dtype, slots=slots, name=name, _attach=True)
+
+    # --------------------------------------------------
+    # Writer API
+    # --------------------------------------------------
+
+    def _slot_view(self, idx, nbytes=None):
+        flat = self._data[idx]
+        if nbytes is None:
+            return flat[: int(np.prod(self.shape))].reshape(self.shape)
+        return flat[: nbytes // self.dtype.itemsize]
+
+    def begin_write(self):
+        """
+        Claim the next slot. Returns (seq, view) — fill the view in place
+        (e.g. cap.read(view)) and then call commit(seq, t).
+        """
+        seq = self._next_seq
+        idx = seq % self.slots
+        self._meta["seq"][idx] = -1
+        return seq, self._slot_view(idx)
+
+    def commit(self, seq, t=None, nbytes=None):
+        idx = seq % self.slots
+        if nbytes is None:
+            nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self._meta["nbytes"][idx] = nbytes
+        self._meta["t"][idx] = time.time() if t is None else t
+        self._meta["seq"][idx] = seq
+        self._head[0] = seq
+        self._next_seq = seq + 1
+
+    def write(self, data, t=None):
+        """Copy `data` into the next slot. Variable-length 1-D data is allowed."""
+        data = np.asarray(data, dtype=self.dtype)
+        seq, view = self.begin_write()
+
+        if data.shape == self.shape:
+            view[...] = data
+            nbytes = None
+        else:
+            flat = data.reshape(-1)
+            if flat.size > self._data.shape[1]:
+                raise ValueError(
+                    f"Frame of {flat.size} elements does not fit a ring slot "
+                    f"of {self._data.shape[1]}"
+                )
+            self._data[seq % self.slots, : flat.size] = flat
+            nbytes = flat.size * self.dtype.itemsize
+
+        self.commit(seq, t, nbytes)
+        return seq
+
+    # --------------------------------------------------
+    # Reader API
+    # --------------------------------------------------
+
+    @property
+    def head(self):
+        """Sequence number of the most recently committed frame (0 = none yet)."""
+        return int(self._head[0])
+
+    def is_valid(self, seq):
+        return seq > 0 and int(self._meta["seq"][seq % self.slots]) == seq
+
+    def read(self, seq):
+        """Return (t, view) for `seq`, or None if it was overwritten or never written."""
+        idx = seq % self.slots
+        if int(self._meta["seq"][idx]) != seq:
+            return None
+
+        nbytes = int(self._meta["nbytes"][idx])
+        t = float(self._meta["t"][idx])
+        if int(self._meta["seq"][idx]) != seq:
+            return None
+
+        if nbytes == int(np.prod(self.shape)) * self.dtype.itemsize:
+            view = self._slot_view(idx)
+        else:
+            view = self._slot_view(idx, nbytes)
+        return t, view
+
+    def latest(self):
+        """Return (seq, t, view) for the newest frame, or None."""
+        seq = self.head
+        if seq == 0:
+            return None
+
+        res = self.read(seq)
+        if res is None:
+            return None
+        t, view = res
+        return seq, t, view
+
+    # --------------------------------------------------
+    # Teardown
+    # --------------------------------------------------
+
+    def close(self):
+        # Drop our views before closing the mapping
+        self._head = self._meta = self._data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # A caller still holds a slot view; the mapping goes with the process
+            pass
+
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _attach_shm(name):
+    try:
+        # Python 3.13+: don't let this process' resource tracker unlink the
+        # owner's segment when we exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # multiprocessing children share the owner's tracker, so only an
+        # unrelated process needs to take its registration back
+        if multiprocessing.parent_process() is None:
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+        return shm
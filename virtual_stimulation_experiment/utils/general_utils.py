@@ -1,16 +1,83 @@
 import cv2
 import config
-import winsound
-import serial
-import time
+from utils.actuators import ActuatorService
+from utils.devices import Devices, make_devices, make_led
 
-ser = None
-try:
-    ser = serial.Serial(config.LED_COM_PORT, config.LED_BAUDRATE, timeout=1)
-except:
-    print("⚠️  Warning: Could not connect to LED stimulator on specified COM port.")
+# LED / sound / stimulator backends and the service that drives them,
+# created on first use so that importing this module never touches hardware
+_devices = None
+_actuators = None
 
-def draw_movement_overlay(frame):
+
+def get_devices():
+    global _devices
+    if _devices is None:
+        _devices = make_devices(
+            config.ACTUATOR_BACKEND,
+            led_port=config.LED_COM_PORT,
+            led_baudrate=config.LED_BAUDRATE,
+            led_protocol=config.LED_PROTOCOL,
+            stim_driver=config.STIM_DRIVER,
+        )
+    return _devices
+
+
+def set_devices(devices):
+    """Swap in a different backend (e.g. mocks for load tests)."""
+    global _devices
+    stop_actuators()
+    _devices = devices
+
+
+def get_actuators():
+    global _actuators
+    if _actuators is None:
+        _actuators = ActuatorService(get_devices())
+        _actuators.start()
+    return _actuators
+
+
+def stop_actuators():
+    """Stop the actuator threads (an LED left on is switched off)."""
+    global _actuators
+    if _actuators is not None:
+        _actuators.stop()
+        _actuators = None
+
+
+def close_devices():
+    """Stop the actuators, then release the devices (ports, stimulator thread)."""
+    global _devices
+    stop_actuators()
+    if _devices is not None:
+        _devices.close()
+        _devices = None
+
+
+def make_tank_actuators(led_port=None, led=None):
+    """
+    A started ActuatorService with its own LED on led_port (or the given LED
+    device), for a tank with its own LED stimulator. Sound and the brain
+    stimulator stay shared.
+    """
+    shared = get_devices()
+    if led is None:
+        led = make_led(config.ACTUATOR_BACKEND, led_port, config.LED_BAUDRATE, config.LED_PROTOCOL)
+    actuators = ActuatorService(Devices(led, shared.sound, shared.stimulator))
+    actuators.start()
+    return actuators
+
+
+def close_tank_actuators(actuators):
+    actuators.stop()
+    actuators.devices.led.close()
+
+
+def actuator_stats():
+    """Per-channel counts and command latency; None before the first command."""
+    return _actuators.stats() if _actuators is not None else None
+
+def draw_movement_overlay(frame, scale=1.2, thickness=3):
     """
     Draws a red rectangle with the text 'MOVEMENT DETECTED'
     in the upper-left corner of the frame.
@@ -19,8 +86,6 @@ def draw_movement_overlay(frame):
     label = "MOVEMENT DETECTED"
 
     font = cv2.FONT_HERSHEY_SIMPLEX
-    scale = 1.2
-    thickness = 3
 
     # Calculate text size
     (tw, th), _ = cv2.getTextSize(label, font, scale, thickness)
@@ -45,20 +110,18 @@ def draw_movement_overlay(frame):
         cv2.LINE_AA
     )
 
-def send_brain_stimulus():
-    print("Sending brain stimulus trigger...")
+# The actuator commands return at once with a Future; its result has the
+# status and the perf_counter() times the device actually ran.
+
+# `actuators`: a tank's own service; None = the shared one.
+
+def send_brain_stimulus(actuators=None):
+    return (actuators or get_actuators()).trigger()
 
 
-def make_sound():
-    winsound.Beep(500, 1000)  # frequency (Hz), duration (ms)
+def make_sound(actuators=None):
+    return (actuators or get_actuators()).beep(500, 1000)  # frequency (Hz), duration (ms)
 
 
-def blink_led():
-    if ser is None:
-        print("⚠️  Warning: LED stimulator not connected.")
-        return
-    for _ in range(config.BLINK_COUNT):
-        ser.write(b"ON\n")
-        time.sleep(config.BLINK_ON)
-        ser.write(b"OFF\n")
-        time.sleep(config.BLINK_OFF)
+def blink_led(actuators=None):
+    return (actuators or get_actuators()).blink(config.BLINK_COUNT, config.BLINK_ON, config.BLINK_OFF)
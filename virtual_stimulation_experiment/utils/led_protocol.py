@@ -0,0 +1,432 @@
+# utils/led_protocol.py
+"""
+Framed serial protocol for an LED stimulator that plays blink patterns on
+its own timer.
+
+The host uploads a whole pattern (count, on / off durations) in one
+command. The device acknowledges with the device-clock time of the first
+edge, and sends DONE with the time of the last one. So the blink timing
+no longer depends on host sleeps or USB-serial latency, and the host still
+knows when the LED really switched.
+
+Frame (both directions):
+
+    0xA5 | type u8 | seq u8 | len u8 | payload (len bytes) | CRC-8 (poly 0x07) of type..payload
+
+    host → device                          device → host
+    PING    0x01  -                        ACK   0x80  status u8, device time µs u64
+    SET     0x02  on u8                    DONE  0x81  status u8, device time µs u64
+    PATTERN 0x03  count u16, on µs u32, off µs u32      (little-endian)
+    STOP    0x04  -
+
+Every command gets an ACK with the same seq: for PING and SET the time it
+ran, for PATTERN the time of the first ON edge. A PATTERN is also finished
+with a DONE (time of the last OFF edge), or DONE status STOPPED when a
+STOP cut it short.
+
+Device times map onto the host's perf_counter() through an offset measured
+with PINGs (the reply with the shortest round trip wins). This repeats
+every LED_SYNC_INTERVAL seconds so crystal drift doesn't add up.
+
+FakeLedDevice runs the device side behind a pseudo-terminal (Linux /
+macOS), for tests and the load test. It also understands the old ON / OFF
+lines.
+"""
+import os
+import select
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import config
+from utils.stats import StreamSummary
+
+SYNC = 0xA5
+
+PING = 0x01
+SET = 0x02
+PATTERN = 0x03
+STOP = 0x04
+ACK = 0x80
+DONE = 0x81
+LINE = 0x00   # parser output for a text line outside any frame (ON / OFF protocol)
+
+OK = 0
+BUSY = 1
+BAD_COMMAND = 2
+STOPPED = 3
+STATUS_NAMES = {OK: "done", BUSY: "busy", BAD_COMMAND: "bad_command", STOPPED: "stopped"}
+
+_REPLY = struct.Struct("<BQ")
+_PATTERN = struct.Struct("<HII")
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc8(data):
+    crc = 0
+    for b in data:
+        crc = _CRC_TABLE[crc ^ b]
+    return crc
+
+
+def encode_frame(kind, seq, payload=b""):
+    body = bytes((kind, seq & 0xFF, len(payload))) + payload
+    return bytes((SYNC,)) + body + bytes((crc8(body),))
+
+
+class FrameParser:
+    """
+    Bytes in, (type, seq, payload) frames out. A frame with a bad CRC is
+    skipped byte by byte until the next SYNC. Complete text lines between
+    frames come out as (LINE, None, line).
+    """
+
+    MAX_LINE = 256
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._text = bytearray()
+        self.bad_frames = 0
+
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+        out = []
+        while buf:
+            if buf[0] != SYNC:
+                j = buf.find(SYNC)
+                n = len(buf) if j < 0 else j
+                self._text += buf[:n]
+                del buf[:n]
+                while b"\n" in self._text:
+                    line, _, rest = self._text.partition(b"\n")
+                    out.append((LINE, None, bytes(line.strip())))
+                    self._text = rest
+                if len(self._text) > self.MAX_LINE:
+                    self._text.clear()  # noise, not a line
+                continue
+
+            if len(buf) < 4 or len(buf) < 5 + buf[3]:
+                break  # wait for the rest of the frame
+            n = buf[3]
+            body = bytes(buf[1:4 + n])
+            if crc8(body) != buf[4 + n]:
+                self.bad_frames += 1
+                del buf[0]
+                continue
+            out.append((body[0], body[1], body[3:]))
+            del buf[:5 + n]
+        return out
+
+
+# ============================
+# Host side
+# ============================
+
+class _Pending:
+    __slots__ = ("kind", "t_send", "future", "t_start", "device_start")
+
+    def __init__(self, kind, t_send, future):
+        self.kind = kind
+        self.t_send = t_send
+        self.future = future
+        self.t_start = None
+        self.device_start = None
+
+
+class FramedSerialLed:
+    """
+    LED stimulator speaking the framed protocol. Commands never block:
+    play() / set() / stop_pattern() return a Future. play() resolves when
+    the pattern is over, with the status, the host-clock times of its
+    first and last edge (t_start, t_end) and the raw device times.
+    """
+
+    def __init__(
+        self,
+        port,
+        baudrate,
+        ack_timeout=config.LED_ACK_TIMEOUT,
+        sync_interval=config.LED_SYNC_INTERVAL,
+    ):
+        self.ack_timeout = ack_timeout
+        self.sync_interval = sync_interval
+
+        self._parser = FrameParser()
+        self._pending = {}
+        self._write_lock = threading.Lock()
+        self._seq = 0
+        self._running = False
+
+        self._sync = deque(maxlen=4)   # (round trip, offset) of recent PINGs
+        self.offset = None             # host perf_counter() − device seconds
+        self._last_sync = 0.0
+
+        self.ack_latency = StreamSummary()
+        self.timeouts = 0
+
+        self.ser = None
+        try:
+            import serial
+            self.ser = serial.Serial(port, baudrate, timeout=0.2)
+        except Exception:
+            print("⚠️  Warning: Could not connect to LED stimulator on specified COM port.")
+            return
+
+        self._running = True
+        self._reader = threading.Thread(target=self._read_loop, name="led-reader", daemon=True)
+        self._reader.start()
+        if not self.sync():
+            print("⚠️  Warning: LED stimulator did not answer; is the framed firmware loaded?")
+
+    # --------------------------------------------------
+    # Commands
+    # --------------------------------------------------
+
+    def play(self, count, on_s, off_s):
+        payload = _PATTERN.pack(count, round(on_s * 1e6), round(off_s * 1e6))
+        return self._send(PATTERN, payload)
+
+    def set(self, on):
+        return self._send(SET, bytes((1 if on else 0,)))
+
+    def stop_pattern(self):
+        return self._send(STOP)
+
+    def ping(self):
+        return self._send(PING)
+
+    def blink(self, count, on_s, off_s):
+        """Blocking: play one pattern and wait until it is over."""
+        return self.play(count, on_s, off_s).result(count * (on_s + off_s) + self.ack_timeout)
+
+    def sync(self, n=5):
+        """A few PINGs back to back to measure the clock offset; False if none answered."""
+        for _ in range(n):
+            try:
+                self.ping().result(self.ack_timeout)
+            except Exception:
+                self.timeouts += 1
+        return self.offset is not None
+
+    def _send(self, kind, payload=b""):
+        future = Future()
+        if self.ser is None:
+            future.set_result({"status": "disconnected"})
+            return future
+
+        with self._write_lock:
+            seq = self._seq
+            self._seq = (seq + 1) & 0xFF
+            # A seq is only reused 256 commands later; an entry still
+            # here by then never got its reply
+            self._pending[seq] = _Pending(kind, time.perf_counter(), future)
+            try:
+                self.ser.write(encode_frame(kind, seq, payload))
+            except Exception as e:
+                del self._pending[seq]
+                future.set_result({"status": "error", "error": str(e)})
+        return future
+
+    # --------------------------------------------------
+    # Replies (reader thread)
+    # --------------------------------------------------
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                if self._running:
+                    print(f"⚠️  Warning: LED stimulator read failed: {e}")
+                break
+            if not data:
+                continue
+            t_recv = time.perf_counter()
+            for kind, seq, payload in self._parser.feed(data):
+                if kind in (ACK, DONE) and len(payload) == _REPLY.size:
+                    self._reply(kind, seq, *_REPLY.unpack(payload), t_recv)
+
+    def to_host(self, device_us):
+        """Device timestamp (µs) → host perf_counter() seconds."""
+        if self.offset is None:
+            return None
+        return device_us / 1e6 + self.offset
+
+    def _reply(self, kind, seq, status, device_us, t_recv):
+        entry = self._pending.get(seq)
+        if entry is None:
+            return
+        name = STATUS_NAMES.get(status, f"status_{status}")
+
+        if kind == ACK:
+            self.ack_latency.add(t_recv - entry.t_send)
+            if entry.kind == PING:
+                self._add_sync(entry.t_send, t_recv, device_us)
+            elif entry.kind == PATTERN and status == OK:
+                # Running; the future completes with DONE
+                entry.t_start = self.to_host(device_us)
+                entry.device_start = device_us
+                return
+            del self._pending[seq]
+            entry.future.set_result({"status": name, "t": self.to_host(device_us), "device_us": device_us})
+            return
+
+        # DONE
+        del self._pending[seq]
+        entry.future.set_result({
+            "status": name,
+            "t_start": entry.t_start,
+            "t_end": self.to_host(device_us),
+            "device_start_us": entry.device_start,
+            "device_end_us": device_us,
+        })
+        if time.perf_counter() - self._last_sync > self.sync_interval:
+            self.ping()  # refresh the offset between patterns
+
+    def _add_sync(self, t_send, t_recv, device_us):
+        # The device stamped the PING somewhere in the round trip: assume the middle
+        self._sync.append((t_recv - t_send, (t_send + t_recv) / 2 - device_us / 1e6))
+        self.offset = min(self._sync)[1]
+        self._last_sync = t_recv
+
+    def close(self):
+        self._running = False
+        if self.ser is not None:
+            self._reader.join(timeout=1)
+            self.ser.close()
+
+    def stats(self):
+        late = self.ack_latency.to_dict()
+        stats = {
+            "connected": self.ser is not None,
+            "pending": len(self._pending),
+            "bad_frames": self._parser.bad_frames,
+            "timeouts": self.timeouts,
+        }
+        if self._sync:
+            stats["sync_rtt_ms"] = round(1000 * min(self._sync)[0], 3)
+        if late["count"]:
+            stats["ack_ms"] = {k: round(1000 * late[k], 3) for k in ("mean", "p50", "p99", "max")}
+        return stats
+
+
+# ============================
+# Fake device (tests)
+# ============================
+
+class FakeLedDevice(threading.Thread):
+    """
+    The firmware side behind a pseudo-terminal: open `port` like a serial
+    port. Patterns run on the simulated device's own clock, so its edges
+    are exact. Old ON / OFF lines switch the LED when they arrive.
+    self.edges is [(device time µs, led on?)].
+    """
+
+    def __init__(self, clock_offset=1000.0):
+        import pty
+        import tty
+
+        super().__init__(name="fake-led", daemon=True)
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self.clock_offset = clock_offset   # device clock ≠ host clock
+        self.edges = []
+        self.commands = 0
+        self._parser = FrameParser()
+        self._pattern = None   # (seq, start µs, count, on µs, off µs, end µs)
+        self._stop_event = threading.Event()
+
+    def now_us(self):
+        return int((time.perf_counter() + self.clock_offset) * 1e6)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            timeout = 0.2
+            if self._pattern is not None:
+                timeout = min(timeout, max(0.0, (self._pattern[5] - self.now_us()) / 1e6))
+            try:
+                ready, _, _ = select.select([self._master], [], [], timeout)
+                data = os.read(self._master, 4096) if ready else b""
+            except OSError:
+                break
+
+            for kind, seq, payload in self._parser.feed(data):
+                self._handle(kind, seq, payload)
+
+            if self._pattern is not None and self.now_us() >= self._pattern[5]:
+                self._finish(self._pattern[5], OK)
+
+    def _handle(self, kind, seq, payload):
+        now = self.now_us()
+        self.commands += 1
+
+        if kind == LINE:
+            if payload in (b"ON", b"OFF"):
+                self.edges.append((now, payload == b"ON"))
+            return
+
+        status = OK
+        if kind == PATTERN and len(payload) == _PATTERN.size:
+            if self._pattern is not None:
+                status = BUSY
+            else:
+                count, on_us, off_us = _PATTERN.unpack(payload)
+                end = now + (count - 1) * (on_us + off_us) + on_us
+                self._pattern = (seq, now, count, on_us, off_us, end)
+        elif kind == SET and len(payload) == 1:
+            if self._pattern is not None:
+                status = BUSY
+            else:
+                self.edges.append((now, bool(payload[0])))
+        elif kind == STOP:
+            if self._pattern is not None:
+                self._finish(now, STOPPED)
+        elif kind != PING:
+            status = BAD_COMMAND
+
+        self._write(encode_frame(ACK, seq, _REPLY.pack(status, now)))
+
+    def _finish(self, until, status):
+        """Lay down the pattern's edges up to `until`, LED off, DONE."""
+        seq, start, count, on_us, off_us, _ = self._pattern
+        self._pattern = None
+        for i in range(count):
+            on = start + i * (on_us + off_us)
+            if on > until:
+                break
+            self.edges.append((on, True))
+            off = on + on_us
+            if off > until:
+                self.edges.append((until, False))
+                break
+            self.edges.append((off, False))
+        self._write(encode_frame(DONE, seq, _REPLY.pack(status, until)))
+
+    def _write(self, data):
+        try:
+            os.write(self._master, data)
+        except OSError:
+            pass
+
+    def stop(self, timeout=1):
+        self._stop_event.set()
+        self.join(timeout)
+        os.close(self._master)
+        os.close(self._slave)
@@ -0,0 +1,243 @@
+# utils/mp4_timing.py
+"""
+Rewrite the frame timing of a finished MP4 without touching the video data.
+
+cv2.VideoWriter can only write a constant, nominal frame rate. The real
+timing lives in the moov box (sample durations in stts plus the track /
+movie durations), so retime_mp4() rebuilds just those tables from the
+capture timestamps and puts the new moov back in place. The cost depends
+on the size of the sample tables (a few bytes per frame), never on the size
+of the encoded video.
+"""
+import os
+import struct
+
+import numpy as np
+
+# Boxes we descend into; everything else is copied as opaque bytes
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+
+
+class Mp4TimingError(Exception):
+    pass
+
+
+# --------------------------------------------------
+# Box parsing / serialization
+# --------------------------------------------------
+
+def _top_level_boxes(f):
+    """(type, offset, size) of every top-level box, reading only headers."""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    offset = 0
+    boxes = []
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        size, typ = struct.unpack(">I4s", f.read(8))
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8:
+            raise Mp4TimingError(f"Corrupt box {typ!r} at {offset}")
+        boxes.append((typ, offset, size))
+        offset += size
+    return boxes
+
+
+def _parse(buf):
+    """[type, payload bytes | children list] for every box in buf."""
+    boxes = []
+    offset = 0
+    while offset + 8 <= len(buf):
+        size, typ = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(buf) - offset
+        payload = buf[offset + header:offset + size]
+        boxes.append([typ, _parse(payload) if typ in _CONTAINERS else bytearray(payload)])
+        offset += size
+    return boxes
+
+
+def _serialize(boxes):
+    out = bytearray()
+    for typ, content in boxes:
+        payload = _serialize(content) if isinstance(content, list) else content
+        out += struct.pack(">I4s", len(payload) + 8, typ) + payload
+    return bytes(out)
+
+
+def _find(boxes, *path):
+    """Payload of the first box at path (e.g. "mdia", "mdhd"), or None."""
+    for typ, content in boxes:
+        if typ == path[0]:
+            return content if len(path) == 1 else _find(content, *path[1:])
+    return None
+
+
+def _replace(boxes, typ, payload):
+    for box in boxes:
+        if box[0] == typ:
+            box[1] = payload
+            return
+    raise Mp4TimingError(f"Missing {typ!r}")
+
+
+# --------------------------------------------------
+# Header fields (version 0: 32-bit times, version 1: 64-bit)
+# --------------------------------------------------
+
+def _timescale_duration(payload):
+    """(timescale, duration, duration offset, version) of an mvhd / mdhd payload."""
+    if payload[0] == 1:
+        timescale, duration = struct.unpack_from(">IQ", payload, 20)
+        return timescale, duration, 24, 1
+    timescale, duration = struct.unpack_from(">II", payload, 12)
+    return timescale, duration, 16, 0
+
+
+def _set_duration(payload, offset, version, duration):
+    if version == 1:
+        struct.pack_into(">Q", payload, offset, duration)
+    else:
+        if duration >= 2 ** 32:
+            raise Mp4TimingError("Duration does not fit a version 0 header")
+        struct.pack_into(">I", payload, offset, duration)
+
+
+def _tkhd_duration_offset(payload):
+    # creation, modification, track_ID, reserved, then duration
+    return (28, 1) if payload[0] == 1 else (20, 0)
+
+
+# --------------------------------------------------
+# Retiming
+# --------------------------------------------------
+
+def _video_trak(moov):
+    for typ, content in moov:
+        if typ != b"trak":
+            continue
+        hdlr = _find(content, b"mdia", b"hdlr")
+        if hdlr is not None and bytes(hdlr[8:12]) == b"vide":
+            return content
+    raise Mp4TimingError("No video track")
+
+
+def _sample_durations(timestamps, timescale):
+    """Per-sample durations in track units; cumulative rounding so nothing drifts."""
+    t = np.asarray(timestamps, dtype=np.float64)
+    pts = np.round((t - t[0]) * timescale).astype(np.int64)
+    deltas = np.diff(pts)
+    # Capture timestamps should be increasing; never emit a zero/negative duration
+    deltas = np.maximum(deltas, 1)
+    last = int(np.median(deltas)) if len(deltas) else timescale // 30
+    return np.append(deltas, last)
+
+
+def _stts(durations):
+    entries = []
+    for d in durations.tolist():
+        if entries and entries[-1][1] == d:
+            entries[-1][0] += 1
+        else:
+            entries.append([1, d])
+
+    out = bytearray(struct.pack(">II", 0, len(entries)))
+    for count, delta in entries:
+        out += struct.pack(">II", count, delta)
+    return out
+
+
+def retime_mp4(path, timestamps):
+    """
+    Give every frame of the (single) video track of `path` its capture time
+    from `timestamps` (seconds, one per frame). Raises Mp4TimingError when
+    the file has a layout this doesn't handle; the file is then unchanged.
+    """
+    with open(path, "r+b") as f:
+        boxes = _top_level_boxes(f)
+        moov_boxes = [b for b in boxes if b[0] == b"moov"]
+        if len(moov_boxes) != 1:
+            raise Mp4TimingError("Expected exactly one moov box")
+        _, moov_offset, moov_size = moov_boxes[0]
+
+        f.seek(moov_offset)
+        moov = _parse(f.read(moov_size))[0][1]
+
+        trak = _video_trak(moov)
+        stbl = _find(trak, b"mdia", b"minf", b"stbl")
+        if stbl is None or _find(stbl, b"stts") is None:
+            raise Mp4TimingError("No sample table")
+        if _find(stbl, b"ctts") is not None:
+            raise Mp4TimingError("Reordered frames (ctts) are not supported")
+
+        stts = _find(stbl, b"stts")
+        n_entries = struct.unpack_from(">I", stts, 4)[0]
+        n_samples = sum(
+            struct.unpack_from(">I", stts, 8 + 8 * i)[0] for i in range(n_entries)
+        )
+        if n_samples != len(timestamps):
+            raise Mp4TimingError(f"{n_samples} samples but {len(timestamps)} timestamps")
+
+        # Track timing, in the track's own timescale
+        mdhd = _find(trak, b"mdia", b"mdhd")
+        track_scale, _, dur_off, version = _timescale_duration(mdhd)
+        durations = _sample_durations(timestamps, track_scale)
+        track_duration = int(durations.sum())
+
+        _replace(stbl, b"stts", _stts(durations))
+        _set_duration(mdhd, dur_off, version, track_duration)
+
+        # Movie-level durations, in the movie timescale
+        mvhd = _find(moov, b"mvhd")
+        movie_scale, _, mv_off, mv_version = _timescale_duration(mvhd)
+        movie_duration = round(track_duration * movie_scale / track_scale)
+
+        tkhd = _find(trak, b"tkhd")
+        tk_off, tk_version = _tkhd_duration_offset(tkhd)
+        _set_duration(tkhd, tk_off, tk_version, movie_duration)
+
+        elst = _find(trak, b"edts", b"elst")
+        if elst is not None:
+            elst_version = elst[0]
+            count = struct.unpack_from(">I", elst, 4)[0]
+            # Entries: segment_duration, media_time (-1 = empty edit), media_rate
+            entry_size, media_fmt, media_off = (20, ">q", 8) if elst_version == 1 else (12, ">i", 4)
+            for i in range(count):
+                entry = 8 + i * entry_size
+                media_time = struct.unpack_from(media_fmt, elst, entry + media_off)[0]
+                if media_time != -1:
+                    _set_duration(elst, entry, elst_version, movie_duration)
+
+        # The movie lasts as long as its longest track
+        longest = movie_duration
+        for typ, content in moov:
+            if typ == b"trak" and content is not trak:
+                other = _find(content, b"tkhd")
+                off, ver = _tkhd_duration_offset(other)
+                fmt = ">Q" if ver == 1 else ">I"
+                longest = max(longest, struct.unpack_from(fmt, other, off)[0])
+        _set_duration(mvhd, mv_off, mv_version, longest)
+
+        new_moov = _serialize([[b"moov", moov]])
+
+        # Sample offsets (stco/co64) are absolute and mdat doesn't move, so
+        # the new moov can go anywhere after it
+        if moov_offset + moov_size == boxes[-1][1] + boxes[-1][2]:
+            # moov is the last box: overwrite it in place
+            f.seek(moov_offset)
+            f.write(new_moov)
+            f.truncate()
+        else:
+            # moov comes before other boxes: append the new one, blank the old
+            f.seek(0, os.SEEK_END)
+            f.write(new_moov)
+            f.flush()
+            f.seek(moov_offset + 4)
+            f.write(b"free")
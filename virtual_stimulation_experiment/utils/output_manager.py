@@ -1,68 +1,357 @@
 # utils/output_manager.py
 import cv2
+import math
 import os
+import shutil
+import subprocess
+import threading
 import time
+from array import array
+
+import numpy as np
+
+import config
+from utils.mp4_timing import retime_mp4, Mp4TimingError
+
+# Columns of recording_<ts>.index.csv, one row per finished segment
+INDEX_COLUMNS = ("segment", "path", "first_frame", "frames", "t_start", "t_end", "bytes")
+
+# How often (in frames) to check the size of the open segment
+SIZE_CHECK_EVERY = 30
 
 
 class OutputManager:
-    def __init__(self, output_dir="output"):
+    """
+    Writes the recording as a series of segments:
+
+        recording_<ts>_000.mp4, recording_<ts>_001.mp4, ...
+        recording_<ts>_000.timestamps.csv   frame,t for every frame in the segment
+        recording_<ts>.index.csv            one row per finished segment
+
+    A segment is closed (and gets its real frame timing) once it spans
+    `segment_seconds` or grows past `segment_mb`, so a crash loses at most
+    the segment being written. save_frame() is meant to run on its own
+    recorder thread, never on the capture / detection path.
+    """
+
+    def __init__(
+        self,
+        output_dir="output",
+        segment_seconds=config.RECORD_SEGMENT_SECONDS,
+        segment_mb=config.RECORD_SEGMENT_MB,
+        fourcc=config.RECORD_FOURCC,
+        quality=config.RECORD_QUALITY,
+        prefix="recording",
+    ):
         os.makedirs(output_dir, exist_ok=True)
 
         ts = time.strftime("%Y%m%d_%H%M%S")
-        self.video_path = os.path.join(output_dir, f"recording_{ts}.mp4")
+        self.output_dir = output_dir
+        self.base_name = f"{prefix}_{ts}"
+        self.index_path = os.path.join(output_dir, f"{self.base_name}.index.csv")
+
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_mb * 1024 * 1024 if segment_mb else None
+        self.fourcc = fourcc
+        self.quality = quality
 
         self.writer = None
         self.frame_size = None
-        self.fps = 30  # temporary, corrected on close()
+        self.fps = 30  # nominal; real timing is written when a segment closes
+
+        self.frames_written = 0
+        self.segments = []          # paths of finished segments
+        self.encode_time = 0.0      # seconds spent in VideoWriter.write
+
+        # Open segment
+        self.video_path = None
+        self.timestamps_path = None
+        self._segment = -1
+        self._segment_first_frame = 0
+        self._segment_frames = 0
+        self._segment_t0 = None
+        self._timestamps = array("d")
+        self._timestamps_file = None
+        self._index_file = None
+
+    # --------------------------------------------------
+    # Segments
+    # --------------------------------------------------
+
+    def _open_segment(self, frame_size, t):
+        self._segment += 1
+        stem = os.path.join(self.output_dir, f"{self.base_name}_{self._segment:03d}")
+        self.video_path = stem + ".mp4"
+        self.timestamps_path = stem + ".timestamps.csv"
+
+        self.writer = cv2.VideoWriter(
+            self.video_path,
+            cv2.VideoWriter_fourcc(*self.fourcc),
+            self.fps,
+            frame_size
+        )
+        if not self.writer.isOpened():
+            raise RuntimeError(f"❌ Failed to open video writer for {self.video_path} ({self.fourcc})")
+        if self.quality is not None:
+            # Best effort: not every codec / backend honours it
+            self.writer.set(cv2.VIDEOWRITER_PROP_QUALITY, self.quality)
+
+        self._timestamps_file = open(self.timestamps_path, "w")
+        self._timestamps_file.write("frame,t\n")
+
+        self._segment_first_frame = self.frames_written
+        self._segment_frames = 0
+        self._segment_t0 = t
+        self._timestamps = array("d")
+
+    def _close_segment(self, real_fps=None):
+        self.writer.release()
+        self.writer = None
+        self._timestamps_file.close()
+
+        n = self._segment_frames
+        if len(self._timestamps) == n and n >= 2:
+            # Every frame gets its own capture time (variable frame rate)
+            timestamps = self._timestamps
+        elif real_fps and real_fps > 0:
+            timestamps = [i / real_fps for i in range(n)]
+        else:
+            timestamps = None
+
+        if timestamps is not None:
+            self._fix_timing(timestamps)
+
+        self._write_index_row()
+        self.segments.append(self.video_path)
+
+    def _fix_timing(self, timestamps):
+        try:
+            retime_mp4(self.video_path, timestamps)
+            return
+        except (Mp4TimingError, OSError, ValueError, IndexError) as e:
+            print(f"⚠️  Warning: could not rewrite MP4 timing in place ({e}), remuxing instead")
+
+        duration = timestamps[-1] - timestamps[0]
+        if duration > 0:
+            self._remux_with_fps((len(timestamps) - 1) / duration)
+
+    def _write_index_row(self):
+        if self._index_file is None:
+            new = not os.path.exists(self.index_path)
+            self._index_file = open(self.index_path, "a")
+            if new:
+                self._index_file.write(",".join(INDEX_COLUMNS) + "\n")
+
+        t_start = f"{self._timestamps[0]:.6f}" if self._timestamps else ""
+        t_end = f"{self._timestamps[-1]:.6f}" if self._timestamps else ""
+        self._index_file.write(
+            f"{self._segment},{os.path.basename(self.video_path)},{self._segment_first_frame},"
+            f"{self._segment_frames},{t_start},{t_end},{os.path.getsize(self.video_path)}\n"
+        )
+        # The index must survive a crash in the next segment
+        self._index_file.flush()
+
+    def _segment_full(self, t):
+        if self.segment_seconds and t - self._segment_t0 >= self.segment_seconds:
+            return True
+        if (
+            self.segment_bytes
+            and self._segment_frames % SIZE_CHECK_EVERY == 0
+            and os.path.getsize(self.video_path) >= self.segment_bytes
+        ):
+            return True
+        return False
+
+    # --------------------------------------------------
+    # Public API
+    # --------------------------------------------------
+
+    def save_frame(self, frame, t=None):
+        now = time.time() if t is None else t
+
+        if self.writer is not None and self._segment_full(now):
+            self._close_segment()
 
-    def save_frame(self, frame):
         # Lazy init so we don't allocate until first frame
         if self.writer is None:
             h, w = frame.shape[:2]
             self.frame_size = (w, h)
-
-            self.writer = cv2.VideoWriter(
-                self.video_path,
-                cv2.VideoWriter_fourcc(*"mp4v"),
-                self.fps,
-                self.frame_size
-            )
+            self._open_segment(self.frame_size, now)
 
         # IMPORTANT: write immediately, never store
+        t0 = time.perf_counter()
         self.writer.write(frame)
+        self.encode_time += time.perf_counter() - t0
 
-    def close(self, real_fps, frame_size=None):
-        if self.writer is None:
-            return
+        if t is not None:
+            self._timestamps.append(t)
+            self._timestamps_file.write(f"{self.frames_written},{t:.6f}\n")
+        self._segment_frames += 1
+        self.frames_written += 1
 
-        self.writer.release()
-        self.writer = None
+    def end_segment(self):
+        """Finish the open segment now; the next frame starts a new one."""
+        if self.writer is not None:
+            self._close_segment()
 
-        # Optional: fix FPS after capture
-        if real_fps and real_fps > 0:
-            self._rewrite_with_correct_fps(real_fps)
+    def close(self, real_fps=None, frame_size=None):
+        if self.writer is not None:
+            self._close_segment(real_fps)
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
 
-    def _rewrite_with_correct_fps(self, real_fps):
-        temp_path = self.video_path + ".tmp.mp4"
+    def stats(self):
+        return {
+            "frames": self.frames_written,
+            "segments": len(self.segments) + (1 if self.writer is not None else 0),
+            "encode_ms": round(1000 * self.encode_time / max(self.frames_written, 1), 2),
+        }
 
-        cap = cv2.VideoCapture(self.video_path)
-        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    def _remux_with_fps(self, real_fps):
+        """Fallback: stream-copy remux with rescaled timestamps (no re-encode)."""
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            print(f"⚠️  Warning: ffmpeg not found, {self.video_path} keeps its nominal {self.fps} FPS")
+            return
 
-        writer = cv2.VideoWriter(
-            temp_path,
-            cv2.VideoWriter_fourcc(*"mp4v"),
-            real_fps,
-            (w, h)
+        temp_path = self.video_path + ".tmp.mp4"
+        result = subprocess.run(
+            [
+                ffmpeg, "-y", "-loglevel", "error",
+                "-itsscale", f"{self.fps / real_fps:.9f}",
+                "-i", self.video_path,
+                "-c", "copy",
+                temp_path,
+            ],
+            capture_output=True,
         )
+        if result.returncode != 0:
+            print(f"⚠️  Warning: ffmpeg remux failed: {result.stderr.decode(errors='replace').strip()}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        os.replace(temp_path, self.video_path)
+
+
+class ClipRecorder:
+    """
+    Records only around events: keeps the last `pre_roll` seconds of frames
+    in a preallocated in-memory ring, and on trigger(t) writes a clip from
+    t - pre_roll to t + post_roll. Triggers whose windows overlap a running
+    clip extend it instead of starting a new one.
+
+    Each clip is one segment of the underlying OutputManager
+    (clip_<ts>_NNN.mp4), listed with its time span in clip_<ts>.index.csv.
+    save_frame() runs on the recorder thread; trigger() may be called from
+    any thread.
+    """
+
+    def __init__(
+        self,
+        output_dir="output",
+        pre_roll=config.CLIP_PRE_ROLL,
+        post_roll=config.CLIP_POST_ROLL,
+        fps=30,
+        **output_kwargs,
+    ):
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.output = OutputManager(output_dir, prefix="clip", **output_kwargs)
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
+        # Headroom over the nominal rate so the ring always covers pre_roll
+        self.slots = max(1, math.ceil(pre_roll * fps * 1.25))
+        self._frames = None     # (slots, h, w, c), allocated on the first frame
+        self._times = np.zeros(self.slots)
+        self._head = 0          # frames ever pushed into the ring
+        self._tail = 0          # oldest frame still usable
+
+        self._lock = threading.Lock()
+        self._new_triggers = []
+        self._pending = []
+        self._clip_end = None   # end time of the running clip, None = idle
+
+        self.frames_seen = 0
+        self.clips = 0
+        self.triggers = 0
+
+    def trigger(self, t):
+        with self._lock:
+            self._new_triggers.append(t)
+            self.triggers += 1
+
+    # --------------------------------------------------
+    # Pre-roll ring
+    # --------------------------------------------------
+
+    def _push(self, frame, t):
+        if self._frames is None:
+            self._frames = np.empty((self.slots,) + frame.shape, frame.dtype)
+
+        i = self._head % self.slots
+        np.copyto(self._frames[i], frame)
+        self._times[i] = t
+        self._head += 1
+        self._tail = max(self._tail, self._head - self.slots)
+
+    def _flush_ring(self, t_from):
+        for n in range(self._tail, self._head):
+            i = n % self.slots
+            if self._times[i] >= t_from:
+                self.output.save_frame(self._frames[i], t=self._times[i])
+        self._tail = self._head
+
+    # --------------------------------------------------
+    # Recorder thread
+    # --------------------------------------------------
+
+    def save_frame(self, frame, t=None):
+        t = time.time() if t is None else t
+        self.frames_seen += 1
+
+        with self._lock:
+            if self._new_triggers:
+                self._pending.extend(self._new_triggers)
+                self._pending.sort()
+                self._new_triggers = []
+
+        self._apply_triggers(t)
+        if self._clip_end is not None and t > self._clip_end:
+            self.output.end_segment()
+            self._clip_end = None
+            self._apply_triggers(t)
+
+        if self._clip_end is not None:
+            self.output.save_frame(frame, t=t)
+        else:
+            self._push(frame, t)
+
+    def _apply_triggers(self, t):
+        """Start or extend a clip for every pending trigger whose window has begun."""
+        while self._pending:
+            t_trigger = self._pending[0]
+            start = t_trigger - self.pre_roll
+            if self._clip_end is None:
+                if start > t:
+                    break
+                self._flush_ring(start)
+                self._clip_end = t_trigger + self.post_roll
+                self.clips += 1
+            elif start <= self._clip_end:
+                self._clip_end = max(self._clip_end, t_trigger + self.post_roll)
+            else:
                 break
-            writer.write(frame)
+            self._pending.pop(0)
 
-        cap.release()
-        writer.release()
+    def close(self, real_fps=None, frame_size=None):
+        self.output.close(real_fps, frame_size)
 
-        os.replace(temp_path, self.video_path)
+    def stats(self):
+        stats = self.output.stats()
+        stats.update(
+            clips=self.clips,
+            triggers=self.triggers,
+            recorded_fraction=round(stats["frames"] / max(self.frames_seen, 1), 3),
+        )
+        return stats
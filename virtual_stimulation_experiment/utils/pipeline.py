@@ -0,0 +1,157 @@
+# utils/pipeline.py
+import threading
+import time
+from collections import deque
+
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+
+class FramePacket:
+    """A captured frame plus the metadata that travels with it through the stages."""
+
+    __slots__ = (
+        "seq", "t_capture", "t_mono", "frame", "movement_active", "contours", "score", "preview"
+    )
+
+    def __init__(self, seq, t_capture, frame, t_mono=None):
+        self.seq = seq
+        self.t_capture = t_capture
+        # perf_counter() when the frame left the camera, for latency tracing
+        self.t_mono = time.perf_counter() if t_mono is None else t_mono
+        self.frame = frame
+
+        # Filled in by the detection stage
+        self.movement_active = False
+        self.contours = None
+        self.score = 0
+        # (small image copy, origin, scale) for the live preview, if any
+        self.preview = None
+
+
+class FrameQueue:
+    """
+    Bounded queue between two pipeline stages.
+
+    policy=DROP_OLDEST → put() never blocks, the oldest item is discarded
+    policy=BLOCK       → put() waits until the consumer makes room
+    """
+
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown queue policy: {policy}")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.closed = False
+
+        # Backpressure metrics
+        self.dropped = 0
+        self.high_water = 0       # most items ever waiting at once
+        self.blocked_time = 0.0   # seconds producers spent waiting (BLOCK)
+
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            if self.policy == BLOCK:
+                if len(self._items) >= self.maxsize:
+                    t0 = time.perf_counter()
+                    while len(self._items) >= self.maxsize and not self.closed:
+                        self._cond.wait()
+                    self.blocked_time += time.perf_counter() - t0
+            elif len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+
+            if self.closed:
+                return
+
+            self._items.append(item)
+            if len(self._items) > self.high_water:
+                self.high_water = len(self._items)
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """Return the next item, or None on timeout / after close()."""
+        with self._cond:
+            if not self._items and not self.closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class CaptureStage(threading.Thread):
+    """
+    Reads frames from the camera as fast as it delivers them and stamps
+    each one with a sequence number and the capture time.
+    """
+
+    def __init__(self, camera, out_queue, clock=time.time):
+        super().__init__(name="capture", daemon=True)
+        self.camera = camera
+        self.out_queue = out_queue
+        self.clock = clock
+
+        self.frame_count = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        seq = 0
+        while not self._stop_event.is_set():
+            frame = self.camera.get_frame()
+            if frame is None:
+                continue
+
+            t = self.clock()
+            # Cameras backed by a frame ring already numbered this frame
+            seq = getattr(self.camera, "last_seq", seq + 1)
+            self.frame_count += 1
+            self.out_queue.put(FramePacket(seq, t, frame))
+
+        self.out_queue.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class WorkerStage(threading.Thread):
+    """Pulls packets from a queue and hands each one to `handler`."""
+
+    def __init__(self, name, in_queue, handler):
+        super().__init__(name=name, daemon=True)
+        self.in_queue = in_queue
+        self.handler = handler
+        self.processed = 0
+
+    def run(self):
+        while True:
+            packet = self.in_queue.get()
+            if packet is None:
+                if self.in_queue.closed:
+                    break
+                continue
+
+            try:
+                self.handler(packet)
+            except Exception as e:
+                print(f"⚠️  Warning: {self.name} stage failed on frame {packet.seq}: {e}")
+            self.processed += 1
+
+    def stop(self, timeout=None):
+        self.in_queue.close()
+        self.join(timeout)
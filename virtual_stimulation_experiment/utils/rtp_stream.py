@@ -0,0 +1,331 @@
+# utils/rtp_stream.py
+"""
+H.264 over RTP for remote monitoring, described by an SDP file.
+
+RtpStreamer pipes raw BGR frames into an ffmpeg subprocess that encodes
+them with libx264 (ultrafast / zerolatency) and sends RTP packets to
+host:port. It is one encode however many people watch when host is a
+multicast group. Viewers open the SDP written by the streamer, e.g.
+
+    ffplay -protocol_whitelist file,udp,rtp output/tank.sdp
+
+RtpReceiver is a minimal loopback receiver for tests: it counts packets,
+frames and sequence gaps, and can reassemble the H.264 payload into an
+Annex B file that ffmpeg / ffplay can decode.
+"""
+import ipaddress
+import shutil
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+
+H264_CLOCK = 90000
+ANNEXB_START = b"\x00\x00\x00\x01"
+
+# RTP payload size; stays under a Wi-Fi / VPN MTU without IP fragmentation
+RTP_PACKET_SIZE = 1200
+
+
+def make_sdp(host, port, payload_type=96, name="Pi Camera Stream"):
+    """SDP for an H.264 RTP stream to host:port (the layout of stream.sdp)."""
+    connection = host
+    if ipaddress.ip_address(host).is_multicast:
+        connection += "/16"  # multicast needs a TTL
+    return (
+        "v=0\n"
+        f"o=- 0 0 IN IP4 {host}\n"
+        f"s={name}\n"
+        f"c=IN IP4 {connection}\n"
+        "t=0 0\n"
+        f"m=video {port} RTP/AVP {payload_type}\n"
+        f"a=rtpmap:{payload_type} H264/{H264_CLOCK}\n"
+        f"a=fmtp:{payload_type} packetization-mode=1\n"
+    )
+
+
+class RtpStreamer:
+    """
+    Frames in (write(), on its own pipeline stage), RTP/H.264 out.
+
+    ffmpeg is started on the first frame, once the frame size is known.
+    Frames carry their wall-clock arrival time, so dropped frames don't
+    speed the video up. If ffmpeg is missing or dies, the streamer warns
+    once and turns into a no-op; the experiment carries on.
+    """
+
+    def __init__(
+        self,
+        host=config.RTP_HOST,
+        port=config.RTP_PORT,
+        width=config.RTP_WIDTH,
+        fps=30,
+        bitrate=config.RTP_BITRATE,
+        sdp_path=None,
+        payload_type=96,
+        name="Pi Camera Stream",
+    ):
+        self.host = host
+        self.port = port
+        self.width = width
+        self.fps = fps
+        self.bitrate = bitrate
+        self.payload_type = payload_type
+        self.sdp = make_sdp(host, port, payload_type, name)
+
+        # Written up front so viewers can be started before the first frame
+        self.sdp_path = sdp_path
+        if sdp_path is not None:
+            with open(sdp_path, "w") as f:
+                f.write(self.sdp)
+
+        self.process = None
+        self.frame_size = None
+        self.failed = False
+
+        self.frames_sent = 0
+        self.frames_torn = 0    # source changed under the resize / copy
+        self.write_time = 0.0   # seconds spent resizing + piping frames
+
+    def _command(self, ffmpeg, width, height):
+        return [
+            ffmpeg, "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-framerate", str(self.fps),
+            "-use_wallclock_as_timestamps", "1",
+            "-i", "-",
+            "-an",
+            "-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency",
+            "-pix_fmt", "yuv420p", "-b:v", str(self.bitrate),
+            "-g", str(max(1, int(self.fps))),
+            # SPS/PPS before every keyframe, so viewers can join at any time
+            "-bsf:v", "dump_extra",
+            "-fps_mode", "passthrough",
+            "-payload_type", str(self.payload_type),
+            "-f", "rtp", f"rtp://{self.host}:{self.port}?pkt_size={RTP_PACKET_SIZE}",
+        ]
+
+    def _start(self, frame_size):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            print("⚠️  Warning: ffmpeg not found, RTP stream disabled")
+            self.failed = True
+            return
+
+        self.frame_size = frame_size
+        self.process = subprocess.Popen(
+            self._command(ffmpeg, *frame_size),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        print(f"📡 RTP/H.264 {frame_size[0]}x{frame_size[1]} → {self.host}:{self.port}")
+
+    def write(self, frame, still_valid=None, overlay=None):
+        """
+        Send one BGR frame. Returns False once the stream is disabled.
+
+        For a frame that a writer may reuse (a ring view), still_valid()
+        is checked after the frame was resized / copied and before it is
+        sent; a torn frame is skipped. overlay(image) draws on the stream's
+        own copy, never on `frame`.
+        """
+        if self.failed:
+            return False
+
+        t0 = time.perf_counter()
+        h, w = frame.shape[:2]
+        if self.width is not None and self.width < w:
+            # x264 wants even dimensions
+            size = (self.width // 2 * 2, h * self.width // w // 2 * 2)
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        else:
+            size = (w // 2 * 2, h // 2 * 2)
+            frame = frame[:size[1], :size[0]]
+            if still_valid is not None or overlay is not None:
+                frame = frame.copy()
+
+        if still_valid is not None and not still_valid():
+            self.frames_torn += 1
+            return True
+        if overlay is not None:
+            overlay(frame)
+
+        if self.process is None:
+            self._start(size)
+            if self.failed:
+                return False
+
+        try:
+            self.process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+        except (BrokenPipeError, OSError):
+            self._fail()
+            return False
+
+        self.write_time += time.perf_counter() - t0
+        self.frames_sent += 1
+        return True
+
+    def _fail(self):
+        err = b""
+        if self.process.poll() is not None:
+            err = self.process.stderr.read()
+        print(f"⚠️  Warning: ffmpeg RTP stream stopped: {err.decode(errors='replace').strip()}")
+        self.failed = True
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+    def stats(self):
+        return {
+            "running": self.process is not None and not self.failed,
+            "frames": self.frames_sent,
+            "torn": self.frames_torn,
+            "write_ms": round(1000 * self.write_time / max(self.frames_sent, 1), 2),
+            "target": f"{self.host}:{self.port}",
+        }
+
+
+class RtpReceiver(threading.Thread):
+    """
+    Loopback receiver for tests: listens on host:port, counts packets,
+    frames (marker bit) and lost packets (sequence gaps), and optionally
+    writes the depacketized H.264 as an Annex B stream to `annexb_path`.
+    """
+
+    def __init__(self, port=config.RTP_PORT, host="127.0.0.1", annexb_path=None):
+        super().__init__(name=f"rtp-receiver-{port}", daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.2)
+
+        self.annexb_path = annexb_path
+        self._out = None
+
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._last_seq = None
+        self._frame_idr = False
+
+        self.packets = 0
+        self.frames = 0
+        self.lost = 0
+        self.bytes = 0
+        self.keyframes = 0
+        self.payload_types = set()
+
+    def run(self):
+        if self.annexb_path is not None:
+            self._out = open(self.annexb_path, "wb")
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    data = self.sock.recv(65536)
+                except socket.timeout:
+                    continue
+                self._packet(data)
+        finally:
+            self.sock.close()
+            if self._out is not None:
+                self._out.close()
+
+    def _packet(self, data):
+        if len(data) < 12 or data[0] >> 6 != 2:
+            return  # not RTP version 2
+
+        b0, b1, seq = struct.unpack_from(">BBH", data)
+        offset = 12 + 4 * (b0 & 0x0F)           # CSRC list
+        if b0 & 0x10:                           # header extension
+            offset += 4 + 4 * struct.unpack_from(">H", data, offset + 2)[0]
+        end = len(data) - (data[-1] if b0 & 0x20 else 0)   # padding
+        payload = data[offset:end]
+
+        if self._last_seq is not None:
+            gap = (seq - self._last_seq - 1) & 0xFFFF
+            if gap < 0x8000:   # otherwise a reordered / duplicate packet
+                self.lost += gap
+        self._last_seq = seq
+
+        nal = self._depacketize(payload)
+        if self._out is not None and nal:
+            self._out.write(nal)
+
+        with self._cond:
+            self.packets += 1
+            self.bytes += len(data)
+            self.payload_types.add(b1 & 0x7F)
+            if b1 & 0x80:   # marker: last packet of a frame
+                self.frames += 1
+                if self._frame_idr:
+                    self.keyframes += 1
+                    self._frame_idr = False
+            self._cond.notify_all()
+
+    def _depacketize(self, payload):
+        """Annex B bytes for one RTP payload (RFC 6184 modes 0 and 1)."""
+        if not payload:
+            return b""
+        nal_type = payload[0] & 0x1F
+
+        if nal_type == 24:   # STAP-A: several size-prefixed NAL units
+            out = bytearray()
+            i = 1
+            while i + 2 <= len(payload):
+                size = struct.unpack_from(">H", payload, i)[0]
+                out += ANNEXB_START + payload[i + 2:i + 2 + size]
+                self._count_nal(payload[i + 2])
+                i += 2 + size
+            return bytes(out)
+
+        if nal_type == 28:   # FU-A: one NAL unit split over several packets
+            if len(payload) < 2:
+                return b""
+            fu = payload[1]
+            if not fu & 0x80:
+                return payload[2:]
+            header = (payload[0] & 0xE0) | (fu & 0x1F)
+            self._count_nal(header)
+            return ANNEXB_START + bytes([header]) + payload[2:]
+
+        self._count_nal(payload[0])
+        return ANNEXB_START + payload
+
+    def _count_nal(self, header):
+        if header & 0x1F == 5:   # IDR slice (a keyframe may have several)
+            self._frame_idr = True
+
+    def wait_frames(self, n, timeout=None):
+        """Block until at least n frames arrived; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.frames >= n, timeout)
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "packets": self.packets,
+                "frames": self.frames,
+                "lost": self.lost,
+                "bytes": self.bytes,
+                "keyframes": self.keyframes,
+            }
@@ -0,0 +1,223 @@
+# utils/scheduler.py
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import config
+from utils.stats import StreamSummary
+
+
+class StimulusScheduler(threading.Thread):
+    """
+    One thread that fires timed callbacks for any number of tanks.
+
+    Times are seconds on perf_counter, a monotonic high-resolution clock
+    (now(); the same clock as FramePacket.t_mono), kept as integer
+    nanoseconds internally, so clock adjustments never move a stimulus. callback(t_due) is called at t_due
+    and returns the next due time for that callback, or None to stop
+    rescheduling it.
+
+    The thread sleeps until `spin` seconds before a due time and then
+    polls the clock, yielding the GIL between reads, which absorbs OS
+    wake-up latency without starving the capture / detection threads. How
+    late each callback actually started is kept in self.lateness.
+    """
+
+    def __init__(self, clock_ns=time.perf_counter_ns, spin=config.SCHEDULER_SPIN):
+        super().__init__(name="stim-scheduler", daemon=True)
+        self.clock_ns = clock_ns
+        self.spin_ns = int(spin * 1e9)
+
+        self._heap = []
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self.fired = 0
+        self.lateness = StreamSummary()
+
+    def now(self):
+        return self.clock_ns() / 1e9
+
+    def add(self, callback, due):
+        with self._cond:
+            heapq.heappush(self._heap, (round(due * 1e9), next(self._ids), callback))
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay_ns = self._heap[0][0] - self.clock_ns()
+                    if delay_ns <= self.spin_ns:
+                        break
+                    self._cond.wait((delay_ns - self.spin_ns) / 1e9)
+
+                if self._stopped:
+                    return
+                due_ns, _, callback = heapq.heappop(self._heap)
+
+            # Last stretch: don't trust the OS timer for the final few ms.
+            # sleep(0) hands the GIL to the frame threads between clock
+            # reads instead of holding it for the whole spin.
+            while self.clock_ns() < due_ns:
+                time.sleep(0)
+            self.lateness.add((self.clock_ns() - due_ns) / 1e9)
+            self.fired += 1
+
+            try:
+                next_time = callback(due_ns / 1e9)
+            except Exception as e:
+                print(f"⚠️  Warning: scheduled stimulus failed: {e}")
+                continue
+
+            if next_time is not None:
+                self.add(callback, next_time)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def stats(self):
+        late = self.lateness.to_dict()
+        with self._cond:
+            pending = len(self._heap)
+        if late["count"] == 0:
+            return {"fired": 0, "pending": pending}
+        return {
+            "fired": self.fired,
+            "pending": pending,
+            "lateness_ms": {
+                k: round(1000 * late[k], 3) for k in ("mean", "p50", "p99", "max")
+            },
+        }
+
+
+# --------------------------------------------------
+# Stimulus protocols: how long until the next stimulus
+# --------------------------------------------------
+# next_delay() → seconds until the next stimulus, or None when the
+# protocol is finished. reset() starts it over (e.g. on a new trial).
+
+class FixedInterval:
+    """A stimulus every `interval` seconds."""
+
+    def __init__(self, interval):
+        if interval <= 0:
+            raise ValueError("Stimulus interval must be positive")
+        self.interval = interval
+
+    def next_delay(self):
+        return self.interval
+
+    def reset(self):
+        pass
+
+    def describe(self):
+        return {"type": "fixed", "interval": self.interval}
+
+
+class JitteredInterval:
+    """
+    Intervals drawn uniformly from interval ± jitter, so the fish can't
+    anticipate the stimulus. Seeded: the same seed gives the same sequence,
+    and the seed is logged with every trial.
+    """
+
+    def __init__(self, interval, jitter, seed=None):
+        if not 0 <= jitter < interval:
+            raise ValueError("Jitter must be at least 0 and smaller than the interval")
+        self.interval = interval
+        self.jitter = jitter
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.reset()
+
+    def next_delay(self):
+        return self.interval + self._rng.uniform(-self.jitter, self.jitter)
+
+    def reset(self):
+        self._rng = random.Random(self.seed)
+
+    def describe(self):
+        return {"type": "jitter", "interval": self.interval, "jitter": self.jitter, "seed": self.seed}
+
+
+class Blocks:
+    """
+    Blocks of stimuli: each block is (count, interval), and `rest` seconds
+    pass between the last stimulus of one block and the first of the next.
+    The block list runs `repeat` times (None = forever).
+    """
+
+    def __init__(self, blocks, rest=0.0, repeat=1):
+        self.blocks = [(int(count), float(interval)) for count, interval in blocks]
+        if not self.blocks or any(c <= 0 or i <= 0 for c, i in self.blocks):
+            raise ValueError("Blocks need a positive count and interval")
+        if rest < 0:
+            raise ValueError("Rest must not be negative")
+        self.rest = rest
+        self.repeat = repeat
+        self.reset()
+
+    def next_delay(self):
+        count, interval = self.blocks[self._block]
+        if self._index == 0 and self._first:
+            # Very first stimulus of the protocol
+            self._first = False
+            self._index = 1
+            return interval
+
+        if self._index < count:
+            self._index += 1
+            return interval
+
+        # Block done: move on to the next one (or the next repetition)
+        self._block += 1
+        if self._block == len(self.blocks):
+            self._block = 0
+            self._round += 1
+            if self.repeat is not None and self._round >= self.repeat:
+                return None
+        self._index = 1
+        return self.rest
+
+    def reset(self):
+        self._block = 0
+        self._index = 0
+        self._round = 0
+        self._first = True
+
+    def describe(self):
+        return {
+            "type": "blocks",
+            "blocks": [list(b) for b in self.blocks],
+            "rest": self.rest,
+            "repeat": self.repeat,
+        }
+
+
+PROTOCOLS = {"fixed": FixedInterval, "jitter": JitteredInterval, "blocks": Blocks}
+
+
+def make_protocol(spec=None, interval=config.STIM_INTERVAL):
+    """
+    Protocol from a config value: None → every `interval` seconds, a
+    number → every that many seconds, or a dict like
+    {"type": "jitter", "interval": 5, "jitter": 1.5, "seed": 1}.
+    """
+    if spec is None:
+        return FixedInterval(interval)
+    if isinstance(spec, (int, float)):
+        return FixedInterval(spec)
+
+    params = dict(spec)
+    kind = params.pop("type", "fixed")
+    if kind not in PROTOCOLS:
+        raise ValueError(f"Unknown stimulus protocol: {kind}")
+    return PROTOCOLS[kind](**params)
@@ -1,53 +1,494 @@
 # utils/server.py
-import time
-from flask import Flask, Response
+"""
+Streaming and control server on asyncio (standard library only).
 
-app = Flask(__name__)
+Every connection is a coroutine on one event-loop thread instead of a
+thread per client, and frames / events reach it through thread-safe
+wake-ups rather than polling.
 
-# Camera instance injected from main.py
-_camera = None
+    GET  /                              MJPEG of the first registered tank
+    GET  /tank/<name>                   MJPEG (?width=N caps resolution, ?fps=N frame rate)
+    GET  /tanks                         pipeline stats per tank
+    GET  /stats, /stats/<name>          reaction / bout statistics
+    GET  /events, /tank/<name>/events   WebSocket feed of detection events (JSON)
+    GET  /tank/<name>/schedule          trial state and stimulus schedule
+    POST /tank/<name>/schedule          {"interval": s, "protocol": {...}, "next_in": s} (all optional)
+    POST /tank/<name>/trial/start
+    POST /tank/<name>/trial/stop
+    GET  /metrics                       latency histograms per trace span
+    GET  /trace                         span buffer as a Chrome / Perfetto trace
+    POST /trace/start, /trace/stop      switch tracing at runtime
 
+POST routes need "Authorization: Bearer <SERVER_TOKEN>" when a token is
+set, and are refused outright on a non-localhost server without one.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import re
+import struct
+from urllib.parse import parse_qs
 
-def set_camera_instance(cam):
-    global _camera
-    _camera = cam
+import config
+from utils.tracing import tracer
 
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+# Events buffered per WebSocket client before the oldest are dropped
+EVENT_QUEUE_SIZE = 256
 
-@app.route("/")
-def video_feed():
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+        self.message = message or STATUS_TEXT.get(status, "")
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def arg(self, name, type=str, default=None):
+        """Query parameter converted with `type`, or default."""
+        if name not in self.query:
+            return default
+        try:
+            return type(self.query[name])
+        except ValueError:
+            raise HttpError(400, f"Bad value for {name}")
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, "Body is not valid JSON")
+
+
+def _json_default(obj):
+    # NumPy scalars from the detector
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _ws_frame(payload, opcode=0x1):
+    n = len(payload)
+    if n < 126:
+        header = struct.pack(">BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+
+class StreamServer:
     """
-    Single-client MJPEG stream.
-    Always sends the most recent frame only.
-    Old frames are dropped.
+    Minimal HTTP/1.1 + WebSocket server. Handlers are coroutines
+    handler(request, reader, writer, **url_groups) that either return a
+    JSON-able object (sent as 200) or write the response themselves and
+    return None.
     """
 
-    def generate():
-        while True:
-            if _camera is None:
-                time.sleep(0.05)
-                continue
+    def __init__(self, token=config.SERVER_TOKEN):
+        self.routes = []
+        self.loop = None
+        self.token = token
+        self.host = None
+
+        self._waiters = {}          # (id(hub), width) → set of asyncio.Event
+        self._event_clients = set() # (asyncio.Queue, tank name or None)
+
+    # --------------------------------------------------
+    # Registration (any thread, before or after start)
+    # --------------------------------------------------
+
+    def route(self, method, pattern):
+        regex = re.compile("^" + re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", pattern) + "$")
+
+        def decorator(handler):
+            self.routes.append((method, regex, handler))
+            return handler
+
+        return decorator
 
-            jpeg = _camera.get_latest_jpeg()
-            if jpeg is None:
-                time.sleep(0.01)
+    def add_stream(self, hub):
+        """Wake this loop's MJPEG clients whenever `hub` publishes."""
+        hub.add_listener(lambda width, seq: self._on_publish(hub, width))
+
+    def _on_publish(self, hub, width):
+        # Called on the encoder thread; only bother the loop if someone waits
+        if self.loop is not None and self._waiters.get((id(hub), width)):
+            self.loop.call_soon_threadsafe(self._wake, (id(hub), width))
+
+    def _wake(self, key):
+        for event in self._waiters.get(key, ()):
+            event.set()
+
+    def publish_event(self, event):
+        """Send an event dict to the WebSocket clients (any thread)."""
+        if self.loop is not None and self._event_clients:
+            self.loop.call_soon_threadsafe(self._fan_out, event)
+
+    def _fan_out(self, event):
+        for queue, tank in self._event_clients:
+            if tank is not None and event.get("tank") != tank:
                 continue
+            if queue.full():
+                queue.get_nowait()   # slow client: drop its oldest event
+            queue.put_nowait(event)
+
+    # --------------------------------------------------
+    # HTTP
+    # --------------------------------------------------
+
+    async def _read_request(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413)
+        body = await reader.readexactly(length) if length else b""
+
+        path, _, qs = target.partition("?")
+        query = {k: v[-1] for k, v in parse_qs(qs).items()}
+        return Request(method.upper(), path, query, headers, body)
+
+    def _check_control(self, request):
+        """Mutating (non-GET) requests: token if configured, else localhost servers only."""
+        if request.method == "GET":
+            return
+        if self.token is None:
+            if not _is_loopback(self.host):
+                raise HttpError(403, "Control routes are disabled: set SERVER_TOKEN")
+            return
+        auth = request.headers.get("authorization", "")
+        if not hmac.compare_digest(auth.encode(), f"Bearer {self.token}".encode()):
+            raise HttpError(401)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await self._read_request(reader)
+            self._check_control(request)
 
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n"
-                + jpeg +
-                b"\r\n"
+            allowed = False
+            for method, regex, handler in self.routes:
+                match = regex.match(request.path)
+                if match is None:
+                    continue
+                if method != request.method:
+                    allowed = True
+                    continue
+                result = await handler(request, reader, writer, **match.groupdict())
+                if result is not None:
+                    await self.send_json(writer, result)
+                break
+            else:
+                raise HttpError(405 if allowed else 404)
+
+        except HttpError as e:
+            await self.send_json(writer, {"error": e.message}, e.status)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"⚠️  Warning: server request failed: {e}")
+            try:
+                await self.send_json(writer, {"error": str(e)}, 500)
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def send_json(self, writer, obj, status=200):
+        body = json.dumps(obj, default=_json_default).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    # --------------------------------------------------
+    # MJPEG
+    # --------------------------------------------------
+
+    async def mjpeg(self, request, writer, hub):
+        """Stream `hub` to one client: newest frame only, woken on publish."""
+        max_width = request.arg("width", int)
+        max_fps = request.arg("fps", float, config.STREAM_MAX_FPS)
+        if not max_fps or max_fps <= 0:
+            max_fps = None
+        min_interval = 1.0 / max_fps if max_fps else 0.0
+
+        width = hub.subscribe(max_width, max_fps)
+        key = (id(hub), width)
+        event = asyncio.Event()
+        self._waiters.setdefault(key, set()).add(event)
+        loop = asyncio.get_running_loop()
+
+        try:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                b"Cache-Control: no-cache\r\n"
+                b"Connection: close\r\n\r\n"
             )
+            last_seq = 0
+            while True:
+                event.clear()
+                latest = hub.latest(width)
+                if latest is None or latest[0] <= last_seq:
+                    await event.wait()
+                    continue
+
+                last_seq, jpeg = latest
+                sent = loop.time()
+                writer.write(
+                    b"--frame\r\nContent-Type: image/jpeg\r\n"
+                    b"Content-Length: %d\r\n\r\n" % len(jpeg)
+                )
+                writer.write(jpeg)
+                writer.write(b"\r\n")
+                # A slow client only holds up its own coroutine
+                await writer.drain()
+                # Lets the encoder notice clients the link can't keep fed
+                hub.report_send(loop.time() - sent)
+
+                delay = sent + min_interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        except ConnectionError:
+            pass
+        finally:
+            self._waiters[key].discard(event)
+            hub.unsubscribe(width, max_fps)
+
+    # --------------------------------------------------
+    # WebSocket event feed
+    # --------------------------------------------------
+
+    async def websocket_events(self, request, reader, writer, tank=None):
+        key = request.headers.get("sec-websocket-key")
+        if request.headers.get("upgrade", "").lower() != "websocket" or not key:
+            raise HttpError(400, "Expected a WebSocket upgrade")
+
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+        )
+        await writer.drain()
+
+        client = (asyncio.Queue(EVENT_QUEUE_SIZE), tank)
+        self._event_clients.add(client)
+        closed = asyncio.create_task(self._ws_read(reader, writer))
+        try:
+            while True:
+                get = asyncio.create_task(client[0].get())
+                done, _ = await asyncio.wait({get, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                    break
+                payload = json.dumps(get.result(), default=_json_default).encode()
+                writer.write(_ws_frame(payload))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._event_clients.discard(client)
+            closed.cancel()
+
+    async def _ws_read(self, reader, writer):
+        """Handle client control frames until the client closes."""
+        while True:
+            b0, b1 = await reader.readexactly(2)
+            opcode = b0 & 0x0F
+            n = b1 & 0x7F
+            if n == 126:
+                n = struct.unpack(">H", await reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack(">Q", await reader.readexactly(8))[0]
+            if n > MAX_BODY_BYTES:
+                return
+            mask = await reader.readexactly(4) if b1 & 0x80 else b"\0\0\0\0"
+            data = bytes(c ^ mask[i % 4] for i, c in enumerate(await reader.readexactly(n)))
+
+            if opcode == 0x8:      # close
+                writer.write(_ws_frame(data[:2], 0x8))
+                return
+            if opcode == 0x9:      # ping
+                writer.write(_ws_frame(data, 0xA))
+
+    # --------------------------------------------------
+    # Run
+    # --------------------------------------------------
+
+    async def _serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        self.host = host
+        server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES)
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self, host=config.SERVER_HOST, port=config.SERVER_PORT):
+        asyncio.run(self._serve(host, port))
+
+
+# ============================
+# Tank routes
+# ============================
+
+server = StreamServer()
+_tanks = {}
+
+
+def register_tank(tank):
+    """Serve a Tank's stream, stats, events and controls."""
+    _tanks[tank.name] = tank
+    server.add_stream(tank.stream)
+    tank.add_event_listener(server.publish_event)
+
+
+def _tank(name):
+    if name not in _tanks:
+        raise HttpError(404, f"No tank {name}")
+    return _tanks[name]
+
+
+@server.route("GET", "/")
+async def video_feed(request, reader, writer):
+    if not _tanks:
+        raise HttpError(404, "No tanks registered")
+    await server.mjpeg(request, writer, next(iter(_tanks.values())).stream)
+
+
+@server.route("GET", "/tank/<name>")
+async def tank_feed(request, reader, writer, name):
+    await server.mjpeg(request, writer, _tank(name).stream)
+
+
+@server.route("GET", "/tanks")
+async def tanks_status(request, reader, writer):
+    return {name: tank.stats() for name, tank in _tanks.items()}
+
+
+@server.route("GET", "/stats")
+async def experiment_stats(request, reader, writer):
+    return {name: tank.logger.summary() for name, tank in _tanks.items()}
+
+
+@server.route("GET", "/stats/<name>")
+async def tank_experiment_stats(request, reader, writer, name):
+    return _tank(name).logger.summary()
+
+
+@server.route("GET", "/events")
+async def events(request, reader, writer):
+    await server.websocket_events(request, reader, writer)
+
+
+@server.route("GET", "/tank/<name>/events")
+async def tank_events(request, reader, writer, name):
+    await server.websocket_events(request, reader, writer, tank=_tank(name).name)
+
+
+@server.route("GET", "/tank/<name>/schedule")
+async def get_schedule(request, reader, writer, name):
+    return _tank(name).schedule_info()
+
+
+@server.route("POST", "/tank/<name>/schedule")
+async def set_schedule(request, reader, writer, name):
+    tank = _tank(name)
+    body = request.json()
+    try:
+        interval = body.get("interval")
+        next_in = body.get("next_in")
+        return tank.set_schedule(
+            interval=None if interval is None else float(interval),
+            next_in=None if next_in is None else float(next_in),
+            protocol=body.get("protocol"),
+        )
+    except (TypeError, ValueError) as e:
+        raise HttpError(400, str(e))
+
+
+@server.route("POST", "/tank/<name>/trial/start")
+async def start_trial(request, reader, writer, name):
+    tank = _tank(name)
+    return {"changed": tank.start_trial(), **tank.schedule_info()}
+
+
+@server.route("POST", "/tank/<name>/trial/stop")
+async def stop_trial(request, reader, writer, name):
+    tank = _tank(name)
+    return {"changed": tank.stop_trial(), **tank.schedule_info()}
+
+
+@server.route("GET", "/metrics")
+async def metrics(request, reader, writer):
+    return tracer.metrics()
+
+
+@server.route("GET", "/trace")
+async def trace(request, reader, writer):
+    # Can be a few hundred thousand events; build it off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, tracer.chrome_trace)
+
+
+@server.route("POST", "/trace/start")
+async def start_trace(request, reader, writer):
+    tracer.enable()
+    return {"enabled": True}
 
-            # Network pacing (prevents client-side buffering)
-            time.sleep(0.03)  # ~30 FPS max
 
-    return Response(
-        generate(),
-        mimetype="multipart/x-mixed-replace; boundary=frame"
-    )
+@server.route("POST", "/trace/stop")
+async def stop_trace(request, reader, writer):
+    tracer.disable()
+    return {"enabled": False}
 
 
-def start_flask(host="0.0.0.0", port=5000):
-    # Single client → no threading needed
-    app.run(host=host, port=port, use_reloader=False)
+def start_server(host=config.SERVER_HOST, port=config.SERVER_PORT):
+    # Blocks; run it in its own thread next to the frame pipeline
+    server.serve_forever(host, port)
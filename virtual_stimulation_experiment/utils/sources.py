@@ -0,0 +1,185 @@
+# utils/sources.py
+import threading
+import time
+import cv2
+import numpy as np
+
+from utils.camera_stream import RingCamera, LiveCamera
+
+FISH_BGR = (10, 100, 230)  # inside config.ORANGE_LOW/HIGH once converted to HSV
+
+
+class SyntheticCamera(RingCamera):
+    """
+    Hardware-free camera that renders orange "fish" blobs on a noisy tank.
+
+    Fish sit still until they swim: either spontaneously (spontaneous_rate
+    bouts per second, seeded) or when trigger_swim() is called, e.g. from a
+    mock LED. Everything is driven by the frame index, so a given seed
+    produces the same frames and the same swim onsets on every run.
+
+    realtime=True paces frames at `framerate`; False renders as fast as
+    possible.
+    """
+
+    def __init__(
+        self,
+        resolution=(640, 360),
+        framerate=30,
+        blobs=1,
+        seed=0,
+        realtime=True,
+        spontaneous_rate=0.0,
+        swim_duration=1.5,
+        ring_slots=64,
+    ):
+        self.width, self.height = resolution
+        self.fps = framerate
+        self.realtime = realtime
+        self.spontaneous_rate = spontaneous_rate
+        self.swim_frames = int(swim_duration * framerate)
+
+        self._rng = np.random.default_rng(seed)
+        w, h = self.width, self.height
+
+        # Static tank texture + a few precomputed noise frames to cycle through
+        self._background = self._rng.integers(20, 60, (h, w, 3), dtype=np.uint8)
+        self._noise = self._rng.integers(0, 4, (8, h, w, 3), dtype=np.uint8)
+
+        r = max(4, min(w, h) // 18)
+        self._axes = (int(r * 1.6), r)
+        self._blobs = [
+            {
+                "pos": np.array([self._rng.uniform(2 * r, w - 2 * r), self._rng.uniform(2 * r, h - 2 * r)]),
+                "vel": self._rng.uniform(-1, 1, 2) * (w / framerate / 2),
+                "swim_until": -1,
+            }
+            for _ in range(blobs)
+        ]
+
+        self.frame_idx = 0
+        self.swim_onsets = []     # (frame index, capture time) of every bout start
+        self._pending = []        # frame indices at which to start a swim
+        self._lock = threading.Lock()
+        self._t0 = None
+
+        self._init_ring((h, w, 3), ring_slots)
+
+    def trigger_swim(self, delay=0.0):
+        """Make the fish start swimming `delay` seconds (of video time) from now."""
+        with self._lock:
+            self._pending.append(self.frame_idx + int(round(delay * self.fps)))
+
+    def _start_swim(self):
+        for blob in self._blobs:
+            blob["swim_until"] = self.frame_idx + self.swim_frames
+            # New heading each bout
+            blob["vel"] = self._rng.uniform(-1, 1, 2) * (self.width / self.fps / 2)
+        self.swim_onsets.append((self.frame_idx, time.time()))
+
+    def _read(self, slot):
+        if self.realtime:
+            if self._t0 is None:
+                self._t0 = time.perf_counter()
+            delay = self._t0 + self.frame_idx / self.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        with self._lock:
+            due = [p for p in self._pending if p <= self.frame_idx]
+            self._pending = [p for p in self._pending if p > self.frame_idx]
+
+        swimming = any(b["swim_until"] > self.frame_idx for b in self._blobs)
+        spontaneous = (
+            self.spontaneous_rate > 0
+            and self._rng.random() < self.spontaneous_rate / self.fps
+        )
+        if (due or spontaneous) and not swimming:
+            self._start_swim()
+
+        cv2.add(self._background, self._noise[self.frame_idx % len(self._noise)], dst=slot)
+
+        for blob in self._blobs:
+            if blob["swim_until"] > self.frame_idx:
+                blob["pos"] += blob["vel"]
+                for k, limit in ((0, self.width), (1, self.height)):
+                    if not self._axes[0] <= blob["pos"][k] <= limit - self._axes[0]:
+                        blob["vel"][k] *= -1
+                        blob["pos"][k] = np.clip(blob["pos"][k], self._axes[0], limit - self._axes[0])
+
+            center = (int(blob["pos"][0]), int(blob["pos"][1]))
+            cv2.ellipse(slot, center, self._axes, 0, 0, 360, FISH_BGR, -1)
+
+        self.frame_idx += 1
+        return slot
+
+
+class VideoFileCamera(RingCamera):
+    """
+    Replays a recording as if it were a live camera.
+
+    realtime=True paces frames at the file's FPS; False decodes as fast as
+    possible. At the end of the file it either loops or stops returning
+    frames.
+    """
+
+    def __init__(self, path, realtime=True, loop=False, ring_slots=64):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.finished = False
+
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"❌ Failed to open video file {path}")
+
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        self.frame_idx = 0
+        self._t0 = None
+
+        self._init_ring((self.height, self.width, 3), ring_slots)
+
+    def _read(self, slot):
+        if self.finished:
+            time.sleep(0.05)
+            return None
+
+        if self.realtime:
+            if self._t0 is None:
+                self._t0 = time.perf_counter()
+            delay = self._t0 + self.frame_idx / self.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        ok, frame = self.cap.read(slot)
+        if not ok and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read(slot)
+        if not ok:
+            self.finished = True
+            return None
+
+        self.frame_idx += 1
+        return frame
+
+    def _release(self):
+        self.cap.release()
+
+
+def make_camera(source="live", camera_index=1, resolution=(640, 360), ring_slots=64, **kwargs):
+    """
+    Build a frame source by name:
+        "live"      → LiveCamera (DirectShow webcam)
+        "synthetic" → SyntheticCamera (kwargs: framerate, blobs, seed, realtime, ...)
+        "video"     → VideoFileCamera (kwargs: path, realtime, loop)
+    """
+    if source == "live":
+        return LiveCamera(camera_index=camera_index, resolution=resolution, ring_slots=ring_slots)
+    if source == "synthetic":
+        return SyntheticCamera(resolution=resolution, ring_slots=ring_slots, **kwargs)
+    if source == "video":
+        return VideoFileCamera(ring_slots=ring_slots, **kwargs)
+    raise ValueError(f"Unknown camera source: {source}")
@@ -0,0 +1,212 @@
+# utils/stats.py
+"""
+Constant-memory streaming statistics for long sessions.
+
+    RunningStats   → count / mean / variance / min / max (Welford)
+    QuantileSketch → approximate quantiles with bounded relative error
+    RollingWindow  → the same numbers over the last N values
+
+RunningStats and QuantileSketch can be merged, e.g. to combine tanks or
+sessions.
+"""
+import math
+from collections import deque
+
+
+class RunningStats:
+    """Welford's online mean / variance."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def merge(self, other):
+        """Fold another RunningStats into this one (Chan et al.)."""
+        if other.count == 0:
+            return self
+        n = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / n
+        self.mean += delta * other.count / n
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """Sample variance (None below two values)."""
+        if self.count < 2:
+            return None
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        var = self.variance
+        return None if var is None else math.sqrt(var)
+
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch (DDSketch style) for non-negative values.
+
+    Any quantile is within `relative_accuracy` of the true value. Values
+    at or below `min_value` share one bucket. Memory is one counter per
+    occupied bucket — ~460 for 1 ms..10 s at 1 % — and never more than
+    `max_buckets`; beyond that the lowest buckets are folded together.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_buckets = max_buckets
+
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._gamma = gamma
+        self._log_gamma = math.log(gamma)
+
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, x):
+        return math.ceil(math.log(x) / self._log_gamma)
+
+    def _value(self, key):
+        # Midpoint (in relative terms) of bucket (gamma^(k-1), gamma^k]
+        return 2 * self._gamma ** key / (1 + self._gamma)
+
+    def add(self, x):
+        self.count += 1
+        if x <= self.min_value:
+            self.zero_count += 1
+            return
+
+        key = self._key(x)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self.buckets)
+        overflow = len(keys) - self.max_buckets
+        target = keys[overflow]
+        for k in keys[:overflow]:
+            self.buckets[target] += self.buckets.pop(k)
+
+    def merge(self, other):
+        """Fold another sketch with the same relative_accuracy into this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+        for k, c in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + c
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                return self._value(key)
+        return self._value(max(self.buckets))
+
+
+class RollingWindow:
+    """The last `size` values, with O(1) mean and exact quantiles over the window."""
+
+    def __init__(self, size=50):
+        self.values = deque(maxlen=size)
+        self._sum = 0.0
+
+    def add(self, x):
+        if len(self.values) == self.values.maxlen:
+            self._sum -= self.values[0]
+        self.values.append(x)
+        self._sum += x
+
+    @property
+    def count(self):
+        return len(self.values)
+
+    @property
+    def mean(self):
+        return self._sum / len(self.values) if self.values else None
+
+    def quantile(self, q):
+        # Sorting at most `size` values — cheap for the window sizes we use
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class StreamSummary:
+    """RunningStats + QuantileSketch + RollingWindow fed from one add()."""
+
+    def __init__(self, window=50, relative_accuracy=0.01):
+        self.total = RunningStats()
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.recent = RollingWindow(window)
+
+    def add(self, x):
+        self.total.add(x)
+        self.sketch.add(x)
+        self.recent.add(x)
+
+    @property
+    def count(self):
+        return self.total.count
+
+    def merge(self, other):
+        """Merge the all-time part; the rolling window stays this stream's own."""
+        self.total.merge(other.total)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def to_dict(self):
+        total = self.total
+        if total.count == 0:
+            return {"count": 0}
+
+        def q(p):
+            # The sketch rounds to bucket centers; never report outside the data
+            return min(max(self.sketch.quantile(p), total.min), total.max)
+
+        return {
+            "count": total.count,
+            "mean": total.mean,
+            "std": total.std,
+            "min": total.min,
+            "max": total.max,
+            "p50": q(0.5),
+            "p90": q(0.9),
+            "p99": q(0.99),
+            "recent": {
+                "count": self.recent.count,
+                "mean": self.recent.mean,
+                "p50": self.recent.quantile(0.5),
+            },
+        }
@@ -0,0 +1,249 @@
+# utils/streaming.py
+"""
+Encode-once JPEG fan-out for live preview streams.
+
+The producer (a tank's encoder stage) asks the hub which variants anyone
+is watching, encodes each of those once per frame and publishes the bytes.
+Clients (utils/server.py) are woken by a publish listener and send the
+newest frame, so nobody sleep-polls and nobody gets the same frame twice.
+publish() never waits for clients: a slow client just skips to the newest
+frame when it is ready again.
+
+PreviewEncoder is the producer side: it resizes and encodes each frame
+for the hub, adapting JPEG quality and resolution to a CPU budget and to
+how fast clients actually take frames.
+"""
+import threading
+import time
+
+import cv2
+
+import config
+
+# Weight of the newest sample in the per-hub send-time average
+SEND_TIME_ALPHA = 0.2
+
+
+class MjpegHub:
+    """
+    Latest JPEG per variant (output width, None = full resolution) plus
+    subscriber bookkeeping for one stream.
+    """
+
+    def __init__(self, name="stream", widths=(None,)):
+        self.name = name
+        # Allowed output widths; clients are mapped onto one of these so the
+        # number of encodes per frame stays bounded
+        self.widths = tuple(widths)
+
+        self._lock = threading.Lock()
+        self._latest = {}         # width → (seq, jpeg bytes)
+        self._subscribers = {}    # width → number of clients
+        self._rates = []          # requested fps per client, None = uncapped
+        self._listeners = []
+
+        self.published = 0
+        # Smoothed time clients need to take one frame off the socket
+        self.send_time = 0.0
+
+    # --------------------------------------------------
+    # Subscribers
+    # --------------------------------------------------
+
+    def variant(self, max_width=None):
+        """The allowed width a client asking for at most `max_width` gets."""
+        if max_width is None:
+            return None if None in self.widths else max(self.widths)
+
+        sized = sorted(w for w in self.widths if w is not None)
+        fitting = [w for w in sized if w <= max_width]
+        if fitting:
+            return fitting[-1]
+        return sized[0] if sized else None
+
+    def subscribe(self, max_width=None, max_fps=None):
+        width = self.variant(max_width)
+        with self._lock:
+            self._subscribers[width] = self._subscribers.get(width, 0) + 1
+            self._rates.append(max_fps)
+        return width
+
+    def unsubscribe(self, width, max_fps=None):
+        with self._lock:
+            if max_fps in self._rates:
+                self._rates.remove(max_fps)
+            n = self._subscribers.get(width, 0) - 1
+            if n > 0:
+                self._subscribers[width] = n
+            else:
+                self._subscribers.pop(width, None)
+                # Don't hand a stale frame to the next subscriber
+                self._latest.pop(width, None)
+
+    @property
+    def subscribers(self):
+        # Read by the frame loop while event-loop handlers (un)subscribe
+        with self._lock:
+            return sum(self._subscribers.values())
+
+    def active_widths(self):
+        """Widths with at least one subscriber — what the producer must encode."""
+        with self._lock:
+            return list(self._subscribers)
+
+    def max_fps(self):
+        """Highest frame rate any client asked for; None if someone is uncapped."""
+        with self._lock:
+            if not self._rates or None in self._rates:
+                return None
+            return max(self._rates)
+
+    def report_send(self, seconds):
+        """A client took `seconds` to take one frame (write + drain)."""
+        self.send_time += SEND_TIME_ALPHA * (seconds - self.send_time)
+
+    def add_listener(self, callback):
+        """callback(width, seq) after every publish, e.g. to wake an event loop."""
+        self._listeners.append(callback)
+
+    # --------------------------------------------------
+    # Producer / consumer
+    # --------------------------------------------------
+
+    def publish(self, width, seq, jpeg):
+        with self._lock:
+            self._latest[width] = (seq, jpeg)
+            self.published += 1
+        for callback in self._listeners:
+            callback(width, seq)
+
+    def latest(self, width):
+        with self._lock:
+            return self._latest.get(width)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "viewers": sum(self._subscribers.values()),
+                "variants": {str(w or "full"): n for w, n in self._subscribers.items()},
+                "published": self.published,
+                "send_ms": round(1000 * self.send_time, 2),
+            }
+
+
+class PreviewEncoder:
+    """
+    Resizes and JPEG-encodes preview frames into a hub, once per output size
+    in use, while keeping the encoder's share of one core under `cpu_budget`.
+
+    Every `adapt_interval` seconds it compares the time spent resizing and
+    encoding with the wall time. Over budget — or clients needing longer
+    than a frame interval to take a frame — lowers JPEG quality first, then
+    resolution; well under budget raises resolution first, then quality.
+    Frames beyond the fastest client's frame rate are skipped by due()
+    before any work is done.
+    """
+
+    def __init__(
+        self,
+        hub,
+        cpu_budget=config.STREAM_CPU_BUDGET,
+        quality=config.STREAM_JPEG_QUALITY,
+        min_quality=config.STREAM_MIN_QUALITY,
+        min_scale=config.STREAM_MIN_SCALE,
+        adapt_interval=1.0,
+    ):
+        self.hub = hub
+        self.cpu_budget = cpu_budget
+        self.max_quality = quality
+        self.min_quality = min_quality
+        self.min_scale = min_scale
+        self.adapt_interval = adapt_interval
+
+        self.quality = quality
+        self.scale = 1.0
+
+        self.encoded = 0
+        self.skipped = 0
+        self.cpu_share = 0.0
+        self.encode_time = 0.0      # seconds per encoded frame (last window)
+
+        self._last_due = 0.0
+        self._window_start = time.monotonic()
+        self._window_busy = 0.0
+        self._window_frames = 0
+
+    def due(self, t):
+        """Whether the frame captured at `t` is needed by any client."""
+        fps = self.hub.max_fps()
+        # 20 % slack so capture jitter doesn't halve the delivered rate
+        if fps and t - self._last_due < 0.8 / fps:
+            self.skipped += 1
+            return False
+        self._last_due = t
+        return True
+
+    def encode(self, seq, image):
+        """Publish `image` (BGR) for every width with subscribers."""
+        t0 = time.perf_counter()
+        h, w = image.shape[:2]
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)]
+
+        # Widths that land on the same output size share one encode
+        encoded = {}
+        for width in self.hub.active_widths():
+            target = w if width is None else min(width, w)
+            target = max(16, int(target * self.scale))
+            jpeg = encoded.get(target)
+            if jpeg is None:
+                resized = image
+                if target < w:
+                    resized = cv2.resize(
+                        image, (target, max(1, h * target // w)), interpolation=cv2.INTER_AREA
+                    )
+                ret, buffer = cv2.imencode(".jpg", resized, params)
+                if not ret:
+                    continue
+                jpeg = encoded[target] = buffer.tobytes()
+            self.hub.publish(width, seq, jpeg)
+
+        self._window_busy += time.perf_counter() - t0
+        self._window_frames += 1
+        self.encoded += 1
+        self._adapt()
+
+    def _adapt(self):
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.adapt_interval:
+            return
+
+        self.cpu_share = self._window_busy / elapsed
+        self.encode_time = self._window_busy / max(self._window_frames, 1)
+        self._window_start = now
+        self._window_busy = 0.0
+        self._window_frames = 0
+
+        fps = self.hub.max_fps() or config.STREAM_MAX_FPS
+        link_limited = self.hub.send_time > 1.0 / fps
+
+        if self.cpu_share > self.cpu_budget or link_limited:
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - 10)
+            else:
+                self.scale = max(self.min_scale, self.scale * 0.8)
+        elif self.cpu_share < 0.5 * self.cpu_budget:
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale / 0.8)
+            else:
+                self.quality = min(self.max_quality, self.quality + 5)
+
+    def stats(self):
+        return {
+            "quality": self.quality,
+            "scale": round(self.scale, 3),
+            "cpu_share": round(self.cpu_share, 3),
+            "encode_ms": round(1000 * self.encode_time, 2),
+            "encoded": self.encoded,
+            "skipped": self.skipped,
+        }
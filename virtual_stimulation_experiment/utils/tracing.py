@@ -0,0 +1,170 @@
+# utils/tracing.py
+"""
+Per-frame latency tracing: camera read → detection sub-stages → behavior
+→ stimulus trigger.
+
+Trace points record spans (name, start, duration, frame) with
+time.perf_counter(), which is monotonic. Every span name also gets an
+in-memory histogram (count / mean / p50 / p95 / p99 / max). The raw spans
+are kept in a bounded buffer and can be dumped as a Chrome trace
+(chrome://tracing, ui.perfetto.dev).
+
+    from utils.tracing import tracer
+
+    tr = tracer.begin("detect", seq)   # no-op object when tracing is off
+    ...
+    tr.mark("resize")                  # span since begin() / the last mark
+    tracer.record("stimulus", t0, t1, seq)
+
+With tracing off a trace point costs one attribute check or a call to an
+empty method.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import config
+from utils.stats import RunningStats, QuantileSketch
+
+
+class _NullTrace:
+    __slots__ = ()
+
+    def mark(self, name):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class FrameTrace:
+    """Back-to-back spans of one frame on one thread: each mark() closes one."""
+
+    __slots__ = ("tracer", "prefix", "frame", "_last")
+
+    def __init__(self, tracer, prefix, frame=None, start=None):
+        self.tracer = tracer
+        self.prefix = prefix
+        self.frame = frame
+        self._last = time.perf_counter() if start is None else start
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.tracer.record(f"{self.prefix}.{name}", self._last, now, self.frame)
+        self._last = now
+
+
+class Tracer:
+    """Span buffer plus one latency histogram per span name."""
+
+    def __init__(self, enabled=config.TRACE_ENABLED, max_events=config.TRACE_MAX_EVENTS):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+
+        self._lock = threading.Lock()
+        self._histograms = {}    # name → (RunningStats, QuantileSketch)
+        self._threads = {}       # thread id → name, for the trace viewer
+
+        # perf_counter has no fixed epoch; keep one wall-clock reference
+        self.origin = time.perf_counter()
+        self.origin_wall = time.time()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+            self._histograms.clear()
+
+    # --------------------------------------------------
+    # Recording
+    # --------------------------------------------------
+
+    def begin(self, prefix, frame=None, start=None):
+        if not self.enabled:
+            return NULL_TRACE
+        return FrameTrace(self, prefix, frame, start)
+
+    def record(self, name, start, end, frame=None):
+        if not self.enabled:
+            return
+
+        thread = threading.current_thread()
+        duration = end - start
+        with self._lock:
+            self.events.append((name, start, duration, frame, thread.ident))
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = thread.name
+
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = (RunningStats(), QuantileSketch())
+            hist[0].add(duration)
+            hist[1].add(duration)
+
+    # --------------------------------------------------
+    # Output
+    # --------------------------------------------------
+
+    def metrics(self):
+        """{span name: count, mean / p50 / p95 / p99 / max in ms}."""
+        with self._lock:
+            out = {}
+            for name, (stats, sketch) in sorted(self._histograms.items()):
+
+                def q(p):
+                    # Bucket centers can overshoot the data; clamp like StreamSummary
+                    return 1000 * min(max(sketch.quantile(p), stats.min), stats.max)
+
+                out[name] = {
+                    "count": stats.count,
+                    "mean_ms": round(1000 * stats.mean, 3),
+                    "p50_ms": round(q(0.5), 3),
+                    "p95_ms": round(q(0.95), 3),
+                    "p99_ms": round(q(0.99), 3),
+                    "max_ms": round(1000 * stats.max, 3),
+                }
+            return {"enabled": self.enabled, "spans": out}
+
+    def chrome_trace(self):
+        """The span buffer in Chrome trace event format (times in µs)."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+
+        trace = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in threads.items()
+        ]
+        for name, start, duration, frame, tid in events:
+            trace.append({
+                "name": name,
+                "cat": name.split(".", 1)[0],
+                "ph": "X",
+                "ts": round((start - self.origin) * 1e6, 1),
+                "dur": round(duration * 1e6, 1),
+                "pid": pid,
+                "tid": tid,
+                "args": {} if frame is None else {"frame": frame},
+            })
+        return {
+            "traceEvents": trace,
+            "displayTimeUnit": "ms",
+            "otherData": {"origin_wall_time": self.origin_wall},
+        }
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+
+# One tracer per process
+tracer = Tracer()